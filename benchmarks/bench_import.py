@@ -0,0 +1,75 @@
+"""
+Micro-benchmark: startup time of `s3w` and of the worker modules.
+
+Every measurement runs in a fresh interpreter (as a k8s probe or a cron
+job would), the median of `--repeat` runs is reported together with the
+heavy third party packages the import pulled in. For a per module
+breakdown use `python -X importtime -c "import s3worker.cli.s3w"`.
+
+Importing `s3worker` requires the usual `PM_*` environment variables.
+
+    uv run python benchmarks/bench_import.py --repeat 10
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY = ("boto3", "sqlalchemy", "celery", "redis", "pdf2image", "pypdfium2")
+
+SCENARIOS = {
+    "import s3worker": "import s3worker",
+    "import s3worker.cli.s3w": "import s3worker.cli.s3w",
+    "s3w --help": (
+        "from s3worker.cli.s3w import app\n"
+        "try:\n"
+        "    app(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass"
+    ),
+    "import s3worker.tasks": "import s3worker.tasks",
+}
+
+
+def run(code: str) -> tuple[float, list[str]]:
+    """Runs `code` in a new interpreter, returns elapsed seconds and
+    heavy packages it imported"""
+    probe = (
+        f"{code}\n"
+        "import sys\n"
+        f"print('imported:' + ','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    )
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", probe],
+        capture_output=True, text=True, check=True,
+    )
+    elapsed = time.perf_counter() - started
+    modules = result.stdout.rsplit("imported:", 1)[1].strip()
+
+    return elapsed, [m for m in modules.split(",") if m]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # interpreter startup itself, to be subtracted mentally
+    baseline = statistics.median(run("pass")[0] for _ in range(args.repeat))
+    print(f"{'python -c pass':<26} {baseline * 1000:>8.0f} ms")
+
+    for name, code in SCENARIOS.items():
+        timings = []
+        for _ in range(args.repeat):
+            elapsed, modules = run(code)
+            timings.append(elapsed)
+        print(
+            f"{name:<26} {statistics.median(timings) * 1000:>8.0f} ms  "
+            f"imports: {', '.join(modules) or '-'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
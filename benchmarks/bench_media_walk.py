@@ -0,0 +1,95 @@
+"""
+Micro-benchmark: `walk.iter_media` vs. the former glob based `media_iter`.
+
+Generates a synthetic media tree (docvers, thumbnails and OCR pages
+sharded by UUID) in a temporary folder and times a full walk with both
+implementations.
+
+Importing `s3worker` requires the usual `PM_*` environment variables.
+
+    uv run python benchmarks/bench_media_walk.py --docs 20000
+"""
+import argparse
+import logging
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from s3worker import walk
+
+logger = logging.getLogger(__name__)
+
+
+def legacy_media_iter(media_root: str, prefix: Path = Path('')):
+    """`client.media_iter()` as it was before `walk.iter_media`"""
+    paths = Path(media_root).glob("**/*")
+    logger.debug(f"PREFIX={prefix}")
+    for path in paths:
+        if path.is_file():
+            str_path = str(path)
+            str_media = str(media_root)
+            str_rel_path = str_path[len(str_media) + 1:]
+            keyname = prefix / Path(str_rel_path)
+            logger.debug(f"str_path={str_path}")
+            logger.debug(f"str_media={str_media}")
+            logger.debug(f"str_rel_path={str_rel_path}")
+            logger.debug(f"keyname={keyname}")
+            logger.debug(f"path={path}")
+            yield path, keyname
+
+
+def make_tree(root: Path, docs: int, pages: int):
+    def sharded(base: Path, uid: str) -> Path:
+        path = base / uid[0:2] / uid[2:4] / uid
+        path.mkdir(parents=True)
+        return path
+
+    for _ in range(docs):
+        doc_id, ver_id = str(uuid.uuid4()), str(uuid.uuid4())
+        (sharded(root / "docvers", ver_id) / "doc.pdf").write_bytes(b"%PDF" * 64)
+        (sharded(root / "thumbnails" / "jpg", doc_id) / "sm.jpg").write_bytes(b"\xff" * 32)
+        for _ in range(pages):
+            page_dir = sharded(root / "ocr" / "pages", str(uuid.uuid4()))
+            (page_dir / "page.txt").write_text("text")
+            (page_dir / "page.hocr").write_text("<hocr/>")
+
+
+def timeit(func, repeat: int) -> tuple[float, int]:
+    best, count = float("inf"), 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        count = sum(1 for _ in func())
+        best = min(best, time.perf_counter() - started)
+
+    return best, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--docs", type=int, default=5000)
+    parser.add_argument("--pages", type=int, default=2, help="pages per document")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        make_tree(root, args.docs, args.pages)
+
+        legacy, legacy_count = timeit(
+            lambda: legacy_media_iter(tmp), args.repeat
+        )
+        scandir, scandir_count = timeit(
+            lambda: walk.iter_media(tmp, max_workers=args.workers), args.repeat
+        )
+
+    assert legacy_count == scandir_count, (legacy_count, scandir_count)
+    print(f"files: {scandir_count}")
+    print(f"glob media_iter:  {legacy:.3f}s ({legacy_count / legacy:.0f} files/s)")
+    print(f"walk.iter_media:  {scandir:.3f}s ({scandir_count / scandir:.0f} files/s)")
+    print(f"speedup: {legacy / scandir:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark: PDF rendering backends (`pm_pdf_renderer`).
+
+Renders page previews in all sizes (sm/md/lg/xl, as
+`s3_worker_generate_page_image` does) of every PDF in a corpus with each
+backend. Without `--corpus`, a synthetic corpus of scanned-like
+documents is generated.
+
+Importing `s3worker` requires the usual `PM_*` environment variables.
+
+    uv run --extra pdfium python benchmarks/bench_render.py --docs 20 --pages 5
+    uv run --extra pdfium python benchmarks/bench_render.py --corpus ~/samples
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from s3worker import image
+from s3worker.config import PdfRenderer
+from s3worker.generate import PAGE_PREVIEW_SIZES
+
+
+def make_corpus(folder: Path, docs: int, pages: int) -> list[Path]:
+    """Generates PDFs of A4 pages (150 dpi) with random "text" lines"""
+    rnd = random.Random(0)
+    result = []
+    for doc in range(docs):
+        imgs = []
+        for _ in range(pages):
+            img = Image.new("L", (1240, 1754), "white")
+            draw = ImageDraw.Draw(img)
+            for y in range(100, 1650, 40):
+                x = 100
+                while x < 1100:
+                    width = rnd.randint(20, 120)
+                    draw.rectangle((x, y, x + width, y + 18), fill=rnd.randint(0, 80))
+                    x += width + 15
+            imgs.append(img)
+        path = folder / f"doc-{doc}.pdf"
+        imgs[0].save(path, save_all=True, append_images=imgs[1:], resolution=150)
+        result.append(path)
+
+    return result
+
+
+def bench(renderer: PdfRenderer, pdfs: list[Path], max_pages: int) -> tuple[float, int]:
+    sizes = {size.value: px for size, px in PAGE_PREVIEW_SIZES.items()}
+    count = 0
+    started = time.perf_counter()
+    for pdf_path in pdfs:
+        with image.open_pdf(pdf_path, renderer=renderer) as doc:
+            for page_number in range(1, max_pages + 1):
+                try:
+                    image.generate_page_previews(doc, page_number, sizes)
+                except (IndexError, ValueError):
+                    break  # document has fewer pages
+                count += 1
+
+    return time.perf_counter() - started, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", type=Path, help="folder with sample PDFs")
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=3, help="pages per document")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.corpus:
+            pdfs = sorted(args.corpus.glob("*.pdf"))
+        else:
+            pdfs = make_corpus(Path(tmp), args.docs, args.pages)
+
+        print(f"{len(pdfs)} PDFs, up to {args.pages} pages each")
+        for renderer in PdfRenderer:
+            try:
+                elapsed, count = bench(renderer, pdfs, args.pages)
+            except Exception as ex:
+                print(f"{renderer.value:>10}: unavailable ({ex})")
+                continue
+            print(
+                f"{renderer.value:>10}: {count} pages in {elapsed:.2f}s "
+                f"({count / elapsed:.1f} pages/s)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark: upload/download throughput across file sizes.
+
+Compares boto3 default transfer settings with the ones configured via
+`PM_TRANSFER_*` settings (i.e. `client.get_transfer_config()`) against a
+local S3 stand-in (moto server), so it runs without network access.
+
+    uv run --group bench python benchmarks/bench_transfer.py --sizes 1,8,64
+"""
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from moto_env import setup_env, start_server
+
+MB = 1024 * 1024
+
+
+def throughput(func, size: int, repeat: int) -> float:
+    """Returns best throughput in MB/s"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+
+    return size / MB / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="1,8,32,128", help="file sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+
+    server = start_server(args.port)
+    tmp = tempfile.TemporaryDirectory()
+    setup_env(args.port, tmp.name)
+
+    from boto3.s3.transfer import TransferConfig
+    from s3worker import client
+
+    s3 = client.get_client()
+    bucket = client.get_bucket_name()
+    s3.create_bucket(Bucket=bucket)
+    configs = {
+        "boto3 default": TransferConfig(),
+        "configured": client.get_transfer_config(),
+    }
+
+    print(f"{'size':>8} {'config':>14} {'upload MB/s':>12} {'download MB/s':>14}")
+    try:
+        for size_mb in (int(size) for size in args.sizes.split(",")):
+            size = size_mb * MB
+            src = Path(tmp.name, f"{size_mb}.bin")
+            dst = Path(tmp.name, f"{size_mb}.out")
+            src.write_bytes(os.urandom(size))
+            key = f"bench/{size_mb}.bin"
+            for name, config in configs.items():
+                upload = throughput(
+                    lambda: s3.upload_file(str(src), bucket, key, Config=config),
+                    size,
+                    args.repeat
+                )
+                download = throughput(
+                    lambda: s3.download_file(bucket, key, str(dst), Config=config),
+                    size,
+                    args.repeat
+                )
+                print(f"{size_mb:>6}MB {name:>14} {upload:>12.1f} {download:>14.1f}")
+    finally:
+        server.stop()
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Compares two result files of `benchmarks/suite.py`.
+
+Prints every metric of both runs and the relative change. Changes worse
+than `--threshold` percent are flagged; exit code is 1 if there are any.
+
+    python benchmarks/compare.py before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# metrics for which higher values are better; for the rest lower is better
+HIGHER_IS_BETTER = ("per_sec",)
+# counts describing the workload rather than performance
+IGNORED = ("count", "files", "objects", "failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("before", type=Path)
+    parser.add_argument("after", type=Path)
+    parser.add_argument("--threshold", type=float, default=10, help="percent")
+    args = parser.parse_args()
+
+    before = json.loads(args.before.read_text())["results"]
+    after = json.loads(args.after.read_text())["results"]
+
+    regressions = 0
+    print(f"{'metric':<36} {'before':>12} {'after':>12} {'change':>9}")
+    for scenario, metrics in before.items():
+        for name, old in metrics.items():
+            new = after.get(scenario, {}).get(name)
+            if name in IGNORED or new is None or not old:
+                continue
+
+            change = (new - old) / old * 100
+            if any(suffix in name for suffix in HIGHER_IS_BETTER):
+                worse = change < -args.threshold
+            else:
+                worse = change > args.threshold
+            regressions += worse
+            flag = "  <-- regression" if worse else ""
+            print(
+                f"{scenario + '.' + name:<36} {old:>12.2f} {new:>12.2f} "
+                f"{change:>+8.1f}%{flag}"
+            )
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Benchmark suite: end-to-end throughput and latency of the worker hot paths.
+
+Runs without network access against a local S3 stand-in (moto server).
+A synthetic media root (document versions as real PDFs, thumbnails and
+OCR page files, all sharded by UUID) is generated in a temporary folder
+and the following scenarios are measured, in this order:
+
+- sync          `client.sync()` of the whole media root into an empty
+                bucket, then again with nothing to upload (manifest)
+- delete        bulk delete of all document versions and page previews
+- add_doc_vers  `client.add_doc_vers()` of all document versions
+- download      `client.download_docver()` of every document version,
+                local copies removed first
+- thumbnails    `generate.store_doc_thumbnail()` of every document
+
+With `--db`, documents are also inserted into the database of `PM_DB_URL`
+and the thumbnails scenario iterates them with `db.iter_docs_last_version()`.
+The database must be a throwaway one: tables are created and dropped
+(as in tests).
+
+Results are written as JSON (`--output`), compare two runs with
+`benchmarks/compare.py`.
+
+    uv run --group bench --extra pdfium python benchmarks/suite.py \\
+        --docs 200 --renderer pdfium --output before.json
+"""
+import argparse
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+from moto_env import setup_env, start_server
+
+
+def make_media(media_root: Path, docs: int, pages: int, pdf: bytes) -> list:
+    """Generates media root with `docs` documents of `pages` pages each
+
+    Every document has one version (a copy of `pdf`), a thumbnail and
+    per page OCR files and preview images. Returns `DocLastVersion`
+    records of the documents.
+    """
+    from s3worker import plib
+    from s3worker.types import DocLastVersion, ImagePreviewSize
+
+    rnd = random.Random(0)
+    result = []
+    for _ in range(docs):
+        doc = DocLastVersion(uuid.uuid4(), uuid.uuid4(), "document.pdf")
+        docver = plib.abs_docver_path(doc.doc_ver_id, doc.file_name)
+        docver.parent.mkdir(parents=True)
+        docver.write_bytes(pdf)
+        _write(plib.rel2abs(plib.thumbnail_path(doc.doc_id)), rnd.randbytes(4000))
+        for _ in range(pages):
+            page_id = uuid.uuid4()
+            _write(plib.abs_page_txt_path(page_id), rnd.randbytes(2000))
+            _write(plib.abs_page_hocr_path(page_id), rnd.randbytes(20000))
+            for size in ImagePreviewSize:
+                _write(
+                    plib.rel2abs(plib.thumbnail_path(page_id, size)),
+                    rnd.randbytes(10000)
+                )
+        result.append(doc)
+
+    return result
+
+
+def _write(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+def latency(durations: list[float]) -> dict:
+    """Summary of per-item durations (milliseconds) and throughput"""
+    total = sum(durations)
+    ordered = sorted(durations)
+    return {
+        "count": len(durations),
+        "items_per_sec": len(durations) / total if total else 0,
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[int(len(ordered) * 0.95) - 1] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def timed(func, *args) -> float:
+    started = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - started
+
+
+def bench_sync(client) -> dict:
+    cold = client.sync()
+    warm = client.sync()
+    return {
+        "files": cold.files_total,
+        "files_per_sec": cold.files_per_sec,
+        "mb_per_sec": cold.mb_per_sec,
+        "elapsed": cold.elapsed,
+        "unchanged_elapsed": warm.elapsed,
+    }
+
+
+def bench_delete(client, docs: list) -> dict:
+    objects = sum(1 for _ in client.list_objects(client._key_prefix()))
+    started = time.perf_counter()
+    client.remove_doc_vers([str(doc.doc_ver_id) for doc in docs])
+    # everything else (thumbnails, page previews, OCR) in one go
+    client.remove_prefixes([client._key_prefix()])
+    elapsed = time.perf_counter() - started
+    return {
+        "objects": objects,
+        "objects_per_sec": objects / elapsed,
+        "elapsed": elapsed,
+    }
+
+
+def bench_add_doc_vers(client, docs: list) -> dict:
+    ids = [str(doc.doc_ver_id) for doc in docs]
+    started = time.perf_counter()
+    result = client.add_doc_vers(ids)
+    elapsed = time.perf_counter() - started
+    return {
+        "count": len(ids),
+        "failed": sum(1 for status in result.values() if status != "uploaded"),
+        "items_per_sec": len(ids) / elapsed,
+        "elapsed": elapsed,
+    }
+
+
+def bench_download(client, plib, docs: list) -> dict:
+    durations = []
+    for doc in docs:
+        plib.abs_docver_path(doc.doc_ver_id, doc.file_name).unlink()
+        durations.append(
+            timed(client.download_docver, doc.doc_ver_id, doc.file_name)
+        )
+
+    return latency(durations)
+
+
+def bench_thumbnails(generate, docs) -> dict:
+    durations = []
+    for doc in docs:
+        durations.append(timed(generate.store_doc_thumbnail, doc))
+
+    return latency(durations)
+
+
+def insert_docs(docs: list):
+    """Inserts user, home folder and `docs` into the database"""
+    from s3worker.db import orm
+    from s3worker.db.base import Base
+    from s3worker.db.engine import Session, get_engine
+
+    Base.metadata.create_all(get_engine())
+    user_id, home_id = uuid.uuid4(), uuid.uuid4()
+    with Session() as db_session:
+        db_session.add(orm.User(
+            id=user_id, username="bench", email="bench@example.com",
+            first_name="bench", last_name="bench", password="bench",
+        ))
+        db_session.add(orm.Folder(
+            id=home_id, title="home", ctype="folder", lang="en",
+            user_id=user_id,
+        ))
+        db_session.commit()
+        for doc in docs:
+            db_doc = orm.Document(
+                id=doc.doc_id, ctype="document", title=str(doc.doc_id),
+                user_id=user_id, parent_id=home_id, lang="en",
+            )
+            db_session.add(db_doc)
+            db_session.add(orm.DocumentVersion(
+                id=doc.doc_ver_id, document=db_doc, number=1,
+                file_name=doc.file_name,
+            ))
+        db_session.commit()
+
+
+def drop_tables():
+    from s3worker.db.base import Base
+    from s3worker.db.engine import get_engine
+
+    Base.metadata.drop_all(get_engine())
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=3, help="pages per document")
+    parser.add_argument("--renderer", help="pdftoppm or pdfium (default: PM_PDF_RENDERER)")
+    parser.add_argument("--db", action="store_true", help="use database of PM_DB_URL (throwaway!)")
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    args = parser.parse_args()
+
+    server = start_server(args.port)
+    tmp = tempfile.TemporaryDirectory()
+    media_root = Path(tmp.name, "media")
+    media_root.mkdir()
+    setup_env(args.port, str(media_root), args.renderer)
+
+    from bench_render import make_corpus
+
+    from s3worker import client, config, db, generate, plib
+    from s3worker.db.engine import Session
+
+    settings = config.get_settings()
+    client.get_client().create_bucket(Bucket=client.get_bucket_name())
+    pdf = make_corpus(Path(tmp.name), 1, args.pages)[0].read_bytes()
+    docs = make_media(media_root, args.docs, args.pages, pdf)
+
+    results = {}
+    try:
+        print("sync...")
+        results["sync"] = bench_sync(client)
+        print("delete...")
+        results["delete"] = bench_delete(client, docs)
+        print("add_doc_vers...")
+        results["add_doc_vers"] = bench_add_doc_vers(client, docs)
+        print("download...")
+        results["download"] = bench_download(client, plib, docs)
+        print("thumbnails...")
+        if args.db:
+            insert_docs(docs)
+            with Session() as db_session:
+                started = time.perf_counter()
+                db_docs = list(db.iter_docs_last_version(db_session))
+                results["docs_iter"] = {
+                    "count": len(db_docs),
+                    "elapsed": time.perf_counter() - started,
+                }
+            docs = db_docs
+        results["thumbnails"] = bench_thumbnails(generate, docs)
+    finally:
+        if args.db:
+            drop_tables()
+        server.stop()
+        shutil.rmtree(tmp.name, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "docs": args.docs,
+            "pages": args.pages,
+            "pdf_renderer": settings.pm_pdf_renderer.value,
+            "pdf_size": len(pdf),
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
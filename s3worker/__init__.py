@@ -1,5 +1,19 @@
-from .celery_app import app as celery_app
-from . import client, utils, schemas, plib, db
+import importlib
 
 __all__ = ['celery_app', 'client', 'utils', 'schemas', 'plib', 'db']
 
+
+def __getattr__(name: str):
+    # submodules are imported on first access, so that e.g. importing
+    # `s3worker.plib` does not import Celery, boto3 and SQLAlchemy
+    if name == 'celery_app':
+        from .celery_app import app
+        # importing the submodule bound its name to the module; the
+        # package attribute is the Celery app (as it always was)
+        globals()['celery_app'] = app
+        return app
+
+    if name in __all__:
+        return importlib.import_module(f'.{name}', __name__)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,327 @@
+"""
+Asyncio storage engine for high fan-out bulk operations.
+
+Bulk operations on many small objects (sync of thumbnails and OCR files,
+bulk deletes, existence checks) are bound by request latency, and the
+thread pools of `s3worker.client` keep a few dozen requests in flight
+at most. Here the same operations run on one event loop with an
+aiobotocore client: up to `pm_aio_max_concurrency` requests are in
+flight at once, bounded by one semaphore shared by all of them. Bulk
+operations run a fixed number of consumer coroutines (not one task per
+file), so memory does not grow with the number of files; bodies of
+uploads in flight add up to `pm_aio_max_upload_bytes` at most.
+
+Requires aiobotocore (pip install 's3worker[aio]'). Used by bulk
+operations of `s3worker.client` when `pm_storage_engine` is `asyncio`,
+or with `--engine asyncio` of `s3w sync`, `s3w delete` and
+`s3w remove-doc-vers`.
+
+The plain (non-async) functions at the bottom are entry points for
+synchronous code; each runs its own event loop, so they must not be
+called from within a running one.
+"""
+import asyncio
+import logging
+from contextlib import AsyncExitStack, asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Iterable, TypeVar
+
+from botocore.exceptions import ClientError
+
+from s3worker import client, config, metrics
+from s3worker.types import DeleteError, RemoteObject
+
+settings = config.get_settings()
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class ByteBudget:
+    """Limits total size of request bodies held in memory at once
+
+    A body larger than the whole budget waits until no other one is in
+    flight, then goes alone.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self._changed = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int) -> AsyncIterator[None]:
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: self.in_flight == 0
+                or self.in_flight + size <= self.max_bytes
+            )
+            self.in_flight += size
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.in_flight -= size
+                self._changed.notify_all()
+
+
+class AsyncStorage:
+    """S3/R2 bucket accessed with an aiobotocore client
+
+    All requests share one semaphore of `max_concurrency` slots. Use as
+    async context manager:
+
+        async with AsyncStorage() as storage:
+            await storage.upload(path, keyname)
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int | None = None,
+        max_upload_bytes: int | None = None
+    ):
+        if max_concurrency is None:
+            max_concurrency = settings.pm_aio_max_concurrency
+        if max_upload_bytes is None:
+            max_upload_bytes = settings.pm_aio_max_upload_bytes
+
+        self.max_concurrency = max_concurrency
+        self.bucket_name = client.get_bucket_name()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._upload_budget = ByteBudget(max_upload_bytes)
+        self._exit_stack = AsyncExitStack()
+        self._client = None
+
+    async def __aenter__(self) -> "AsyncStorage":
+        try:
+            from aiobotocore.config import AioConfig
+            from aiobotocore.session import get_session
+        except ImportError as ex:
+            raise RuntimeError(
+                "asyncio storage engine requires aiobotocore: "
+                "pip install 's3worker[aio]'"
+            ) from ex
+
+        options = client.config_options()
+        # one connection per request in flight
+        options['max_pool_connections'] = self.max_concurrency
+        self._client = await self._exit_stack.enter_async_context(
+            get_session().create_client(
+                's3',
+                config=AioConfig(**options),
+                **client.client_options()
+            )
+        )
+        metrics.instrument_s3_client(self._client)
+
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._exit_stack.aclose()
+        self._client = None
+
+    async def upload(self, path: Path, keyname: str):
+        """Uploads local file `path` as `keyname`
+
+        Files below the multipart threshold are read into memory (within
+        the upload byte budget) and sent with one `put_object` request;
+        larger ones are handed over to boto3 transfer manager (in a
+        thread), which uploads their parts concurrently.
+        """
+        size = path.stat().st_size
+        if size >= settings.pm_transfer_multipart_threshold:
+            async with self._semaphore:
+                await asyncio.to_thread(
+                    client.get_client().upload_file,
+                    str(path),
+                    Bucket=self.bucket_name,
+                    Key=keyname,
+                    Config=client.get_transfer_config()
+                )
+            return
+
+        # budget first: waiting for it must not take a request slot
+        async with self._upload_budget.reserve(size), self._semaphore:
+            body = await asyncio.to_thread(path.read_bytes)
+            await self._client.put_object(
+                Bucket=self.bucket_name,
+                Key=keyname,
+                Body=body
+            )
+
+    async def head(self, keyname: str) -> RemoteObject | None:
+        """Returns object `keyname`, None if it is not in the bucket"""
+        async with self._semaphore:
+            try:
+                response = await self._client.head_object(
+                    Bucket=self.bucket_name, Key=keyname
+                )
+            except ClientError as ex:
+                if client.error_code(ex) in ('404', 'NoSuchKey', 'NotFound'):
+                    return None
+                raise
+
+        return RemoteObject(
+            key=keyname,
+            size=response['ContentLength'],
+            etag=response['ETag'].strip('"'),
+            last_modified=response['LastModified'].timestamp(),
+        )
+
+    async def list_objects(self, prefix: str) -> AsyncIterator[RemoteObject]:
+        """Yields all objects whose key starts with `prefix`
+
+        Each page (up to 1000 keys) is one request, taking one slot.
+        """
+        paginator = self._client.get_paginator('list_objects_v2')
+        pages = aiter(paginator.paginate(Bucket=self.bucket_name, Prefix=prefix))
+        while True:
+            async with self._semaphore:
+                page = await anext(pages, None)
+            if page is None:
+                return
+
+            for item in page.get('Contents', []):
+                yield RemoteObject(
+                    key=item['Key'],
+                    size=item['Size'],
+                    etag=item['ETag'].strip('"'),
+                    last_modified=item['LastModified'].timestamp(),
+                )
+
+    async def delete_batch(self, keynames: list[str]) -> list[DeleteError]:
+        """Deletes up to 1000 keys with one `delete_objects` request
+
+        Returns per-key errors; if the whole request fails, every key of
+        the batch is reported.
+        """
+        async with self._semaphore:
+            try:
+                response = await self._client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={
+                        'Objects': [{'Key': k} for k in keynames],
+                        # response lists only keys which failed to be deleted
+                        'Quiet': True
+                    }
+                )
+            except Exception as ex:
+                code = client.error_code(ex)
+                return [DeleteError(key, code, str(ex)) for key in keynames]
+
+        return [
+            DeleteError(item.get('Key'), item.get('Code'), item.get('Message'))
+            for item in response.get('Errors', [])
+        ]
+
+    async def delete_keys(self, keynames: list[str]) -> list[DeleteError]:
+        """Deletes `keynames` in concurrent batches of (at most) 1000 keys"""
+        results = await map_bounded(
+            self.delete_batch,
+            list(client.delete_batches(keynames)),
+            self.max_concurrency
+        )
+
+        return [error for errors in results for error in errors]
+
+
+async def map_bounded(
+    func: Callable[[T], Awaitable[R]],
+    items: list[T],
+    max_concurrency: int
+) -> list[R | Exception]:
+    """Awaits `func(item)` for all `items` by `max_concurrency` consumer
+    coroutines; returns results (or raised exceptions) in order of `items`
+    """
+    results: list[R | Exception] = [None] * len(items)
+    # shared by all consumers, each takes next item when done with one
+    pending = iter(enumerate(items))
+
+    async def _consume():
+        for index, item in pending:
+            try:
+                results[index] = await func(item)
+            except Exception as ex:
+                results[index] = ex
+
+    await asyncio.gather(*(
+        _consume() for _ in range(min(max_concurrency, len(items)))
+    ))
+
+    return results
+
+
+async def _collect(objects: AsyncIterator[RemoteObject]) -> list[RemoteObject]:
+    return [obj async for obj in objects]
+
+
+async def _list_remote_objects(prefixes: Iterable[str]) -> dict[str, RemoteObject]:
+    async with AsyncStorage() as storage:
+        listings = await map_bounded(
+            lambda prefix: _collect(storage.list_objects(prefix)),
+            list(prefixes),
+            storage.max_concurrency
+        )
+
+    objects = {}
+    for listing in listings:
+        if isinstance(listing, Exception):
+            raise listing
+        objects.update((obj.key, obj) for obj in listing)
+
+    return objects
+
+
+async def _upload_files(
+    files: list[tuple[Path, str]]
+) -> list[Exception | None]:
+    async with AsyncStorage() as storage:
+        results = await map_bounded(
+            lambda file: storage.upload(*file), files, storage.max_concurrency
+        )
+
+    return [
+        result if isinstance(result, Exception) else None
+        for result in results
+    ]
+
+
+async def _delete_keys(keynames: list[str]) -> list[DeleteError]:
+    async with AsyncStorage() as storage:
+        return await storage.delete_keys(keynames)
+
+
+async def _head_objects(keynames: list[str]) -> dict[str, RemoteObject | None]:
+    async with AsyncStorage() as storage:
+        results = await map_bounded(
+            storage.head, keynames, storage.max_concurrency
+        )
+
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+
+    return dict(zip(keynames, results))
+
+
+def list_remote_objects(prefixes: Iterable[str]) -> dict[str, RemoteObject]:
+    """Returns all objects found under any of `prefixes` keyed by key name"""
+    return asyncio.run(_list_remote_objects(prefixes))
+
+
+def upload_files(files: list[tuple[Path, str]]) -> list[Exception | None]:
+    """Uploads `(path, keyname)` pairs; returns the exception each upload
+    failed with (None on success), in order of `files`"""
+    return asyncio.run(_upload_files(files))
+
+
+def delete_keys(keynames: list[str]) -> list[DeleteError]:
+    """Deletes `keynames`; returns per-key errors"""
+    return asyncio.run(_delete_keys(keynames))
+
+
+def head_objects(keynames: list[str]) -> dict[str, RemoteObject | None]:
+    """Existence check of many keys: returns object of each of `keynames`,
+    None for the ones not in the bucket"""
+    return asyncio.run(_head_objects(keynames))
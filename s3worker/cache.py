@@ -0,0 +1,203 @@
+"""
+Size-bounded local cache of downloaded document versions.
+
+Document versions downloaded by `client.download_docver()` are registered
+in a small SQLite index (path, size, last access time). Once their total
+size exceeds `pm_docver_cache_max_bytes`, least recently used files are
+removed. Files which are in use (see `pin`) are never removed: users
+hold a shared `flock` on the file, eviction takes the exclusive one
+without blocking and skips the file if that fails. Empty document
+version folders are removed only while no download holds their lock
+(see `locks.file_lock`).
+
+Only downloaded files are tracked, i.e. files written to media root by
+other means are never evicted. With the cache disabled (no
+`pm_docver_cache_max_bytes`) the index is not touched at all, pinning
+takes only the `flock`.
+"""
+import fcntl
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from s3worker import config, utils
+
+settings = config.get_settings()
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docvers (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    atime REAL NOT NULL
+)
+"""
+
+
+def is_enabled() -> bool:
+    return settings.pm_docver_cache_max_bytes is not None
+
+
+def get_index_path() -> Path:
+    if settings.pm_docver_cache_index_path:
+        return Path(settings.pm_docver_cache_index_path)
+
+    media_root = Path(settings.pm_media_root)
+    return media_root.with_name(f"{media_root.name}.docvers-cache.sqlite")
+
+
+@contextmanager
+def session() -> Iterator[sqlite3.Connection]:
+    conn = utils.connect_sqlite(get_index_path(), SCHEMA)
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def register(path: Path):
+    """Adds freshly downloaded file to the cache and evicts, if needed
+
+    `path` itself is kept, even if it alone exceeds the cache size.
+    """
+    if not is_enabled():
+        return
+
+    try:
+        fd = pin(path)
+    except OSError as ex:
+        logger.warning(f"Failed to register {path} in docver cache: {ex}")
+        return
+
+    try:
+        with session() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO docvers (path, size, atime) "
+                "VALUES (?, ?, ?)",
+                (str(path), os.fstat(fd).st_size, time.time())
+            )
+        evict()
+    except (sqlite3.Error, OSError) as ex:
+        logger.warning(f"Failed to register {path} in docver cache: {ex}")
+    finally:
+        unpin(fd)
+
+
+def touch(path: Path):
+    """Marks cached file as recently used"""
+    if not is_enabled():
+        return
+
+    try:
+        with session() as conn:
+            conn.execute(
+                "UPDATE docvers SET atime = ? WHERE path = ?",
+                (time.time(), str(path))
+            )
+    except sqlite3.Error as ex:
+        logger.warning(f"Failed to update {path} in docver cache: {ex}")
+
+
+def pin(path: Path) -> int:
+    """Protects `path` from eviction until `unpin` is called
+
+    Returns file descriptor to pass to `unpin`.
+    Raises FileNotFoundError if the file is not present (anymore).
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        # file might have been evicted between `open` and `flock`
+        if os.fstat(fd).st_ino != os.stat(path).st_ino:
+            raise FileNotFoundError(path)
+    except OSError:
+        os.close(fd)
+        raise
+
+    touch(path)
+
+    return fd
+
+
+def unpin(fd: int):
+    os.close(fd)
+
+
+def evict(max_bytes: int | None = None) -> int:
+    """Removes least recently used files until cache fits into `max_bytes`
+
+    Files in use are skipped. Returns number of freed bytes.
+    """
+    if max_bytes is None:
+        max_bytes = settings.pm_docver_cache_max_bytes
+    if max_bytes is None:
+        return 0
+
+    freed = 0
+    with session() as conn:
+        total = conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM docvers"
+        ).fetchone()[0]
+        if total <= max_bytes:
+            return 0
+
+        rows = conn.execute(
+            "SELECT path, size FROM docvers ORDER BY atime"
+        ).fetchall()
+        for path, size in rows:
+            if total - freed <= max_bytes:
+                break
+            if _remove_unused(Path(path)):
+                conn.execute("DELETE FROM docvers WHERE path = ?", (path,))
+                freed += size
+
+    logger.info(f"Evicted {freed} bytes from docver cache")
+
+    return freed
+
+
+def _remove_unused(path: Path) -> bool:
+    """Removes `path` unless it is in use; True if it is gone"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return True
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        logger.debug(f"{path} is in use, not evicting it")
+        return False
+
+    try:
+        path.unlink(missing_ok=True)
+    finally:
+        os.close(fd)
+
+    _remove_empty_folder(path.parent)
+
+    return True
+
+
+def _remove_empty_folder(folder: Path):
+    """Removes doc version folder e.g. docvers/ab/cd/<uuid>/, unless a
+    download into it is in progress (holds `locks.file_lock` on it)"""
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except FileNotFoundError:
+        return
+
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        folder.rmdir()
+    except OSError:
+        # locked, not empty or removed already
+        pass
+    finally:
+        os.close(fd)
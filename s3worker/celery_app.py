@@ -1,6 +1,8 @@
 from celery import Celery
-from s3worker import config, utils
-from celery.signals import setup_logging
+from s3worker import config, utils, client, metrics, profiling
+from s3worker import constants as const
+from s3worker.db import engine
+from celery.signals import setup_logging, worker_process_init
 
 settings = config.get_settings()
 
@@ -12,6 +14,8 @@ app = Celery(
 )
 
 app.autodiscover_tasks()
+metrics.instrument_celery(engine.get_engine())
+profiling.instrument_celery()
 
 # Optional configuration, see the application user guide.
 app.conf.update(
@@ -23,6 +27,15 @@ app.conf.update(
     interval_max=0.2,
 )
 
+if settings.pm_delete_coalesce:
+    # requires celery beat e.g. `celery -A s3worker.celery_app worker -B`
+    app.conf.beat_schedule = {
+        'flush-deletes': {
+            'task': const.S3_WORKER_FLUSH_DELETES,
+            'schedule': settings.pm_delete_flush_interval,
+        },
+    }
+
 
 @setup_logging.connect
 def config_loggers(*args, **kwags):
@@ -30,5 +43,15 @@ def config_loggers(*args, **kwags):
         utils.setup_logging(settings.pm_log_config)
 
 
+
+@worker_process_init.connect
+def init_worker_process(*args, **kwargs):
+    # each pool process creates its own S3 client (and connection pool)
+    # instead of using the one possibly inherited from the parent
+    client.reset_client()
+    # same for database connections
+    engine.reset_engine()
+
+
 if __name__ == '__main__':
     app.start()
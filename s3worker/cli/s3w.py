@@ -1,3 +1,4 @@
+from collections import deque
 from uuid import UUID
 import typer
 import logging
@@ -8,8 +9,9 @@ from rich.progress import track
 from rich import print_json
 from rich import print
 
-from s3worker.db.engine import Session
-from s3worker import client, generate, db, utils, config, schemas
+# database and rendering modules are imported by commands which use them
+from s3worker import client, plib, utils, config
+from s3worker.types import UploadStatus
 
 
 logger = logging.getLogger(__name__)
@@ -33,6 +35,11 @@ KeynamesPath = Annotated[
     typer.Argument(help="One or multiple storage object keys")
 ]
 
+EngineOption = Annotated[
+    config.StorageEngine | None,
+    typer.Option(help="Storage engine of bulk requests (default: PM_STORAGE_ENGINE)")
+]
+
 
 @app.command()
 def upload(target: TargetPath, keyname: KeynamePath):
@@ -43,19 +50,29 @@ def upload(target: TargetPath, keyname: KeynamePath):
 @app.command()
 def add_doc_vers(uids: list[str]):
     """Add document versions to storage"""
-    client.add_doc_vers(uids)
+    result = client.add_doc_vers(uids)
+    not_uploaded = {
+        ver: status.value for ver, status in result.items()
+        if status != UploadStatus.uploaded
+    }
+    if not_uploaded:
+        print(f"[bold red]Not uploaded: {not_uploaded}[/bold red]")
 
 
 @app.command()
-def remove_doc_vers(uids: list[str]):
+def remove_doc_vers(uids: list[str], engine: EngineOption = None):
     """Remove document versions from storage"""
-    client.remove_doc_vers(uids)
+    errors = client.remove_doc_vers(uids, engine=engine)
+    if errors:
+        print(f"[bold red]Failed to delete {len(errors)} objects[/bold red]")
 
 
 @app.command()
-def delete(keynames: KeynamesPath):
+def delete(keynames: KeynamesPath, engine: EngineOption = None):
     """Delete objects from storage"""
-    client.delete(keynames)
+    errors = client.delete(keynames, engine=engine)
+    if errors:
+        print(f"[bold red]Failed to delete {len(errors)} objects[/bold red]")
 
 
 @app.command()
@@ -65,48 +82,219 @@ def doc_thumbnail(doc_id: str):
     Thumbnails is generated for the first page of the last version
     of the document identified with given UUID
     """
+    from s3worker import generate
+    from s3worker.db.engine import Session
+
     with Session() as db_session:
-        thumb_path: Path = generate.doc_thumbnail(db_session, UUID(doc_id))
-        client.upload_file(thumb_path)
+        thumb_path, data = generate.doc_thumbnail(db_session, UUID(doc_id))
+        generate.store_images({thumb_path: data})
 
 
 @app.command()
-def sync():
+def sync(
+    workers: Annotated[
+        int | None,
+        typer.Option(help="Number of concurrent listings/uploads")
+    ] = None,
+    rebuild_manifest: Annotated[
+        bool,
+        typer.Option(
+            help="Only re-create local sync manifest from the bucket listing"
+        )
+    ] = False,
+    engine: EngineOption = None,
+    verify_hash: Annotated[
+        bool | None,
+        typer.Option(
+            help="Compare content (ETag) of files which look unchanged "
+            "(default: PM_SYNC_VERIFY_HASH)"
+        )
+    ] = None,
+):
     """Uploads all local media data to S3/R2
 
-    Iterates through all local media files and checks if they
-    are present on storage. If not present - upload, otherwise continue.
+    Files unchanged (same size and mtime) since their last upload, as
+    recorded in local sync manifest, are skipped right away. For the rest,
+    the bucket is listed once per shard folder and only the files which
+    are not present on storage yet, or whose size differs or which were
+    modified after their upload, are uploaded (concurrently).
     All uploaded objects will be prefixed with `pm_prefix`.
     """
     backend = client.get_storage_backend_name()
+    if rebuild_manifest:
+        print(f"[bold green]Rebuilding sync manifest from {backend}...[/bold green]")
+        count = client.rebuild_manifest(
+            max_workers=workers, engine=engine, verify_hash=verify_hash
+        )
+        print(f"[bold green]Recorded {count} files in sync manifest[/bold green]")
+        return
+
     print(f"[bold green]Starting sync to {backend}...[/bold green]")
-    client.sync()
+    stats = client.sync(
+        max_workers=workers, engine=engine, verify_hash=verify_hash
+    )
+    print(
+        f"Uploaded {stats.files_uploaded} of {stats.files_total} files "
+        f"({stats.bytes_uploaded / (1024 * 1024):.1f} MB) "
+        f"in {stats.elapsed:.1f}s: "
+        f"{stats.files_per_sec:.1f} files/s, {stats.mb_per_sec:.2f} MB/s"
+    )
+    print(f"Skipped {stats.files_skipped} files unchanged since last sync")
+    if stats.files_changed:
+        print(f"Re-uploaded {stats.files_changed} files changed since their upload")
+    if stats.files_failed:
+        print(f"[bold red]{stats.files_failed} uploads failed[/bold red]")
     print("[bold green]Sync complete![/bold green]")
 
 
 @app.command()
-def generate_doc_thumbnails(progress: bool = False):
-    """Generate thumbnails for all documents and if the
-     previews are not present on storage - upload them"""
-    prefix = settings.pm_prefix
-    bucket_name = settings.pm_s3_bucket_name
+def pull(
+    subtree: Annotated[
+        list[str] | None,
+        typer.Option(
+            help="Folder to pull e.g. docvers (repeatable; default: "
+            "docvers, thumbnails/jpg and ocr/pages)"
+        )
+    ] = None,
+    shards: Annotated[
+        str | None,
+        typer.Option(help="Shard folders to pull e.g. 00-3f or ab")
+    ] = None,
+    workers: Annotated[
+        int | None,
+        typer.Option(help="Number of concurrent listings/downloads")
+    ] = None,
+    max_bytes: Annotated[
+        int | None,
+        typer.Option(help="Download at most this many bytes")
+    ] = None,
+):
+    """Downloads objects missing in local media root from S3/R2
+
+    Meant to prewarm media root of a new node. Files already present
+    (same size) are skipped, thus an interrupted pull is resumed by
+    running it again. Every file is downloaded to a temporary file first
+    and atomically moved into place.
+    """
+    try:
+        shard_names = plib.shard_range(shards) if shards else None
+    except ValueError as ex:
+        raise typer.BadParameter(str(ex), param_hint="--shards")
+
+    backend = client.get_storage_backend_name()
+    print(f"[bold green]Pulling from {backend}...[/bold green]")
+    stats = client.pull(
+        subtrees=subtree,
+        shards=shard_names,
+        max_workers=workers,
+        max_bytes=max_bytes,
+    )
+    print(
+        f"Downloaded {stats.files_downloaded} of {stats.files_total} files "
+        f"({stats.bytes_downloaded / (1024 * 1024):.1f} MB) "
+        f"in {stats.elapsed:.1f}s: "
+        f"{stats.files_per_sec:.1f} files/s, {stats.mb_per_sec:.2f} MB/s"
+    )
+    print(f"Skipped {stats.files_present} files already present")
+    if stats.files_over_budget:
+        print(
+            f"[bold yellow]{stats.files_over_budget} files not downloaded, "
+            "--max-bytes reached[/bold yellow]"
+        )
+    if stats.files_failed:
+        print(f"[bold red]{stats.files_failed} downloads failed[/bold red]")
+    print("[bold green]Pull complete![/bold green]")
 
-    with Session() as db_session:
-        all_docs: list[schemas.Document] = db.get_docs(db_session)
 
+@app.command()
+def generate_doc_thumbnails(
+    progress: bool = False,
+    resume_from: Annotated[
+        str | None,
+        typer.Option(help="Skip documents up to and including this ID")
+    ] = None,
+    jobs: Annotated[
+        int,
+        typer.Option(help="Number of render processes")
+    ] = 1,
+):
+    """Generate thumbnails for all documents whose
+    thumbnails are not present on storage and upload them
+
+    Existing thumbnails are found with one bucket listing upfront, only
+    documents without thumbnail are rendered (by `--jobs` processes).
+    Documents are processed in order of their ID. If the command is
+    interrupted, it can be resumed with `--resume-from <last reported ID>`.
+    """
+    from s3worker import db, generate
+    from s3worker.db.engine import Session
+
+    try:
+        after = UUID(resume_from) if resume_from else None
+    except ValueError as ex:
+        raise typer.BadParameter(str(ex), param_hint="--resume-from")
+
+    existing = client.list_thumbnail_ids()
+    print(f"{len(existing)} thumbnails found on storage")
+
+    # IDs of dispatched documents in order; used to find the ID up to
+    # which all documents are done, as jobs complete out of order
+    dispatched: deque[UUID] = deque()
+    done: set[UUID] = set()
+    last_doc_id = resume_from
+    failed = 0
+
+    with Session() as db_session:
+        all_docs = db.iter_docs_last_version(db_session, after=after)
+
+        def _missing():
+            for doc in all_docs:
+                if str(doc.doc_id) not in existing:
+                    dispatched.append(doc.doc_id)
+                    yield doc
+
+        results = utils.bounded_imap(
+            generate.store_doc_thumbnail,
+            _missing(),
+            max_workers=jobs,
+            processes=True
+        )
         if progress:
-            all_items = track(all_docs, description="Generating...")
-        else:
-            all_items = all_docs
-
-        for doc in all_items:
-            thumb_path: Path = generate.doc_thumbnail(db_session, doc.id)
-            keyname = prefix / thumb_path
-            if not client.s3_obj_exists(
-                bucket_name=bucket_name,
-                keyname=str(keyname)
-            ):
-                client.upload_file(thumb_path)
+            # listed IDs include pages, only documents are rendered
+            total = db.count_docs_last_version(
+                db_session, after=after
+            ) - db.count_docs_last_version(
+                db_session,
+                after=after,
+                doc_ids=[UUID(doc_id) for doc_id in existing]
+            )
+            results = track(
+                results, total=total, description="Generating..."
+            )
+
+        try:
+            for doc, future in results:
+                try:
+                    if future.result():
+                        failed += 1
+                except Exception as ex:
+                    failed += 1
+                    logger.error(f"Failed to generate thumbnail of {doc.doc_id}: {ex}")
+
+                done.add(doc.doc_id)
+                while dispatched and dispatched[0] in done:
+                    last_doc_id = dispatched.popleft()
+                    done.remove(last_doc_id)
+        except BaseException:
+            if last_doc_id:
+                print(
+                    "[bold red]Interrupted. Resume with "
+                    f"--resume-from {last_doc_id}[/bold red]"
+                )
+            raise
+
+    if failed:
+        print(f"[bold red]{failed} thumbnails failed[/bold red]")
 
 
 @app.command()
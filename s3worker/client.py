@@ -8,67 +8,157 @@ The backend is selected via the STORAGE_BACKEND environment variable:
 
 Cloudflare R2 is S3-compatible, so we use boto3 with a custom endpoint URL.
 Reference: https://developers.cloudflare.com/r2/examples/aws/boto3/
+
+boto3 is imported on first use only, as it takes a noticeable share of
+CLI startup time.
 """
+from __future__ import annotations
+
+import io
 import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from uuid import UUID
-from typing import Tuple
+from typing import TYPE_CHECKING, Iterable, Iterator, Tuple
 
-import boto3
-from botocore.client import BaseClient
-from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError
 from pathlib import Path
 
 from s3worker import config, utils
-from s3worker import plib
-from s3worker.exc import S3DocumentNotFound
-from s3worker.config import StorageBackend
+from s3worker import cache, locks, metrics, plib, schemas, manifest, walk
+from s3worker import constants as const
+from s3worker.exc import DocverEvicted, S3DocumentNotFound
+from s3worker.config import StorageBackend, StorageEngine
+from s3worker.types import (
+    DeleteError,
+    ImagePreviewSize,
+    MediaFile,
+    RemoteObject,
+    UploadStatus,
+)
+
+if TYPE_CHECKING:
+    from boto3.s3.transfer import TransferConfig
+    from botocore.client import BaseClient
 
 settings = config.get_settings()
 logger = logging.getLogger(__name__)
 
-# Cache the client instance
+# Cache the client instance (per process, see `get_client`)
 _client: BaseClient | None = None
+_client_pid: int | None = None
+_client_lock = threading.Lock()
+# `delete_objects` accepts at most 1000 keys per request
+DELETE_BATCH_SIZE = 1000
+# Shared by all uploads/downloads
+_transfer_config: TransferConfig | None = None
 
 
 def get_client() -> BaseClient:
     """
     Create and return a boto3 S3 client.
-    
+
     For AWS: Uses standard S3 endpoint with region
     For Cloudflare R2: Uses custom endpoint URL with 'auto' region
+
+    The client is thread safe and is shared by all threads of the process.
+    It is re-created in a forked child process (e.g. Celery prefork pool),
+    as the connection pool of the parent must not be reused there.
     """
-    global _client
-    if _client is not None:
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
         return _client
 
-    if settings.pm_storage_backend == StorageBackend.AWS:
-        session = boto3.Session(
-            aws_access_key_id=settings.aws_access_key_id,
-            aws_secret_access_key=settings.aws_secret_access_key,
-            region_name=settings.aws_region_name
-        )
-        _client = session.client('s3')
-    else:
-        # Cloudflare R2
-        session = boto3.Session(
-            aws_access_key_id=settings.r2_access_key_id,
-            aws_secret_access_key=settings.r2_secret_access_key,
-        )
-        _client = session.client(
-            's3',
-            endpoint_url=settings.r2_endpoint_url,
-            region_name='auto',  # Required by boto3 but not used by R2
-            config=BotoConfig(signature_version='s3v4')
-        )
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            return _client
+
+        _client = _create_client()
+        _client_pid = os.getpid()
+        metrics.instrument_s3_client(_client)
 
     return _client
 
 
+def _create_client() -> BaseClient:
+    import boto3
+    from botocore.config import Config as BotoConfig
+
+    return boto3.Session().client(
+        's3',
+        config=BotoConfig(**config_options()),
+        **client_options()
+    )
+
+
+def client_options() -> dict:
+    """Endpoint, region and credentials of the selected backend
+
+    Shared by the boto3 client and the asyncio one (`s3worker.aio`).
+    """
+    if settings.pm_storage_backend == StorageBackend.AWS:
+        return {
+            'aws_access_key_id': settings.aws_access_key_id,
+            'aws_secret_access_key': settings.aws_secret_access_key,
+            'region_name': settings.aws_region_name,
+            # custom endpoint is meant for S3 compatible stand-ins e.g. MinIO
+            'endpoint_url': settings.aws_endpoint_url,
+        }
+
+    # Cloudflare R2
+    return {
+        'aws_access_key_id': settings.r2_access_key_id,
+        'aws_secret_access_key': settings.r2_secret_access_key,
+        'region_name': 'auto',  # Required by boto3 but not used by R2
+        'endpoint_url': settings.r2_endpoint_url,
+    }
+
+
+def config_options() -> dict:
+    """botocore `Config` options (connection pool, timeouts, retries)"""
+    options = {
+        'max_pool_connections': settings.pm_s3_max_pool_connections,
+        'tcp_keepalive': settings.pm_s3_tcp_keepalive,
+        'connect_timeout': settings.pm_s3_connect_timeout,
+        'read_timeout': settings.pm_s3_read_timeout,
+        'retries': {
+            'mode': settings.pm_s3_retry_mode.value,
+            'total_max_attempts': settings.pm_s3_max_attempts,
+        },
+    }
+    if settings.pm_storage_backend == StorageBackend.CLOUDFLARE:
+        options['signature_version'] = 's3v4'
+
+    return options
+
+
 def reset_client():
-    """Reset the cached client (useful for testing or config changes)."""
-    global _client
+    """Reset the cached client (useful for testing or config changes).
+
+    Also called in every new Celery worker process.
+    """
+    global _client, _transfer_config
     _client = None
+    _transfer_config = None
+
+
+def get_transfer_config() -> TransferConfig:
+    """Returns multipart transfer settings used by all uploads/downloads"""
+    global _transfer_config
+    if _transfer_config is None:
+        from boto3.s3.transfer import TransferConfig
+
+        _transfer_config = TransferConfig(
+            multipart_threshold=settings.pm_transfer_multipart_threshold,
+            multipart_chunksize=settings.pm_transfer_multipart_chunksize,
+            max_concurrency=settings.pm_transfer_max_concurrency,
+            use_threads=settings.pm_transfer_use_threads,
+        )
+
+    return _transfer_config
 
 
 def upload(target_path: Path, object_path: Path):
@@ -78,37 +168,52 @@ def upload(target_path: Path, object_path: Path):
     s3_client.upload_file(
         str(target_path),
         Bucket=get_bucket_name(),
-        Key=str(keyname)
+        Key=str(keyname),
+        Config=get_transfer_config()
     )
 
 
-def delete(object_paths: list[Path]):
-    """Delete one or multiple objects from S3/R2 bucket
-
-    Reference:
-        - https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/delete_objects.html
-    """
-    s3_client = get_client()
+def delete(
+    object_paths: list[Path],
+    engine: StorageEngine | None = None
+) -> list[DeleteError]:
+    """Delete one or multiple objects from S3/R2 bucket"""
     keynames = [
         str(get_prefix() / obj_path) for obj_path in object_paths
     ]
-    s3_client.delete_objects(
-        Bucket=get_bucket_name(),
-        Delete={
-            'Objects': [{'Key': key} for key in keynames]
-        }
-    )
+    return delete_keys(keynames, engine=engine)
 
 
-def add_doc_vers(doc_ver_ids: list[str]):
-    """Given a list of UUID (as str) - add those documents to S3/R2"""
-    s3_client = get_client()
-    for ver in doc_ver_ids:
-        uid = UUID(ver)
-        add_doc_ver(s3_client, uid)
+def add_doc_vers(
+    doc_ver_ids: list[str],
+    max_workers: int | None = None
+) -> dict[str, UploadStatus]:
+    """Given a list of UUID (as str) - add those documents to S3/R2
 
+    Document versions are uploaded concurrently by `max_workers` threads.
+    Failure of one upload does not affect the others.
+    Returns upload status of each of the document versions.
+    """
+    if max_workers is None:
+        max_workers = settings.pm_upload_workers
 
-def add_doc_ver(client: BaseClient, uid: UUID):
+    s3_client = get_client()
+    result = {}
+    for ver, future in utils.bounded_imap(
+        lambda ver: add_doc_ver(s3_client, UUID(ver)),
+        doc_ver_ids,
+        max_workers=max_workers
+    ):
+        try:
+            result[ver] = future.result()
+        except Exception as ex:
+            logger.error(f"Failed to upload doc_ver {ver}: {ex}")
+            result[ver] = UploadStatus.failed
+
+    return result
+
+
+def add_doc_ver(client: BaseClient, uid: UUID) -> UploadStatus:
     logger.info(f"Adding doc_ver {uid} to the Bucket")
 
     # get filename to be uploaded based on the UUID of the doc version
@@ -120,7 +225,7 @@ def add_doc_ver(client: BaseClient, uid: UUID):
             f"No filename found in {_doc_ver_base(uid)} directory. "
             f"Skipping upload for doc version {uid}."
         )
-        return
+        return UploadStatus.missing
 
     logger.debug(f"file_name={file_name}")
 
@@ -132,38 +237,43 @@ def add_doc_ver(client: BaseClient, uid: UUID):
     client.upload_file(
         str(target_path),
         Bucket=get_bucket_name(),
-        Key=str(keyname)
+        Key=str(keyname),
+        Config=get_transfer_config()
     )
+    manifest.record(str(keyname), target_path)
 
+    return UploadStatus.uploaded
 
-def remove_doc_vers(doc_ver_ids: list[str]):
+
+def remove_doc_vers(
+    doc_ver_ids: list[str],
+    engine: StorageEngine | None = None
+) -> list[DeleteError]:
     """Given a list of UUID (as str) - remove those documents from S3/R2"""
-    s3_client = get_client()
-    for ver in doc_ver_ids:
-        uid = UUID(ver)
-        remove_doc_ver(s3_client, uid)
+    logger.info(f"Removing doc_vers {doc_ver_ids} from the bucket")
+    return remove_prefixes(doc_vers_prefixes(doc_ver_ids), engine=engine)
 
 
-def remove_doc_ver(client: BaseClient, uid: UUID):
-    logger.info(f"Removing doc_ver {uid} from the bucket")
+def doc_vers_prefixes(doc_ver_ids: list[str]) -> list[str]:
+    """Key prefixes of all objects of the given document versions"""
+    return [
+        str(get_prefix() / plib.docver_base_path(UUID(ver)))
+        for ver in doc_ver_ids
+    ]
 
-    prefix = str(get_prefix() / plib.docver_base_path(uid))
-    remove_files(
-        client,
-        bucket_name=get_bucket_name(),
-        prefix=prefix
-    )
 
+def remove_doc_thumbnail(uid: UUID) -> list[DeleteError]:
+    return remove_docs_thumbnails([uid])
+
+
+def remove_docs_thumbnails(uids: list[UUID]) -> list[DeleteError]:
+    logger.info(f"Removing thumbnails of doc_ids={uids} from the bucket")
+    return remove_prefixes(docs_thumbnails_prefixes(uids))
 
-def remove_doc_thumbnail(uid: UUID):
-    logger.info(f"Removing thumbnail of doc_id={uid} from the bucket")
-    s3_client = get_client()
-    prefix = str(get_prefix() / plib.thumbnail_path(uid))
-    remove_files(
-        client=s3_client,
-        bucket_name=get_bucket_name(),
-        prefix=prefix
-    )
+
+def docs_thumbnails_prefixes(uids: list[UUID]) -> list[str]:
+    """Key prefixes of the thumbnails of the given documents"""
+    return [str(get_prefix() / plib.thumbnail_path(uid)) for uid in uids]
 
 
 def upload_file(rel_file_path: Path) -> Tuple[bool, str | None]:
@@ -196,14 +306,49 @@ def upload_file(rel_file_path: Path) -> Tuple[bool, str | None]:
     s3_client.upload_file(
         str(target),
         Bucket=get_bucket_name(),
-        Key=str(keyname)
+        Key=str(keyname),
+        Config=get_transfer_config()
     )
+    manifest.record(str(keyname), target)
 
     return True, None
 
 
-def upload_doc_previews(doc_ver_id: UUID):
-    pass
+def upload_previews(
+    previews: dict[Path, bytes],
+    max_workers: int | None = None
+) -> list[Path]:
+    """Uploads in-memory jpeg images to S3/R2, concurrently
+
+    `previews` maps relative path (as in `upload_file`) to jpeg data.
+    Returns relative paths which failed to upload.
+    """
+    if max_workers is None:
+        max_workers = settings.pm_upload_workers
+
+    s3_client = get_client()
+    bucket_name = get_bucket_name()
+
+    def _upload(rel_path: Path):
+        s3_client.upload_fileobj(
+            io.BytesIO(previews[rel_path]),
+            Bucket=bucket_name,
+            Key=str(get_prefix() / rel_path),
+            ExtraArgs={'ContentType': 'image/jpeg'},
+            Config=get_transfer_config()
+        )
+
+    failed = []
+    for rel_path, future in utils.bounded_imap(
+        _upload, previews, max_workers=max_workers
+    ):
+        try:
+            future.result()
+        except Exception as ex:
+            logger.error(f"Failed to upload {rel_path}: {ex}")
+            failed.append(rel_path)
+
+    return failed
 
 
 def _doc_ver_base(uid: UUID) -> Path:
@@ -211,84 +356,685 @@ def _doc_ver_base(uid: UUID) -> Path:
     return plib.rel2abs(plib.docver_base_path(uid))
 
 
-def remove_files(client: BaseClient, bucket_name: str, prefix: str):
-    """Removes all objects in `bucket_name` starting with `prefix`"""
-    objects_to_delete = client.list_objects_v2(
-        Bucket=bucket_name,
-        Prefix=prefix
+def remove_prefixes(
+    prefixes: Iterable[str],
+    max_workers: int | None = None,
+    engine: StorageEngine | None = None
+) -> list[DeleteError]:
+    """Removes all objects whose key starts with any of `prefixes`
+
+    Listings are paginated, so there is no limit on the number of
+    objects per prefix.
+    """
+    if max_workers is None:
+        max_workers = settings.pm_delete_workers
+
+    objects = list_remote_objects(
+        prefixes, max_workers=max_workers, engine=engine
     )
-    if 'Contents' not in objects_to_delete:
-        logger.error(f"Empty content for prefix={prefix}. Nothing to delete.")
-        return
+    if not objects:
+        logger.debug(f"Empty content for prefixes={prefixes}. Nothing to delete.")
+        return []
+
+    return delete_keys(list(objects), max_workers=max_workers, engine=engine)
+
+
+def delete_keys(
+    keynames: list[str],
+    max_workers: int | None = None,
+    engine: StorageEngine | None = None
+) -> list[DeleteError]:
+    """Deletes objects in batches of (at most) 1000 keys
+
+    Batches are deleted concurrently by `max_workers` threads (or by
+    the asyncio engine, see `s3worker.aio`).
+    Returns per-key errors; they are logged, not raised.
+
+    Reference:
+        - https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3/client/delete_objects.html
+    """
+    if max_workers is None:
+        max_workers = settings.pm_delete_workers
+
+    if _use_asyncio(engine):
+        from s3worker import aio
+
+        errors = aio.delete_keys(keynames)
+    else:
+        errors = []
+        for batch, future in utils.bounded_imap(
+            _delete_batch, delete_batches(keynames), max_workers=max_workers
+        ):
+            try:
+                errors.extend(future.result())
+            except Exception as ex:
+                # whole request failed e.g. connection error
+                code = error_code(ex)
+                errors.extend(DeleteError(key, code, str(ex)) for key in batch)
+
+    for error in errors:
+        logger.error(
+            f"Failed to delete {error.key}: {error.code} {error.message}"
+        )
+
+    return errors
 
-    keynames = []
-    for i in objects_to_delete['Contents']:
-        if 'Key' in i:
-            keynames.append(i['Key'])
-        else:
-            logger.warning(
-                f"Item {i} does not have Key attribute. API changed?"
-            )
 
+def delete_batches(keynames: list[str]) -> list[list[str]]:
+    """Splits `keynames` into `delete_objects` sized batches"""
+    return [
+        keynames[i:i + DELETE_BATCH_SIZE]
+        for i in range(0, len(keynames), DELETE_BATCH_SIZE)
+    ]
+
+
+def _delete_batch(keynames: list[str]) -> list[DeleteError]:
     logger.debug(
-        f"Deleting keynames={keynames} from bucket={bucket_name}"
+        f"Deleting {len(keynames)} keys from bucket={get_bucket_name()}"
     )
-    client.delete_objects(
-        Bucket=bucket_name,
+    response = get_client().delete_objects(
+        Bucket=get_bucket_name(),
         Delete={
-            'Objects': [{'Key': k} for k in keynames]
+            'Objects': [{'Key': k} for k in keynames],
+            # response lists only keys which failed to be deleted
+            'Quiet': True
         }
     )
+    return [
+        DeleteError(item.get('Key'), item.get('Code'), item.get('Message'))
+        for item in response.get('Errors', [])
+    ]
+
+
+def error_code(ex: Exception) -> str:
+    """S3 error code of a failed request, or exception class name"""
+    if isinstance(ex, ClientError):
+        return ex.response.get('Error', {}).get('Code', 'Unknown')
 
+    return type(ex).__name__
 
-def delete_page(uid: UUID):
+
+def _use_asyncio(engine: StorageEngine | None) -> bool:
+    """Whether bulk operation runs on the asyncio engine (`s3worker.aio`)"""
+    return (engine or settings.pm_storage_engine) == StorageEngine.ASYNCIO
+
+
+def delete_page(uid: UUID) -> list[DeleteError]:
     """Delete all thumbnails/previews associated with given page ID"""
-    s3_client = get_client()
-    prefix = str(get_prefix() / plib.base_thumbnail_path(uid))
-    remove_files(
-        s3_client,
-        bucket_name=get_bucket_name(),
-        prefix=prefix
-    )
+    return delete_pages([uid])
+
+
+def delete_pages(uids: list[UUID]) -> list[DeleteError]:
+    """Delete all thumbnails/previews associated with given page IDs"""
+    return remove_prefixes(pages_prefixes(uids))
+
+
+def pages_prefixes(uids: list[UUID]) -> list[str]:
+    """Key prefixes of all thumbnails/previews of the given pages"""
+    return [
+        str(get_prefix() / plib.base_thumbnail_path(uid)) for uid in uids
+    ]
+
+
+def sync(
+    max_workers: int | None = None,
+    engine: StorageEngine | None = None,
+    verify_hash: bool | None = None
+) -> schemas.SyncStats:
+    """Uploads local media files which are missing or outdated in the bucket
+
+    Local files whose size and mtime match the sync manifest (see
+    `s3worker.manifest`) were already uploaded and are skipped without
+    any network request. For the rest, instead of sending one `head_object`
+    request per file, the bucket is listed once per shard folder
+    (see `plib.shard_prefix`) and the listing is diffed in memory against
+    the local files (see `_is_unchanged`). Missing and changed files are
+    then uploaded concurrently by `max_workers` threads (or by the asyncio
+    engine, see `s3worker.aio`).
+    """
+    if max_workers is None:
+        max_workers = settings.pm_sync_workers
+    if verify_hash is None:
+        verify_hash = settings.pm_sync_verify_hash
+
+    started = time.monotonic()
+    stats = schemas.SyncStats()
+
+    with manifest.writer() as manifest_writer:
+        known = manifest_writer.load() if manifest_writer else {}
+        local, prefixes = _scan_media(known, stats)
+        remote = list_remote_objects(
+            prefixes, max_workers=max_workers, engine=engine
+        )
+        missing = []
+        for keyname, media_file, remote_obj, unchanged in _diff(
+            local, remote, verify_hash, max_workers
+        ):
+            if unchanged:
+                if manifest_writer:
+                    manifest_writer.add(
+                        keyname,
+                        media_file.size,
+                        media_file.mtime_ns,
+                        remote_obj.etag
+                    )
+                continue
+
+            if remote_obj is not None:
+                stats.files_changed += 1
+            missing.append((plib.rel2abs(media_file.key), keyname))
+
+        logger.info(
+            f"{stats.files_total} local files, {len(local)} not in manifest, "
+            f"{len(missing) - stats.files_changed} missing in the bucket, "
+            f"{stats.files_changed} changed"
+        )
+
+        for (_, keyname), error in upload_files(
+            missing, max_workers=max_workers, engine=engine
+        ):
+            media_file = local[keyname]
+            if error is not None:
+                stats.files_failed += 1
+                logger.error(f"Failed to upload {media_file.key} to {keyname}: {error}")
+                continue
+
+            stats.files_uploaded += 1
+            stats.bytes_uploaded += media_file.size
+            if manifest_writer:
+                manifest_writer.add(
+                    keyname, media_file.size, media_file.mtime_ns
+                )
+
+    stats.elapsed = time.monotonic() - started
 
+    return stats
+
+
+def upload_files(
+    files: list[tuple[Path, str]],
+    max_workers: int,
+    engine: StorageEngine | None = None
+) -> Iterator[tuple[tuple[Path, str], Exception | None]]:
+    """Uploads `(path, keyname)` pairs concurrently
+
+    Yields each pair with the exception its upload failed with (None on
+    success), in order of completion.
+    """
+    if _use_asyncio(engine):
+        from s3worker import aio
+
+        yield from zip(files, aio.upload_files(files))
+        return
 
-def sync():
     s3_client = get_client()
     bucket_name = get_bucket_name()
-    for target_path, keyname in media_iter():
-        logger.debug(f"target_path: {target_path}, keyname={keyname}")
-        if not s3_obj_exists(
-            bucket_name=bucket_name,
-            keyname=str(keyname)
-        ):
-            logger.debug(f"Uploading {target_path} to {keyname}")
-            s3_client.upload_file(
-                str(target_path),
-                Bucket=bucket_name,
-                Key=str(keyname)
+
+    def _upload(item: tuple[Path, str]) -> None:
+        path, keyname = item
+        s3_client.upload_file(
+            str(path),
+            Bucket=bucket_name,
+            Key=keyname,
+            Config=get_transfer_config()
+        )
+
+    for item, future in utils.bounded_imap(
+        _upload, files, max_workers=max_workers
+    ):
+        yield item, future.exception()
+
+
+def rebuild_manifest(
+    max_workers: int | None = None,
+    engine: StorageEngine | None = None,
+    verify_hash: bool | None = None
+) -> int:
+    """Re-creates sync manifest from the bucket listing
+
+    Every local file which is present in the bucket and unchanged (see
+    `_is_unchanged`) is recorded in the manifest. Nothing is uploaded.
+    Returns number of recorded files.
+    """
+    if max_workers is None:
+        max_workers = settings.pm_sync_workers
+    if verify_hash is None:
+        verify_hash = settings.pm_sync_verify_hash
+
+    count = 0
+    with manifest.writer() as manifest_writer:
+        if manifest_writer is None:
+            raise ValueError(
+                "Sync manifest is disabled (pm_sync_manifest) or not available"
             )
+
+        manifest_writer.clear()
+        local, prefixes = _scan_media({}, schemas.SyncStats())
+        remote = list_remote_objects(
+            prefixes, max_workers=max_workers, engine=engine
+        )
+        for keyname, media_file, remote_obj, unchanged in _diff(
+            local, remote, verify_hash, max_workers
+        ):
+            if unchanged:
+                manifest_writer.add(
+                    keyname,
+                    media_file.size,
+                    media_file.mtime_ns,
+                    remote_obj.etag
+                )
+                count += 1
+
+    return count
+
+
+def _diff(
+    local: dict[str, MediaFile],
+    remote: dict[str, RemoteObject],
+    verify_hash: bool,
+    max_workers: int
+) -> Iterator[tuple[str, MediaFile, RemoteObject | None, bool]]:
+    """Yields `(keyname, media_file, remote_obj, unchanged)` of all `local`
+    files; `remote_obj` is None if the file is not in the bucket
+
+    Hashes (with `verify_hash`) are computed by `max_workers` threads.
+    """
+    to_verify = []
+    for keyname, media_file in local.items():
+        remote_obj = remote.get(keyname)
+        if remote_obj is None:
+            yield keyname, media_file, None, False
+        elif not _is_unchanged(media_file, remote_obj):
+            yield keyname, media_file, remote_obj, False
+        elif verify_hash:
+            to_verify.append((keyname, media_file, remote_obj))
         else:
-            logger.debug(f"Skipping {target_path} as {keyname} exists")
+            yield keyname, media_file, remote_obj, True
+
+    for (keyname, media_file, remote_obj), future in utils.bounded_imap(
+        lambda item: _etag_matches(item[1], item[2]),
+        to_verify,
+        max_workers=max_workers
+    ):
+        try:
+            unchanged = future.result()
+        except OSError as ex:
+            logger.warning(f"Failed to compute ETag of {media_file.key}: {ex}")
+            unchanged = False
+
+        yield keyname, media_file, remote_obj, unchanged
+
+
+def _is_unchanged(media_file: MediaFile, remote_obj: RemoteObject) -> bool:
+    """Whether object in the bucket is (most likely) the local file
+
+    Uses size and LastModified from the bucket listing, i.e. costs no
+    request: local file has changed if its size differs or it was modified
+    after the object was uploaded. LastModified has a resolution of
+    one second, so a change within the second of the upload goes unnoticed,
+    as does a change which keeps size and an old mtime (e.g. restored
+    backup); `_etag_matches` tells these apart.
+    """
+    if media_file.size != remote_obj.size:
+        return False
+
+    return media_file.mtime_ns // 1_000_000_000 <= remote_obj.last_modified
+
+
+def _etag_matches(media_file: MediaFile, remote_obj: RemoteObject) -> bool:
+    """Whether content of the local file matches ETag of the object
+
+    ETags of multipart uploads ("<digest>-<parts>") are reproduced with
+    `pm_transfer_multipart_chunksize` as part size, i.e. they match only
+    if the object was uploaded with the same part size.
+    """
+    part_size = None
+    if '-' in remote_obj.etag:
+        part_size = settings.pm_transfer_multipart_chunksize
+
+    etag = utils.file_etag(plib.rel2abs(media_file.key), part_size)
+
+    return etag == remote_obj.etag
+
+
+def _scan_media(
+    known: dict[str, tuple[int, int]],
+    stats: schemas.SyncStats
+) -> tuple[dict[str, MediaFile], set[str]]:
+    """Walks media root and skips files recorded in `known` (unchanged)
+
+    Returns `{keyname: media_file}` of remaining files and the listing
+    prefixes of the shards they belong to.
+    """
+    key_prefix = _key_prefix()
+    local = {}
+    prefixes = set()
+    for media_file in media_iter():
+        stats.files_total += 1
+        keyname = key_prefix + media_file.key
+        if known.get(keyname) == (media_file.size, media_file.mtime_ns):
+            stats.files_skipped += 1
+            continue
+
+        local[keyname] = media_file
+        prefixes.add(_listing_prefix(media_file.key))
+
+    return local, prefixes
+
+
+def list_objects(prefix: str) -> Iterator[RemoteObject]:
+    """Yields all objects in the bucket whose key starts with `prefix`
+
+    Pages through `list_objects_v2` results i.e. sends one request
+    per 1000 keys.
+    """
+    paginator = get_client().get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=get_bucket_name(), Prefix=prefix):
+        for item in page.get('Contents', []):
+            yield RemoteObject(
+                key=item['Key'],
+                size=item['Size'],
+                etag=item['ETag'].strip('"'),
+                last_modified=item['LastModified'].timestamp(),
+            )
+
+
+def list_remote_objects(
+    prefixes: Iterable[str],
+    max_workers: int,
+    engine: StorageEngine | None = None
+) -> dict[str, RemoteObject]:
+    """Returns all objects found under any of `prefixes` keyed by key name
+
+    Prefixes are listed concurrently by `max_workers` threads (or by
+    the asyncio engine, see `s3worker.aio`).
+    """
+    if _use_asyncio(engine):
+        from s3worker import aio
+
+        return aio.list_remote_objects(prefixes)
+
+    objects = {}
+    for prefix, future in utils.bounded_imap(
+        lambda prefix: list(list_objects(prefix)),
+        prefixes,
+        max_workers=max_workers
+    ):
+        for obj in future.result():
+            objects[obj.key] = obj
+
+    return objects
+
+
+def list_thumbnail_ids(max_workers: int | None = None) -> set[str]:
+    """Returns IDs of documents/pages whose "sm" thumbnail is in the bucket
+
+    Lists the 256 shard folders of "thumbnails/jpg/" concurrently by
+    `max_workers` threads, i.e. sends one request per 1000 thumbnails
+    instead of one `head_object` per document.
+    """
+    if max_workers is None:
+        max_workers = settings.pm_sync_workers
+
+    thumbnails_prefix = f"{_key_prefix()}{const.THUMBNAILS}/{const.JPG}/"
+    suffix = f"/{ImagePreviewSize.sm.value}.{const.JPG}"
+
+    def _list(shard: str) -> list[str]:
+        # keys are ".../thumbnails/jpg/ab/cd/<uuid>/sm.jpg"
+        return [
+            obj.key.rsplit('/', 2)[-2]
+            for obj in list_objects(f"{thumbnails_prefix}{shard}/")
+            if obj.key.endswith(suffix)
+        ]
+
+    ids = set()
+    for _, future in utils.bounded_imap(
+        _list, [f"{i:02x}" for i in range(256)], max_workers=max_workers
+    ):
+        ids.update(future.result())
+
+    return ids
+
+
+def _listing_prefix(rel_path: str) -> str:
+    """Returns listing prefix of the shard `rel_path` belongs to"""
+    shard = plib.shard_prefix(rel_path)
+    if shard == rel_path:
+        return _key_prefix() + shard
+
+    return f"{_key_prefix()}{shard}/"
+
+
+def _key_prefix() -> str:
+    """Returns `pm_prefix` ready to be prepended to relative keys"""
+    prefix = get_prefix().as_posix()
+    if prefix == '.':
+        return ''
+
+    return f"{prefix}/"
 
 
 def download_docver(docver_id: UUID, file_name: str):
-    """Downloads document version from S3/R2"""
+    """Downloads document version from S3/R2
+
+    Concurrent calls for the same document version are single-flight:
+    one caller downloads, the others wait and find the file in place.
+    File is downloaded into `const.TMP_DIR` and atomically moved to its
+    final path, thus a partially written file is never visible. Its mtime
+    is the object's LastModified, thus `sync` does not upload it back.
+    """
+    cache.unpin(_pinned_docver(docver_id, file_name))
+
+
+def _pinned_docver(docver_id: UUID, file_name: str) -> int:
+    """Downloads document version, if needed, and pins it in docver cache
+
+    The file is pinned before it is registered in the cache (which evicts
+    other files), so neither this nor a concurrent eviction can remove it
+    before the caller uses it. Returns file descriptor to pass to
+    `cache.unpin`.
+    """
     doc_ver_path = plib.abs_docver_path(docver_id, file_name)
     keyname = Path(get_prefix()) / plib.docver_path(docver_id, file_name)
 
-    if doc_ver_path.exists():
-        # file exists locally, nothing to do
-        logger.debug(f"{doc_ver_path} exists locally")
-        return
+    for _ in range(3):
+        try:
+            return cache.pin(doc_ver_path)
+        except FileNotFoundError:
+            pass
 
-    if not s3_obj_exists(get_bucket_name(), str(keyname)):
-        # no local version + no remote version
-        logger.debug(f"{keyname} was not found in storage")
-        raise S3DocumentNotFound(f"Storage key {keyname} not found")
+        try:
+            fd = _download_docver(str(keyname), doc_ver_path)
+        except FileNotFoundError:
+            # folder was removed by a concurrent eviction, try again
+            continue
 
-    client = get_client()
+        if fd is None:
+            # downloaded by concurrent task and evicted already
+            continue
+
+        cache.register(doc_ver_path)
+        return fd
+
+    raise DocverEvicted(f"{doc_ver_path} keeps being evicted")
+
+
+def _download_docver(keyname: str, doc_ver_path: Path) -> int | None:
+    """Downloads `keyname` to `doc_ver_path` unless a concurrent task
+    did so; returns fd of a pin on the downloaded file, None otherwise"""
     doc_ver_path.parent.mkdir(parents=True, exist_ok=True)
-    client.download_file(get_bucket_name(), str(keyname), str(doc_ver_path))
+    with locks.single_flight(keyname, doc_ver_path.parent):
+        if doc_ver_path.exists():
+            logger.debug(f"{doc_ver_path} was downloaded by concurrent task")
+            return None
+
+        try:
+            _download_atomic(keyname, doc_ver_path)
+        except ClientError as ex:
+            if error_code(ex) not in ("404", "NoSuchKey"):
+                raise
+            # no local version + no remote version
+            logger.debug(f"{keyname} was not found in storage")
+            raise S3DocumentNotFound(f"Storage key {keyname} not found")
+
+        return cache.pin(doc_ver_path)
+
+
+def _download_atomic(keyname: str, target: Path, mtime: float | None = None):
+    """Downloads `keyname` into `const.TMP_DIR` and moves it to `target`
+
+    File gets `mtime` or, if not given, the object's LastModified (one
+    `head_object` request) as mtime, so that `sync` sees it unchanged.
+    """
+    if mtime is None:
+        response = get_client().head_object(Bucket=get_bucket_name(), Key=keyname)
+        mtime = response['LastModified'].timestamp()
+
+    tmp_dir = Path(settings.pm_media_root) / const.TMP_DIR
+    tmp_dir.mkdir(exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix=target.suffix)
+    os.close(fd)
+    try:
+        get_client().download_file(
+            get_bucket_name(),
+            keyname,
+            tmp_path,
+            Config=get_transfer_config()
+        )
+        os.utime(tmp_path, (mtime, mtime))
+        os.replace(tmp_path, target)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def pull(
+    subtrees: list[str] | None = None,
+    shards: list[str] | None = None,
+    max_workers: int | None = None,
+    max_bytes: int | None = None
+) -> schemas.PullStats:
+    """Downloads objects under `pm_prefix` which are missing in media root
+
+    Only `subtrees` (folders relative to media root, by default
+    `const.SHARDED_DIRS`) are pulled; sharded ones only for `shards`
+    (e.g. `plib.shard_range("00-3f")`, by default all of them). Listings
+    run per shard folder, downloads concurrently by `max_workers` threads.
+
+    Local files of the same size as the object are skipped, so an
+    interrupted pull is resumed by running it again. Each file is
+    downloaded into `const.TMP_DIR` and atomically moved into place with
+    the object's LastModified as mtime and recorded in the sync manifest,
+    thus `sync` does not upload it back. Once downloads add up to
+    `max_bytes`, objects which do not fit anymore are skipped.
+    """
+    if max_workers is None:
+        max_workers = settings.pm_sync_workers
+
+    started = time.monotonic()
+    stats = schemas.PullStats()
+    key_prefix = _key_prefix()
+    remote = list_remote_objects(
+        _pull_prefixes(subtrees, shards), max_workers=max_workers
+    )
+
+    budget = max_bytes
+    to_download = []
+    for keyname in sorted(remote):
+        obj = remote[keyname]
+        if keyname.endswith('/'):
+            # folder placeholder
+            continue
+
+        stats.files_total += 1
+        target = plib.rel2abs(keyname[len(key_prefix):])
+        try:
+            if target.stat().st_size == obj.size:
+                stats.files_present += 1
+                continue
+        except FileNotFoundError:
+            pass
+
+        if budget is not None:
+            if obj.size > budget:
+                stats.files_over_budget += 1
+                continue
+            budget -= obj.size
+
+        to_download.append((obj, target))
+
+    logger.info(
+        f"{stats.files_total} objects, {stats.files_present} present locally, "
+        f"{len(to_download)} to download"
+    )
+
+    with manifest.writer() as manifest_writer:
+        for (obj, target), future in utils.bounded_imap(
+            lambda item: _pull_object(*item), to_download, max_workers=max_workers
+        ):
+            try:
+                stat = future.result()
+            except Exception as ex:
+                stats.files_failed += 1
+                logger.error(f"Failed to download {obj.key} to {target}: {ex}")
+                continue
+
+            stats.files_downloaded += 1
+            stats.bytes_downloaded += obj.size
+            if manifest_writer:
+                manifest_writer.add(
+                    obj.key, stat.st_size, stat.st_mtime_ns, obj.etag
+                )
+
+    stats.elapsed = time.monotonic() - started
+
+    return stats
+
+
+def _pull_prefixes(
+    subtrees: list[str] | None,
+    shards: list[str] | None
+) -> list[str]:
+    """Listing prefixes of `pull`: one per shard folder of sharded subtrees"""
+    if shards is None:
+        shards = [f"{i:02x}" for i in range(256)]
+
+    prefixes = []
+    for subtree in subtrees or const.SHARDED_DIRS:
+        subtree = subtree.strip('/')
+        if subtree in const.SHARDED_DIRS:
+            prefixes.extend(
+                f"{_key_prefix()}{subtree}/{shard}/" for shard in shards
+            )
+        else:
+            prefixes.append(f"{_key_prefix()}{subtree}/")
+
+    return prefixes
+
+
+def _pull_object(obj: RemoteObject, target: Path) -> os.stat_result:
+    """Downloads `obj` to `target`; returns stat of the downloaded file"""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    _download_atomic(obj.key, target, mtime=obj.last_modified)
+    stat = target.stat()
+    if obj.key.startswith(f"{_key_prefix()}{const.DOCVERS}/"):
+        cache.register(target)
+
+    return stat
+
+
+@contextmanager
+def local_docver(docver_id: UUID, file_name: str) -> Iterator[Path]:
+    """Yields absolute path of the document version, downloading it if needed
+
+    The file is protected from docver cache eviction until the `with`
+    block exits.
+    """
+    fd = _pinned_docver(docver_id, file_name)
+    try:
+        yield plib.abs_docver_path(docver_id, file_name)
+    finally:
+        cache.unpin(fd)
 
 
 def s3_obj_exists(
@@ -306,6 +1052,52 @@ def s3_obj_exists(
     return True
 
 
+def head_objects(
+    keynames: list[str],
+    max_workers: int | None = None,
+    engine: StorageEngine | None = None
+) -> dict[str, RemoteObject | None]:
+    """Existence check of many keys: returns object of each of `keynames`,
+    None for the ones not in the bucket
+
+    Sends one `head_object` per key, concurrently by `max_workers` threads
+    (or by the asyncio engine, see `s3worker.aio`). To check keys sharing
+    a folder, `list_remote_objects` needs fewer requests.
+    """
+    if max_workers is None:
+        max_workers = settings.pm_sync_workers
+
+    if _use_asyncio(engine):
+        from s3worker import aio
+
+        return aio.head_objects(keynames)
+
+    return {
+        keyname: future.result()
+        for keyname, future in utils.bounded_imap(
+            _head_object, keynames, max_workers=max_workers
+        )
+    }
+
+
+def _head_object(keyname: str) -> RemoteObject | None:
+    try:
+        response = get_client().head_object(
+            Bucket=get_bucket_name(), Key=keyname
+        )
+    except ClientError as ex:
+        if error_code(ex) in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+    return RemoteObject(
+        key=keyname,
+        size=response['ContentLength'],
+        etag=response['ETag'].strip('"'),
+        last_modified=response['LastModified'].timestamp(),
+    )
+
+
 def generate_presigned_url(keyname: str, expires_in: int | None = None) -> str:
     """
     Generate a presigned URL for downloading an object.
@@ -334,22 +1126,9 @@ def generate_presigned_url(keyname: str, expires_in: int | None = None) -> str:
     return url
 
 
-def media_iter():
-    paths = Path(get_media_root()).glob("**/*")
-    prefix = get_prefix()
-    logger.debug(f"PREFIX={prefix}")
-    for path in paths:
-        if path.is_file():
-            str_path = str(path)
-            str_media = str(get_media_root())
-            str_rel_path = str_path[len(str_media) + 1:]
-            keyname = prefix / Path(str_rel_path)
-            logger.debug(f"str_path={str_path}")
-            logger.debug(f"str_media={str_media}")
-            logger.debug(f"str_rel_path={str_rel_path}")
-            logger.debug(f"keyname={keyname}")
-            logger.debug(f"path={path}")
-            yield path, keyname
+def media_iter() -> Iterator[MediaFile]:
+    """Yields all files in media root as (relative key, size, mtime_ns)"""
+    return walk.iter_media(get_media_root(), max_workers=settings.pm_sync_workers)
 
 
 def get_bucket_name():
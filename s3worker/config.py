@@ -1,4 +1,5 @@
 from enum import Enum
+from functools import cache
 from pathlib import Path
 
 from pydantic import PostgresDsn, RedisDsn, computed_field, model_validator
@@ -19,6 +20,31 @@ class StorageBackend(str, Enum):
     CLOUDFLARE = 'cloudflare'
 
 
+class RetryMode(str, Enum):
+    """botocore retry mode"""
+    LEGACY = 'legacy'
+    STANDARD = 'standard'
+    ADAPTIVE = 'adaptive'
+
+
+class PdfRenderer(str, Enum):
+    """Backend used to rasterize PDF pages"""
+    PDFTOPPM = 'pdftoppm'  # poppler-utils subprocess
+    PDFIUM = 'pdfium'  # in-process, requires pypdfium2
+
+
+class DbPool(str, Enum):
+    """SQLAlchemy connection pool"""
+    QUEUE = 'queue'  # pool of up to pool size + max overflow connections
+    NULL = 'null'  # no pooling, connection per checkout (e.g. pgbouncer)
+
+
+class StorageEngine(str, Enum):
+    """How bulk operations (sync, bulk delete) talk to S3/R2"""
+    THREADS = 'threads'  # boto3 client shared by a thread pool
+    ASYNCIO = 'asyncio'  # aiobotocore, see `s3worker.aio`
+
+
 class Settings(BaseSettings):
     # Storage backend selection (aws or cloudflare)
     pm_storage_backend: StorageBackend = StorageBackend.AWS
@@ -27,6 +53,8 @@ class Settings(BaseSettings):
     aws_access_key_id: str | None = None
     aws_secret_access_key: str | None = None
     aws_region_name: str | None = None
+    # S3 compatible endpoint (e.g. MinIO, moto server); None - AWS endpoint
+    aws_endpoint_url: str | None = None
 
     # Cloudflare R2 specific configurations
     r2_access_key_id: str | None = None
@@ -36,6 +64,17 @@ class Settings(BaseSettings):
     pm_db_url: PostgresDsn
     pm_redis_url: RedisDsn | None = None
 
+    # Database connection pool (per process)
+    pm_db_pool: DbPool = DbPool.QUEUE
+    pm_db_pool_size: int = 5
+    pm_db_max_overflow: int = 10
+    pm_db_pool_pre_ping: bool = False
+    pm_db_pool_recycle: int = -1  # seconds; -1 - never recycle
+    pm_db_statement_timeout: int | None = None  # milliseconds
+    # Don't use server side prepared statements, which do not work
+    # with pgbouncer in transaction pooling mode (before pgbouncer 1.21)
+    pm_db_pgbouncer: bool = False
+
     pm_file_server: FileServer = FileServer.S3
     pm_s3_bucket_name: str  # Used for both S3 and R2
 
@@ -48,10 +87,82 @@ class Settings(BaseSettings):
     pm_preview_page_size_lg: int = 900  # pixels
     pm_preview_page_size_xl: int = 1600  # pixels
     pm_thumbnail_size: int = 100  # pixels
+    pm_pdf_renderer: PdfRenderer = PdfRenderer.PDFTOPPM
 
     # Presigned URL expiration (in seconds) - used for R2
     presigned_url_expires: int = 3600  # 1 hour
 
+    # Number of concurrent listings/uploads performed by `s3w sync`
+    pm_sync_workers: int = 16
+    # Number of concurrent uploads within one task (e.g. page previews)
+    pm_upload_workers: int = 8
+    # Number of concurrent listings/`delete_objects` requests of bulk deletes
+    pm_delete_workers: int = 4
+    # Local SQLite manifest of uploaded files, used by `s3w sync` to skip
+    # unchanged files. Defaults to "<pm_media_root>.manifest.sqlite"
+    pm_sync_manifest: bool = True
+    pm_sync_manifest_path: Path | None = None
+    # `s3w sync` re-uploads files whose size differs from the object's
+    # or which were modified after the object's LastModified. With
+    # verify hash, files which look unchanged are also compared by ETag
+    # (reads every such file)
+    pm_sync_verify_hash: bool = False
+
+    # Downloaded document versions are evicted (least recently used first)
+    # once their total size exceeds max bytes; None - never evicted.
+    # Index defaults to "<pm_media_root>.docvers-cache.sqlite"
+    pm_docver_cache_max_bytes: int | None = None
+    pm_docver_cache_index_path: Path | None = None
+
+    # Concurrent downloads of the same document version are coordinated
+    # with a file lock; with `pm_download_lock_redis` also with a Redis lock
+    # (on `pm_redis_url`), so that only one node downloads a file into
+    # a shared media root
+    pm_download_lock_redis: bool = False
+    pm_download_lock_timeout: int = 300  # seconds
+
+    # Coalesce deletes: remove tasks only add key prefixes to a Redis set
+    # (on `pm_redis_url`), which the periodic flush task (celery beat)
+    # drains every `pm_delete_flush_interval` seconds with bulk deletes
+    pm_delete_coalesce: bool = False
+    pm_delete_flush_interval: float = 5  # seconds
+    pm_delete_flush_batch_size: int = 10000  # prefixes per bulk delete
+
+    # Prometheus metrics (see `s3worker.metrics`); None - disabled
+    pm_metrics_port: int | None = None
+    # Folder for samples of all worker processes; default - temporary folder
+    pm_metrics_dir: Path | None = None
+
+    # Per-task profiler (see `s3worker.profiling`)
+    pm_profile: bool = False
+    pm_profile_sample_rate: float = 1.0  # share of profiled tasks, 0..1
+    pm_profile_slow_threshold: float = 10  # seconds
+    # Folder of cProfile dumps; default - "s3worker-profiles" in temp folder
+    pm_profile_dir: Path | None = None
+
+    # Engine of bulk operations; `asyncio` requires aiobotocore
+    # (pip install 's3worker[aio]') and keeps up to `pm_aio_max_concurrency`
+    # requests in flight from one process
+    pm_storage_engine: StorageEngine = StorageEngine.THREADS
+    pm_aio_max_concurrency: int = 256
+    # bodies of single request uploads held in memory at once, per process
+    pm_aio_max_upload_bytes: int = 256 * 1024 * 1024
+
+    # Multipart transfer settings shared by all uploads and downloads
+    pm_transfer_multipart_threshold: int = 8 * 1024 * 1024  # bytes
+    pm_transfer_multipart_chunksize: int = 8 * 1024 * 1024  # bytes
+    pm_transfer_max_concurrency: int = 10  # threads per transfer
+    pm_transfer_use_threads: bool = True
+
+    # S3/R2 client connection settings. Pool size should be at least the
+    # number of threads using the client at once (e.g. `pm_sync_workers`)
+    pm_s3_max_pool_connections: int = 50
+    pm_s3_tcp_keepalive: bool = True
+    pm_s3_connect_timeout: int = 10  # seconds
+    pm_s3_read_timeout: int = 60  # seconds
+    pm_s3_retry_mode: RetryMode = RetryMode.STANDARD
+    pm_s3_max_attempts: int = 5  # including the initial request
+
     @computed_field
     @property
     def db_url(self) -> str:
@@ -85,5 +196,10 @@ class Settings(BaseSettings):
         return self
 
 
-def get_settings():
+@cache
+def get_settings() -> Settings:
+    """Returns settings, read from environment on first call only
+
+    Call `get_settings.cache_clear()` to re-read the environment.
+    """
     return Settings()
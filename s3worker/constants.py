@@ -10,12 +10,19 @@ PAGES = 'pages'
 THUMBNAILS = 'thumbnails'
 DOCVERS = 'docvers'
 OCR = 'ocr'
+# Folders (relative to media root) whose content is sharded by the first
+# two hex chars of the UUID e.g. docvers/ab/cd/abcd1234.../
+SHARDED_DIRS = (DOCVERS, f"{THUMBNAILS}/{JPG}", f"{OCR}/{PAGES}")
+# Folder (relative to media root) of partial downloads; it is never synced
+TMP_DIR = '.tmp'
 S3_WORKER_ADD_DOC_VER = 's3_worker_add_doc_vers'
 S3_WORKER_REMOVE_DOC_VER = 's3_worker_remove_doc_vers'
 S3_WORKER_REMOVE_DOC_THUMBNAIL = 's3_worker_remove_doc_thumbnail'
 S3_WORKER_REMOVE_DOCS_THUMBNAIL = 's3_worker_remove_docs_thumbnail'
 S3_WORKER_REMOVE_PAGE_THUMBNAIL = 's3_worker_remove_page_thumbnail'
 S3_WORKER_GENERATE_PREVIEW = 's3_worker_generate_preview'
+# periodic task which drains buffer of coalesced deletes
+S3_WORKER_FLUSH_DELETES = 's3_worker_flush_deletes'
 # generate document thumbnail preview i.e. one single image
 # as preview for the whole document
 S3_WORKER_GENERATE_DOC_THUMBNAIL = "s3_worker_generate_doc_thumbnail"
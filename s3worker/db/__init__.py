@@ -3,7 +3,13 @@ from .orm import User, Folder, Document, DocumentVersion, Page
 from .api import (
     get_last_version,
     get_pages,
+    get_pages_doc_ver,
+    get_doc_ver_pages,
     get_docs,
+    get_docs_last_version,
+    iter_docs_last_version,
+    count_docs_last_version,
+    claim_doc_img_preview,
     update_doc_img_preview_status,
     get_doc_img_preview_status,
     get_doc_ver_from_page,
@@ -14,7 +20,13 @@ from .api import (
 __all__ = [
     'get_last_version',
     'get_docs',
+    'get_docs_last_version',
+    'iter_docs_last_version',
+    'count_docs_last_version',
     'get_pages',
+    'get_pages_doc_ver',
+    'get_doc_ver_pages',
+    'claim_doc_img_preview',
     'update_doc_img_preview_status',
     'get_doc_img_preview_status',
     'get_doc_ver_from_page',
@@ -1,7 +1,8 @@
+import itertools
 from uuid import UUID
-from sqlalchemy import select
+from sqlalchemy import Row, func, select, update
 
-from typing import Tuple
+from typing import Iterable, Iterator, Tuple
 from s3worker import schemas, types
 from s3worker.db.orm import (Document, DocumentVersion, Page)
 from s3worker.db.engine import Session
@@ -18,6 +19,93 @@ def get_docs(db_session: Session) -> list[schemas.Document]:
     return model_docs
 
 
+def get_docs_last_version(db_session: Session) -> list[types.DocLastVersion]:
+    """
+    Returns ID, last version ID and its file name of all documents
+
+    Lean alternative to `get_docs` (no ORM objects, no pydantic
+    validation). Documents without versions are not included.
+    For large tables prefer `iter_docs_last_version`.
+    """
+    return list(iter_docs_last_version(db_session))
+
+
+def iter_docs_last_version(
+    db_session: Session,
+    after: UUID | None = None,
+    batch_size: int = 1000,
+) -> Iterator[types.DocLastVersion]:
+    """
+    Yields ID, last version ID and its file name of all documents
+    ordered by document ID
+
+    Documents are fetched in keyset paginated batches of `batch_size`:
+
+        SELECT DISTINCT ON (document_id) ... WHERE document_id > :last
+        ORDER BY document_id, number DESC LIMIT :batch_size
+
+    i.e. every batch reads only the versions of its own documents (from
+    the `document_id` index), not the whole table. Each batch is streamed
+    from a server side cursor, so memory usage does not depend on number
+    of documents. If `after` is given, only documents with ID greater
+    than `after` are yielded i.e. the walk resumes after that document.
+    Transaction is committed after each batch, so that no transaction
+    stays open for the whole walk.
+    """
+    stmt = select(
+        DocumentVersion.document_id,
+        DocumentVersion.id,
+        DocumentVersion.file_name,
+    ).distinct(
+        DocumentVersion.document_id
+    ).order_by(
+        DocumentVersion.document_id,
+        DocumentVersion.number.desc(),
+    ).limit(batch_size).execution_options(yield_per=batch_size)
+
+    while True:
+        batch_stmt = stmt
+        if after is not None:
+            batch_stmt = stmt.where(DocumentVersion.document_id > after)
+
+        count = 0
+        for row in db_session.execute(batch_stmt):
+            count += 1
+            after = row.document_id
+            yield types.DocLastVersion(*row)
+
+        db_session.commit()
+        if count < batch_size:
+            return
+
+
+def count_docs_last_version(
+    db_session: Session,
+    after: UUID | None = None,
+    doc_ids: Iterable[UUID] | None = None,
+    batch_size: int = 1000,
+) -> int:
+    """
+    Returns number of documents `iter_docs_last_version` yields
+    (with the same `after`)
+
+    If `doc_ids` is given, only these documents are counted (IDs which
+    are not a document with a version are ignored); they are looked up
+    in batches of `batch_size`.
+    """
+    stmt = select(func.count(DocumentVersion.document_id.distinct()))
+    if after is not None:
+        stmt = stmt.where(DocumentVersion.document_id > after)
+
+    if doc_ids is None:
+        return db_session.scalar(stmt)
+
+    return sum(
+        db_session.scalar(stmt.where(DocumentVersion.document_id.in_(batch)))
+        for batch in itertools.batched(doc_ids, batch_size)
+    )
+
+
 def get_last_version(
     db_session: Session,
     doc_id: UUID
@@ -61,6 +149,48 @@ def get_pages(
     return list(models)
 
 
+def get_pages_doc_ver(
+    db_session: Session,
+    page_ids: list[UUID]
+) -> list[Row]:
+    """
+    Returns page number and document version (id and file name)
+    of each of the pages identified by page_ids.
+
+    Rows have following attributes: `page_id`, `number`, `doc_ver_id`
+    and `file_name`.
+    """
+    stmt = _pages_doc_ver_stmt().where(Page.id.in_(page_ids))
+
+    return list(db_session.execute(stmt).all())
+
+
+def get_doc_ver_pages(
+    db_session: Session,
+    doc_ver_id: UUID
+) -> list[Row]:
+    """
+    Returns all pages of the document version identified by doc_ver_id
+    ordered by page number, as rows of `get_pages_doc_ver`.
+    """
+    stmt = _pages_doc_ver_stmt().where(
+        Page.document_version_id == doc_ver_id
+    ).order_by(Page.number)
+
+    return list(db_session.execute(stmt).all())
+
+
+def _pages_doc_ver_stmt():
+    return select(
+        Page.id.label("page_id"),
+        Page.number,
+        DocumentVersion.id.label("doc_ver_id"),
+        DocumentVersion.file_name,
+    ).join(
+        DocumentVersion, Page.document_version_id == DocumentVersion.id
+    )
+
+
 def get_doc_img_preview_status(
     db_session: Session,
     doc_id: UUID
@@ -70,6 +200,48 @@ def get_doc_img_preview_status(
 
     return doc.preview_status
 
+def claim_doc_img_preview(
+    db_session: Session,
+    doc_id: UUID
+) -> Row | None:
+    """
+    Atomically claims generation of the document's preview image.
+
+    In one statement sets `preview_status` to "pending", provided that
+    nobody claimed it before (i.e. status is NULL), and selects the last
+    version of the document. Commits the claim.
+
+    Returns None if the document does not exist or was already claimed.
+    Otherwise returns row with `doc_ver_id` and `file_name` attributes
+    (both None if the document has no version).
+    """
+    documents = Document.__table__
+    claimed = update(documents).where(
+        documents.c.node_id == doc_id,
+        documents.c.preview_status.is_(None),
+    ).values(
+        preview_status=ImagePreviewStatus.pending
+    ).returning(documents.c.node_id).cte("claimed")
+
+    stmt = select(
+        DocumentVersion.id.label("doc_ver_id"),
+        DocumentVersion.file_name,
+    ).select_from(claimed).outerjoin(
+        DocumentVersion, DocumentVersion.document_id == claimed.c.node_id
+    ).order_by(
+        DocumentVersion.number.desc().nulls_last()
+    ).limit(1)
+
+    try:
+        row = db_session.execute(stmt).one_or_none()
+        db_session.commit()
+    except Exception as e:
+        db_session.rollback()
+        raise e
+
+    return row
+
+
 def update_doc_img_preview_status(
     db_session: Session,
     doc_id: UUID,
@@ -1,14 +1,48 @@
 from sqlalchemy import create_engine, Engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
-from s3worker.config import get_settings
+from s3worker.config import DbPool, get_settings
 
 settings = get_settings()
 
-engine = create_engine(settings.db_url)
+
+def create_db_engine() -> Engine:
+    """Creates engine configured by `pm_db_*` settings"""
+    kwargs = {
+        "pool_pre_ping": settings.pm_db_pool_pre_ping,
+    }
+    if settings.pm_db_pool == DbPool.NULL:
+        kwargs["poolclass"] = NullPool
+    else:
+        kwargs["pool_size"] = settings.pm_db_pool_size
+        kwargs["max_overflow"] = settings.pm_db_max_overflow
+        kwargs["pool_recycle"] = settings.pm_db_pool_recycle
+
+    connect_args = {}
+    if settings.pm_db_statement_timeout is not None:
+        connect_args["options"] = (
+            f"-c statement_timeout={settings.pm_db_statement_timeout}"
+        )
+    if settings.pm_db_pgbouncer:
+        connect_args["prepare_threshold"] = None
+
+    return create_engine(settings.db_url, connect_args=connect_args, **kwargs)
+
+
+engine = create_db_engine()
 
 Session = sessionmaker(engine, expire_on_commit=False)
 
 
 def get_engine() -> Engine:
     return engine
+
+
+def reset_engine():
+    """Drops connection pool inherited from the parent process
+
+    Connections of the parent are left untouched (they are still used
+    by the parent), this process opens its own connections on demand.
+    """
+    engine.dispose(close=False)
@@ -0,0 +1,146 @@
+"""
+Redis buffer of coalesced deletes.
+
+Users deleting folders or re-ordering pages trigger bursts of tiny
+remove tasks. With `pm_delete_coalesce` enabled, remove tasks only add
+key prefixes to a Redis sorted set (duplicates collapse) and the periodic
+`s3_worker_flush_deletes` task drains the set, so that thousands of
+pending deletes end up in a few bulk `delete_objects` requests.
+
+Each prefix is scored with the time it was queued. Flush deletes only
+objects last modified before the second it was queued in: an object
+uploaded again under a queued prefix (e.g. regenerated thumbnail)
+survives the flush. LastModified has a resolution of one second, thus
+objects uploaded within the same second as the delete request are kept
+too, even if uploaded before it.
+
+Prefixes stay in the set until their objects are deleted, so a flush
+interrupted in any way (including a killed worker) is repeated by the
+next one. Requires Redis >= 6.2 (`ZADD ... GT`, `ZMSCORE`).
+"""
+import logging
+import math
+import time
+
+import redis
+
+from s3worker import client, config
+from s3worker.locks import get_redis
+from s3worker.types import DeleteError
+
+settings = config.get_settings()
+logger = logging.getLogger(__name__)
+
+BUFFER_KEY = "s3worker:delete-prefixes"
+
+
+def push(prefixes: list[str], queued_at: float | None = None):
+    """Adds key prefixes to be deleted on next flush
+
+    Prefixes are scored with `queued_at` (default: now); a prefix queued
+    again keeps the later time.
+    """
+    if not prefixes:
+        return
+
+    if queued_at is None:
+        queued_at = time.time()
+
+    get_redis().zadd(
+        BUFFER_KEY, {prefix: queued_at for prefix in prefixes}, gt=True
+    )
+
+
+def peek(count: int) -> dict[str, float]:
+    """Returns up to `count` longest queued prefixes (without removing
+    them) with the time each of them was queued at, keyed by prefix"""
+    return {
+        prefix.decode(): queued_at
+        for prefix, queued_at in get_redis().zrange(
+            BUFFER_KEY, 0, count - 1, withscores=True
+        )
+    }
+
+
+def remove(queued: dict[str, float]):
+    """Removes prefixes of `queued` from the buffer, unless queued again
+    (with a later time) in the meantime"""
+    prefixes = list(queued)
+
+    def _remove(pipe):
+        scores = pipe.zmscore(BUFFER_KEY, prefixes)
+        done = [
+            prefix for prefix, score in zip(prefixes, scores)
+            if score == queued[prefix]
+        ]
+        pipe.multi()
+        if done:
+            pipe.zrem(BUFFER_KEY, *done)
+
+    get_redis().transaction(_remove, BUFFER_KEY)
+
+
+def flush(batch_size: int | None = None) -> list[DeleteError]:
+    """Deletes objects of all buffered prefixes, `batch_size` at a time
+
+    Only objects last modified before their prefix was queued are
+    deleted. Prefixes are removed from the buffer once their batch is
+    done; a batch which failed as a whole (e.g. storage not reachable)
+    stays there for the next flush. Returns per-key delete errors.
+    """
+    if batch_size is None:
+        batch_size = settings.pm_delete_flush_batch_size
+
+    errors = []
+    while queued := peek(batch_size):
+        logger.info(f"Flushing {len(queued)} buffered delete prefixes")
+        errors.extend(remove_queued(queued))
+        remove(queued)
+
+        if len(queued) < batch_size:
+            break
+
+    return errors
+
+
+def remove_queued(queued: dict[str, float]) -> list[DeleteError]:
+    """Removes objects under prefixes of `queued` which were last
+    modified before (the second) their prefix was queued"""
+    objects = client.list_remote_objects(
+        queued, max_workers=settings.pm_delete_workers
+    )
+    # key may be under several (nested) prefixes, the latest one counts
+    lengths = {len(prefix) for prefix in queued}
+    keynames = [
+        obj.key for obj in objects.values()
+        if obj.last_modified < math.floor(max(
+            queued.get(obj.key[:length], 0) for length in lengths
+        ))
+    ]
+    if len(keynames) < len(objects):
+        logger.info(
+            f"Keeping {len(objects) - len(keynames)} objects uploaded "
+            "after their delete was queued"
+        )
+    if not keynames:
+        return []
+
+    return client.delete_keys(keynames, max_workers=settings.pm_delete_workers)
+
+
+def remove_prefixes(prefixes: list[str]) -> list[DeleteError]:
+    """Removes objects under `prefixes` now or buffers them
+
+    Buffers if `pm_delete_coalesce` is enabled, falling back to removing
+    right away if Redis is not reachable.
+    """
+    if not settings.pm_delete_coalesce:
+        return client.remove_prefixes(prefixes)
+
+    try:
+        push(prefixes)
+    except redis.RedisError as ex:
+        logger.warning(f"Failed to buffer deletes, deleting now: {ex}")
+        return client.remove_prefixes(prefixes)
+
+    return []
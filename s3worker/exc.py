@@ -2,6 +2,14 @@ class S3DocumentNotFound(Exception):
     """Raised when document is not found on S3"""
     ...
 
+class DocverEvicted(Exception):
+    """Raised when downloaded document version keeps being evicted from
+    docver cache by concurrent tasks before it can be used
+
+    Retrying does not help, docver cache is too small for the workload.
+    """
+    ...
+
 class PageNotFound(Exception):
     """Raised when document is not found on S3"""
     ...
@@ -1,42 +1,145 @@
+from __future__ import annotations
+
 import logging
+from collections import defaultdict
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Iterator
 from uuid import UUID
-from sqlalchemy.orm import Session
 
-from . import db, image
+from . import client, image
 from . import plib, config
-from .types import ImagePreviewSize
+from .config import FileServer
+from .types import DocLastVersion, ImagePreviewSize
+
+if TYPE_CHECKING:
+    from sqlalchemy import Row
+    from sqlalchemy.orm import Session
 
 
 settings = config.get_settings()
 
 logger = logging.getLogger(__name__)
 
+# width in pixels of page preview images
+PAGE_PREVIEW_SIZES = {
+    ImagePreviewSize.sm: settings.pm_preview_page_size_sm,
+    ImagePreviewSize.md: settings.pm_preview_page_size_md,
+    ImagePreviewSize.lg: settings.pm_preview_page_size_lg,
+    ImagePreviewSize.xl: settings.pm_preview_page_size_xl,
+}
+
 
 def doc_thumbnail(
     db_session: Session,
     doc_id: UUID,
     size_px: int = settings.pm_thumbnail_size
-) -> Path:
-    logger.info(f"Generating thumbnail for doc_id={doc_id}")
+) -> tuple[Path, bytes]:
+    """Generates document thumbnail in memory
+
+    Returns relative path of the thumbnail (i.e. storage keyname
+    without prefix) and its jpeg data.
+    """
+    from . import db
 
     last_ver = db.get_last_version(db_session, doc_id)
 
-    abs_thumbnail_path = plib.rel2abs(
-        plib.thumbnail_path(doc_id, size=ImagePreviewSize.sm)
-    )
-    pdf_path = last_ver.abs_file_path
-
-    logger.debug(f"Generating thumbnail for: doc_ver={last_ver}")
-    logger.debug(f"pdf_path: {pdf_path}")
-    logger.debug(f"output_folder: {abs_thumbnail_path.parent}, size_px={size_px}")
-    image.generate_preview(
-        pdf_path=pdf_path,
-        output_folder=abs_thumbnail_path.parent,
-        size_px=size_px,
-        size_name="sm"
+    return doc_ver_thumbnail(
+        doc_id, last_ver.id, last_ver.file_name, size_px=size_px
     )
 
+
+def doc_ver_thumbnail(
+    doc_id: UUID,
+    doc_ver_id: UUID,
+    file_name: str,
+    size_px: int = settings.pm_thumbnail_size
+) -> tuple[Path, bytes]:
+    """Generates thumbnail of the document from its (last) version
+
+    Same as `doc_thumbnail`, for callers which already know the
+    document version.
+    """
+    logger.info(f"Generating thumbnail for doc_id={doc_id}")
+
+    pdf_path = plib.abs_docver_path(doc_ver_id, file_name)
+
+    logger.debug(f"Generating thumbnail for: doc_ver_id={doc_ver_id}")
+    logger.debug(f"pdf_path: {pdf_path}, size_px={size_px}")
+    data = image.render_preview(pdf_path=pdf_path, size_px=size_px)
+
     thumb_path = plib.thumbnail_path(doc_id, size=ImagePreviewSize.sm)
     logger.debug(f"thumb_path = {thumb_path}")
-    return thumb_path
+    return thumb_path, data
+
+
+def store_doc_thumbnail(doc: DocLastVersion) -> list[Path]:
+    """Generates thumbnail of the document and stores it (see `store_images`)
+
+    Document version is downloaded first, if it is not present locally.
+    Returns relative paths which failed to upload.
+    """
+    with client.local_docver(doc.doc_ver_id, doc.file_name):
+        thumb_path, data = doc_ver_thumbnail(
+            doc.doc_id, doc.doc_ver_id, doc.file_name
+        )
+
+    return store_images({thumb_path: data})
+
+
+def page_previews(
+    pages: list[Row],
+    sizes: Iterable[ImagePreviewSize],
+) -> Iterator[dict[Path, bytes]]:
+    """Generate preview images of the pages in all `sizes`
+
+    `pages` are rows as returned by `db.get_pages_doc_ver`; their document
+    versions must be present locally. Every page is rasterized only once.
+    Yields previews page by page, as a map of relative path (i.e. storage
+    keyname without prefix) to jpeg data, so that callers can store them
+    before the next page is rendered.
+    """
+    sizes_px = {size: PAGE_PREVIEW_SIZES[size] for size in sizes}
+    by_doc_ver = defaultdict(list)
+    for page in pages:
+        by_doc_ver[(page.doc_ver_id, page.file_name)].append(page)
+
+    for (doc_ver_id, file_name), doc_ver_pages in by_doc_ver.items():
+        pdf_path = plib.abs_docver_path(doc_ver_id, file_name)
+        # document is opened once for all its pages
+        with image.open_pdf(pdf_path) as doc:
+            for page in doc_ver_pages:
+                logger.info(f"Generating previews for page_id={page.page_id}")
+                previews = image.generate_page_previews(
+                    doc,
+                    page_number=page.number,
+                    sizes=sizes_px,
+                )
+                yield {
+                    plib.thumbnail_path(page.page_id, size=size): data
+                    for size, data in previews.items()
+                }
+
+
+def store_images(images: dict[Path, bytes]) -> list[Path]:
+    """Stores generated images keyed by their relative path
+
+    Images are uploaded to S3/R2 straight from memory. They are written
+    to local media root only if `pm_file_server` is `local` or
+    `s3-local-test` (the latter skips the upload).
+    Returns relative paths which failed to upload.
+    """
+    if settings.pm_file_server in (FileServer.LOCAL, FileServer.S3_LOCAL_TEST):
+        save_images(images)
+
+    if settings.pm_file_server == FileServer.S3_LOCAL_TEST:
+        return []
+
+    return client.upload_previews(images)
+
+
+def save_images(images: dict[Path, bytes]):
+    """Writes images to local media root"""
+    for rel_path, data in images.items():
+        abs_path = plib.rel2abs(rel_path)
+        abs_path.parent.mkdir(parents=True, exist_ok=True)
+        abs_path.write_bytes(data)
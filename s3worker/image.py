@@ -1,40 +1,170 @@
+import io
 import logging
+import math
+from contextlib import contextmanager
 from pathlib import Path
-from pdf2image import convert_from_path
+from typing import Iterator, Protocol
 
+from PIL import Image
 
+from s3worker import config, metrics
+from s3worker.config import PdfRenderer
+
+settings = config.get_settings()
 logger = logging.getLogger(__name__)
 
-def file_name_generator(size):
-    yield str(size)
+
+class PdfDocument(Protocol):
+    """Opened PDF document, ready to rasterize its pages"""
+    renderer: PdfRenderer
+
+    def render(self, page_number: int, size_px: int) -> Image.Image:
+        """Rasterizes page `page_number` (starting from 1) `size_px` wide"""
+        ...
+
+    def close(self):
+        ...
+
+
+class PdftoppmDocument:
+    """Renders pages with `pdftoppm` (poppler-utils) via pdf2image
+
+    Each render spawns a `pdftoppm` process, which parses the PDF again.
+    """
+    renderer = PdfRenderer.PDFTOPPM
+
+    def __init__(self, pdf_path: Path):
+        self.pdf_path = pdf_path
+
+    def render(self, page_number: int, size_px: int) -> Image.Image:
+        from pdf2image import convert_from_path
+
+        images = convert_from_path(
+            str(self.pdf_path),
+            first_page=page_number,
+            last_page=page_number,
+            size=(size_px, None),
+        )
+        return images[0]
+
+    def close(self):
+        pass
+
+
+class PdfiumDocument:
+    """Renders pages in-process with pdfium (pypdfium2)
+
+    The PDF is parsed once and kept open until `close`, thus rendering
+    several pages/sizes of the same document needs neither new processes
+    nor re-parsing. pdfium is not thread safe: render from one thread
+    per process only (e.g. Celery prefork pool).
+    """
+    renderer = PdfRenderer.PDFIUM
+
+    def __init__(self, pdf_path: Path):
+        try:
+            import pypdfium2
+        except ImportError as ex:
+            raise RuntimeError(
+                "pdfium renderer requires pypdfium2: pip install 's3worker[pdfium]'"
+            ) from ex
+
+        self._pdf = pypdfium2.PdfDocument(str(pdf_path))
+
+    def render(self, page_number: int, size_px: int) -> Image.Image:
+        page = self._pdf[page_number - 1]
+        try:
+            width = page.get_width()
+            scale = size_px / width
+            # bitmap size is rounded up, float error must not add a pixel
+            while math.ceil(width * scale) > size_px:
+                scale = math.nextafter(scale, 0)
+            bitmap = page.render(scale=scale)
+            return bitmap.to_pil()
+        finally:
+            page.close()
+
+    def close(self):
+        self._pdf.close()
 
 
-def generate_preview(
+RENDERERS: dict[PdfRenderer, type[PdfDocument]] = {
+    PdfRenderer.PDFTOPPM: PdftoppmDocument,
+    PdfRenderer.PDFIUM: PdfiumDocument,
+}
+
+
+@contextmanager
+def open_pdf(
+    pdf_path: Path,
+    renderer: PdfRenderer | None = None
+) -> Iterator[PdfDocument]:
+    """Opens PDF with `renderer` backend (default `pm_pdf_renderer`)"""
+    if renderer is None:
+        renderer = settings.pm_pdf_renderer
+
+    doc = RENDERERS[renderer](pdf_path)
+    try:
+        yield doc
+    finally:
+        doc.close()
+
+
+def render_preview(
     pdf_path: Path,
-    output_folder: Path,
     size_px: int,
-    size_name: str,
     page_number: int = 1,
-):
-    """Generate jpg thumbnail/preview images of PDF document"""
+) -> bytes:
+    """Generate jpg thumbnail/preview image of PDF document in memory"""
     logger.debug(
         f"{pdf_path=},"
-        f"{output_folder=},"
         f"{size_px=},"
-        f"{size_name=},"
         f"{page_number=},"
     )
-    kwargs = {
-        'pdf_path': str(pdf_path),
-        'output_folder': str(output_folder),
-        'fmt': 'jpg',
-        'first_page': page_number,
-        'last_page': page_number,
-        'single_file': True,
-        'size': (size_px, None),
-        'output_file': file_name_generator(size_name)
-    }
-    output_folder.mkdir(exist_ok=True, parents=True)
-
-    # generates jpeg previews of PDF file using pdftoppm (poppler-utils)
-    convert_from_path(**kwargs)
+    with open_pdf(pdf_path) as doc:
+        img = render(doc, page_number, size_px)
+
+    return to_jpeg(img)
+
+
+def render(doc: PdfDocument, page_number: int, size_px: int) -> Image.Image:
+    """Rasterizes page of opened PDF, recording render time"""
+    with metrics.RENDER_SECONDS.labels(doc.renderer.value).time():
+        return doc.render(page_number, size_px)
+
+
+def downscale(img: Image.Image, size_px: int) -> Image.Image:
+    """Resizes `img` to `size_px` width, keeping aspect ratio"""
+    if img.width <= size_px:
+        return img
+
+    height = max(1, round(img.height * size_px / img.width))
+    return img.resize((size_px, height), Image.Resampling.LANCZOS)
+
+
+def to_jpeg(img: Image.Image) -> bytes:
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+def generate_page_previews(
+    doc: PdfDocument,
+    page_number: int,
+    sizes: dict[str, int],
+) -> dict[str, bytes]:
+    """Generate jpg previews of one page of opened PDF in all `sizes`
+
+    `sizes` maps size name to width in pixels. Page is rasterized only
+    once, at the largest size; smaller sizes are derived from it by
+    downscaling in memory. Returns a map of size name to jpeg data.
+    """
+    by_width = sorted(sizes.items(), key=lambda item: item[1], reverse=True)
+    img = render(doc, page_number, by_width[0][1])
+    result = {}
+    for size_name, size_px in by_width:
+        # each size is derived from the next larger one
+        img = downscale(img, size_px)
+        result[size_name] = to_jpeg(img)
+
+    return result
@@ -0,0 +1,97 @@
+"""
+Single-flight coordination of concurrent downloads.
+
+Several tasks (possibly in several worker processes) may need the same
+document version at the same time. `single_flight` lets exactly one of
+them download the file, the others wait for the lock and then find the
+file already in place.
+
+Within one node the lock is an exclusive `flock` on the (local) folder
+of the file. With `pm_download_lock_redis` enabled it is additionally
+a Redis lock, which covers workers on different nodes sharing the same
+media root.
+"""
+import fcntl
+import logging
+import os
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterator
+
+from s3worker import config
+
+if TYPE_CHECKING:
+    import redis
+
+settings = config.get_settings()
+logger = logging.getLogger(__name__)
+
+# Redis client is created lazily, once per process
+_redis: "redis.Redis | None" = None
+_redis_pid: int | None = None
+
+
+def get_redis() -> "redis.Redis":
+    global _redis, _redis_pid
+
+    if _redis is None or _redis_pid != os.getpid():
+        import redis
+
+        _redis = redis.Redis.from_url(str(settings.pm_redis_url))
+        _redis_pid = os.getpid()
+
+    return _redis
+
+
+@contextmanager
+def file_lock(folder: Path) -> Iterator[None]:
+    """Holds exclusive `flock` on `folder` while in the `with` block"""
+    fd = os.open(folder, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def redis_lock(name: str) -> Iterator[None]:
+    """Holds Redis lock `name` while in the `with` block
+
+    Lock expires after `pm_download_lock_timeout` seconds, so a crashed
+    worker does not block others forever. If Redis is not reachable,
+    logs a warning and continues without the lock.
+    """
+    import redis
+
+    lock = get_redis().lock(
+        f"s3worker:lock:{name}",
+        timeout=settings.pm_download_lock_timeout,
+        blocking_timeout=settings.pm_download_lock_timeout,
+    )
+    try:
+        acquired = lock.acquire()
+    except redis.RedisError as ex:
+        logger.warning(f"Redis lock {name} not available: {ex}")
+        acquired = False
+
+    try:
+        yield
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except redis.RedisError as ex:
+                # e.g. lock expired in the meantime
+                logger.warning(f"Failed to release Redis lock {name}: {ex}")
+
+
+@contextmanager
+def single_flight(name: str, folder: Path) -> Iterator[None]:
+    """Serializes work on `name` whose result is stored in `folder`
+
+    `folder` must exist.
+    """
+    use_redis = settings.pm_download_lock_redis and settings.pm_redis_url
+    with redis_lock(name) if use_redis else nullcontext(), file_lock(folder):
+        yield
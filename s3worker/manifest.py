@@ -0,0 +1,186 @@
+"""
+Local sync manifest.
+
+SQLite database which records key, size, mtime and ETag of every file
+uploaded to the bucket. `s3w sync` consults the manifest first and skips
+local files whose size and mtime did not change since they were uploaded,
+so syncing a mostly unchanged media root needs almost no network requests.
+
+By default the manifest is stored next to the media root, e.g. for
+`PM_MEDIA_ROOT=/app/media` it is `/app/media.manifest.sqlite`.
+"""
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from s3worker import config, utils
+
+settings = config.get_settings()
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    key TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    etag TEXT
+)
+"""
+INSERT = (
+    "INSERT OR REPLACE INTO objects (key, size, mtime_ns, etag) "
+    "VALUES (?, ?, ?, ?)"
+)
+
+
+def get_manifest_path() -> Path:
+    if settings.pm_sync_manifest_path:
+        return Path(settings.pm_sync_manifest_path)
+
+    media_root = Path(settings.pm_media_root)
+    return media_root.with_name(f"{media_root.name}.manifest.sqlite")
+
+
+def connect() -> sqlite3.Connection:
+    return utils.connect_sqlite(get_manifest_path(), SCHEMA)
+
+
+@contextmanager
+def session() -> Iterator[sqlite3.Connection | None]:
+    """Yields connection to the manifest, commits on exit
+
+    Yields None if manifest is disabled via `pm_sync_manifest`.
+    """
+    if not settings.pm_sync_manifest:
+        yield None
+        return
+
+    conn = connect()
+    try:
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def load(conn: sqlite3.Connection) -> dict[str, tuple[int, int]]:
+    """Returns a `{key: (size, mtime_ns)}` map of all recorded objects"""
+    rows = conn.execute("SELECT key, size, mtime_ns FROM objects")
+    return {key: (size, mtime_ns) for key, size, mtime_ns in rows}
+
+
+def add(
+    conn: sqlite3.Connection,
+    key: str,
+    size: int,
+    mtime_ns: int,
+    etag: str | None = None
+):
+    conn.execute(INSERT, (key, size, mtime_ns, etag))
+
+
+def clear(conn: sqlite3.Connection):
+    conn.execute("DELETE FROM objects")
+
+
+def record(key: str, path: Path, etag: str | None = None):
+    """Records successful upload of the local file `path` as `key`
+
+    Manifest is only an optimization: failing to update it must not fail
+    the upload, thus errors are logged and otherwise ignored.
+    """
+    if not settings.pm_sync_manifest:
+        return
+
+    try:
+        stat = path.stat()
+        with session() as conn:
+            add(conn, key, stat.st_size, stat.st_mtime_ns, etag)
+    except (sqlite3.Error, OSError) as ex:
+        logger.warning(f"Failed to record {key} in sync manifest: {ex}")
+
+
+class Writer:
+    """Adds rows to the manifest in short transactions
+
+    Rows are buffered in memory and written (and committed) in batches
+    of `batch_size` rows, or as soon as `max_delay` seconds passed since
+    the last write. Thus the SQLite write lock is held only for a moment:
+    worker processes recording their uploads (`record`) are not blocked
+    by a long running sync, and an interrupted sync keeps its progress.
+    """
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        batch_size: int = 500,
+        max_delay: float = 1.0
+    ):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self._rows: list[tuple[str, int, int, str | None]] = []
+        self._written = time.monotonic()
+
+    def load(self) -> dict[str, tuple[int, int]]:
+        return load(self.conn)
+
+    def clear(self):
+        clear(self.conn)
+        self.conn.commit()
+
+    def add(self, key: str, size: int, mtime_ns: int, etag: str | None = None):
+        self._rows.append((key, size, mtime_ns, etag))
+        if (
+            len(self._rows) >= self.batch_size
+            or time.monotonic() - self._written >= self.max_delay
+        ):
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            try:
+                self.conn.executemany(INSERT, self._rows)
+                self.conn.commit()
+            except sqlite3.Error as ex:
+                # files are only listed again on next sync
+                logger.warning(
+                    f"Failed to record {len(self._rows)} files in sync "
+                    f"manifest: {ex}"
+                )
+            self._rows.clear()
+        self._written = time.monotonic()
+
+
+@contextmanager
+def writer() -> Iterator[Writer | None]:
+    """Yields manifest `Writer`; pending rows are written on exit, also
+    when the block is interrupted by an error
+
+    Yields None if manifest is disabled via `pm_sync_manifest`, or if it
+    cannot be opened (logs a warning): the manifest is only an
+    optimization, without it sync compares against bucket listings only.
+    """
+    if not settings.pm_sync_manifest:
+        yield None
+        return
+
+    try:
+        conn = connect()
+    except (sqlite3.Error, OSError) as ex:
+        logger.warning(
+            f"Sync manifest {get_manifest_path()} not available: {ex}"
+        )
+        yield None
+        return
+
+    manifest_writer = Writer(conn)
+    try:
+        yield manifest_writer
+    finally:
+        try:
+            manifest_writer.flush()
+        finally:
+            conn.close()
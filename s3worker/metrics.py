@@ -0,0 +1,269 @@
+"""
+Prometheus metrics of the worker hot paths.
+
+Enabled by setting `pm_metrics_port`; requires `prometheus_client`
+(pip install 's3worker[metrics]'). Recorded are:
+
+- duration and errors (by code) of every S3/R2 API request, per operation
+- bytes uploaded to / downloaded from S3/R2
+- PDF page render time, per renderer
+- database statement latency, per statement type (SELECT, UPDATE, ...)
+- duration and outcome of Celery tasks
+
+Metrics are recorded by the Celery worker only: `setup` runs in the
+main worker process (`worker_init`) before the pool processes are
+forked. Metrics of all processes of a Celery prefork pool are aggregated
+with prometheus_client multiprocess mode: each process writes its
+samples to files in `pm_metrics_dir` (by default a temporary folder,
+removed on worker shutdown) and the main worker process serves them in
+Prometheus text format on `http://<host>:<pm_metrics_port>/metrics`.
+
+Until then (and in any other process e.g. `s3w`), all metrics below are
+no-op objects and nothing is instrumented, so the hot paths pay one
+no-op method call at most.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+from s3worker import config
+
+settings = config.get_settings()
+logger = logging.getLogger(__name__)
+
+# metrics are configured; they are recorded by the Celery worker only
+enabled = settings.pm_metrics_port is not None
+
+
+class _NoopMetric:
+    """Stands in for Prometheus metrics when metrics are disabled"""
+
+    def labels(self, *args, **kwargs) -> "_NoopMetric":
+        return self
+
+    def inc(self, amount: float = 1):
+        pass
+
+    def observe(self, amount: float):
+        pass
+
+    def time(self):
+        return nullcontext()
+
+
+S3_REQUEST_SECONDS = S3_ERRORS = S3_BYTES = _NoopMetric()
+RENDER_SECONDS = DB_QUERY_SECONDS = _NoopMetric()
+TASK_SECONDS = TASKS = _NoopMetric()
+
+# metrics are being recorded i.e. `setup` was called
+active = False
+# temporary folder of metric samples created by `setup`
+_tmp_dir: str | None = None
+
+
+def setup():
+    """Creates Prometheus metrics in place of the no-op ones
+
+    Called once in the main worker process, before pool processes start.
+    """
+    global active, _tmp_dir
+    global S3_REQUEST_SECONDS, S3_ERRORS, S3_BYTES, RENDER_SECONDS
+    global DB_QUERY_SECONDS, TASK_SECONDS, TASKS
+
+    # must be set before prometheus_client is imported
+    if settings.pm_metrics_dir:
+        settings.pm_metrics_dir.mkdir(parents=True, exist_ok=True)
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = str(settings.pm_metrics_dir)
+    elif "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        _tmp_dir = tempfile.mkdtemp(prefix="s3worker-metrics-")
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = _tmp_dir
+
+    try:
+        from prometheus_client import Counter, Histogram
+    except ImportError as ex:
+        raise RuntimeError(
+            "metrics require prometheus_client: pip install 's3worker[metrics]'"
+        ) from ex
+
+    S3_REQUEST_SECONDS = Histogram(
+        "s3worker_s3_request_seconds",
+        "Duration of S3/R2 API requests",
+        ["operation"],
+    )
+    S3_ERRORS = Counter(
+        "s3worker_s3_errors_total",
+        "Failed S3/R2 API requests",
+        ["operation", "code"],
+    )
+    S3_BYTES = Counter(
+        "s3worker_s3_bytes_total",
+        "Bytes transferred to/from S3/R2",
+        ["direction"],  # "upload" or "download"
+    )
+    RENDER_SECONDS = Histogram(
+        "s3worker_render_seconds",
+        "Duration of rasterizing one PDF page",
+        ["renderer"],
+    )
+    DB_QUERY_SECONDS = Histogram(
+        "s3worker_db_query_seconds",
+        "Duration of database statements",
+        ["statement"],
+    )
+    TASK_SECONDS = Histogram(
+        "s3worker_task_seconds",
+        "Duration of Celery tasks",
+        ["task"],
+    )
+    TASKS = Counter(
+        "s3worker_tasks_total",
+        "Finished Celery tasks by outcome (SUCCESS, FAILURE, RETRY)",
+        ["task", "outcome"],
+    )
+    active = True
+
+
+def teardown():
+    """Removes temporary folder of metric samples created by `setup`"""
+    if _tmp_dir:
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+
+def start_server():
+    """Serves metrics of all processes on `pm_metrics_port`
+
+    Called once in the main worker process, before pool processes start.
+    """
+    from prometheus_client import CollectorRegistry, start_http_server
+    from prometheus_client import multiprocess
+
+    metrics_dir = Path(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+    # samples left over by a previous run
+    for path in metrics_dir.glob("*.db"):
+        path.unlink()
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(settings.pm_metrics_port, registry=registry)
+    logger.info(
+        f"Serving metrics on port {settings.pm_metrics_port} from {metrics_dir}"
+    )
+
+
+def mark_process_dead(pid: int):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(pid)
+
+
+def instrument_s3_client(client):
+    """Records duration, errors and transferred bytes of `client` requests"""
+    if not active:
+        return
+
+    events = client.meta.events
+    events.register("before-call.s3", _s3_before_call)
+    events.register("after-call.s3", _s3_after_call)
+    events.register("after-call-error.s3", _s3_after_call_error)
+    events.register("before-send.s3", _s3_before_send)
+
+
+def _s3_before_call(context, **kwargs):
+    context["metrics_started"] = time.perf_counter()
+
+
+def _s3_after_call(http_response, parsed, model, context, **kwargs):
+    _observe_s3_request(model.name, context)
+    if http_response.status_code >= 300:
+        code = parsed.get("Error", {}).get("Code", str(http_response.status_code))
+        S3_ERRORS.labels(model.name, code).inc()
+    elif model.name == "GetObject":
+        length = http_response.headers.get("content-length")
+        if length:
+            S3_BYTES.labels("download").inc(int(length))
+
+
+def _s3_after_call_error(exception, model, context, **kwargs):
+    _observe_s3_request(model.name, context)
+    S3_ERRORS.labels(model.name, type(exception).__name__).inc()
+
+
+def _s3_before_send(request, **kwargs):
+    if request.method in ("PUT", "POST"):
+        length = request.headers.get("Content-Length")
+        if length:
+            S3_BYTES.labels("upload").inc(int(length))
+
+
+def _observe_s3_request(operation: str, context: dict):
+    started = context.pop("metrics_started", None)
+    if started is not None:
+        S3_REQUEST_SECONDS.labels(operation).observe(
+            time.perf_counter() - started
+        )
+
+
+def instrument_engine(engine):
+    """Records latency of all statements executed by `engine`
+
+    Start time is kept on the execution context of the statement, which
+    is discarded with it, so failed statements leave nothing behind.
+    """
+    if not active:
+        return
+
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_metrics_started", None)
+        if started is None:
+            return
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+        DB_QUERY_SECONDS.labels(verb).observe(time.perf_counter() - started)
+
+
+def instrument_celery(engine=None):
+    """Records duration and outcome of tasks and latency of `engine`
+    statements; serves metrics from the main worker process"""
+    if not enabled:
+        return
+
+    from celery import signals
+
+    started: dict[str, float] = {}
+
+    @signals.worker_init.connect(weak=False)
+    def _worker_init(**kwargs):
+        setup()
+        if engine is not None:
+            instrument_engine(engine)
+        start_server()
+
+    @signals.worker_shutdown.connect(weak=False)
+    def _worker_shutdown(**kwargs):
+        teardown()
+
+    @signals.worker_process_shutdown.connect(weak=False)
+    def _worker_process_shutdown(pid=None, **kwargs):
+        mark_process_dead(pid or os.getpid())
+
+    @signals.task_prerun.connect(weak=False)
+    def _task_prerun(task_id=None, **kwargs):
+        started[task_id] = time.perf_counter()
+
+    @signals.task_postrun.connect(weak=False)
+    def _task_postrun(task_id=None, task=None, state=None, **kwargs):
+        begin = started.pop(task_id, None)
+        if begin is not None:
+            TASK_SECONDS.labels(task.name).observe(time.perf_counter() - begin)
+        TASKS.labels(task.name, state or "UNKNOWN").inc()
@@ -24,9 +24,11 @@ __all__ = [
     'abs_page_svg_path',
     'abs_page_jpg_path',
     'abs_page_hocr_path',
-    'rel2abs'
+    'rel2abs',
+    'shard_prefix',
 ]
 
+
 def base_thumbnail_path(uuid: UUID | str) -> Path:
     """
     Relative path to the page thumbnail image.
@@ -173,3 +175,58 @@ def page_file_type_path():
 def rel2abs(rel_path: Path) -> Path:
     """Converts relative path to absolute path"""
     return Path(settings.pm_media_root) / rel_path
+
+
+def shard_prefix(rel_path: str) -> str:
+    """Returns the shard folder of the file specified by relative path
+
+    For files inside one of `const.SHARDED_DIRS` the shard folder is the
+    two-hex-char folder right below it e.g.
+        "docvers/ab/cd/abcd1234/doc.pdf" -> "docvers/ab"
+        "thumbnails/jpg/bd/f8/bdf862be/sm.jpg" -> "thumbnails/jpg/bd"
+
+    For any other file it is its parent folder. It is the file itself,
+    if the file is located directly in media root or directly in a
+    sharded folder or one of its parents (e.g. "docvers/doc.pdf",
+    "thumbnails/sm.jpg"), as listing that folder would list all its shards.
+
+    Works on "/" separated strings, as it is called once per media file.
+    """
+    for sharded_dir in const.SHARDED_DIRS:
+        if rel_path.startswith(f"{sharded_dir}/"):
+            rest = rel_path[len(sharded_dir) + 1:]
+            shard, sep, _ = rest.partition('/')
+            if sep:
+                return f"{sharded_dir}/{shard}"
+
+    parent, sep, _ = rel_path.rpartition('/')
+    if not sep:
+        return rel_path
+
+    for sharded_dir in const.SHARDED_DIRS:
+        if f"{sharded_dir}/".startswith(f"{parent}/"):
+            return rel_path
+
+    return parent
+
+
+def shard_range(spec: str) -> list[str]:
+    """Returns names of shard folders in range `spec`
+
+    `spec` is either one shard e.g. "ab" or an inclusive range of shards
+    e.g. "00-3f" (first two hex chars of the UUID).
+    """
+    first, sep, last = spec.partition('-')
+    if not sep:
+        last = first
+    try:
+        start, end = int(first, 16), int(last, 16)
+    except ValueError:
+        raise ValueError(
+            f"Invalid shard range {spec!r}, expected e.g. 00-3f"
+        ) from None
+
+    if not (len(first) == 2 and len(last) == 2 and start <= end):
+        raise ValueError(f"Invalid shard range {spec!r}, expected e.g. 00-3f")
+
+    return [f"{i:02x}" for i in range(start, end + 1)]
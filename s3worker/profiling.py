@@ -0,0 +1,142 @@
+"""
+Opt-in per-task profiler.
+
+With `pm_profile` enabled, a `pm_profile_sample_rate` share of Celery
+tasks is profiled: the time spent in each phase of the task (marked in
+task code with `phase("download")` etc.) is logged when the task
+finishes and, if the task took at least `pm_profile_slow_threshold`
+seconds, a full cProfile dump is written to `pm_profile_dir` e.g.
+
+    python -m pstats /tmp/s3worker-profiles/s3_worker_generate_doc_thumbnail-20260101T120000-<task id>.pstats
+
+Not sampled tasks (and all tasks, when disabled) pay one context
+variable lookup per phase.
+"""
+import cProfile
+import logging
+import random
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+
+from s3worker import config
+
+settings = config.get_settings()
+logger = logging.getLogger(__name__)
+
+
+class TaskProfile:
+    """Phase timings and cProfile data of one task run"""
+
+    def __init__(self, task_name: str, task_id: str):
+        self.task_name = task_name
+        self.task_id = task_id
+        self.phases: dict[str, float] = {}
+        self.profiler = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, name: str, seconds: float):
+        # same phase may run several times e.g. download of each doc version
+        self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def summary(self) -> str:
+        phases = " ".join(
+            f"{name}={seconds:.3f}s" for name, seconds in self.phases.items()
+        )
+        return f"{self.task_name}[{self.task_id}] took {self.elapsed:.3f}s: {phases}"
+
+
+_current: ContextVar[TaskProfile | None] = ContextVar(
+    "s3worker_task_profile", default=None
+)
+
+
+def get_profile_dir() -> Path:
+    if settings.pm_profile_dir:
+        return Path(settings.pm_profile_dir)
+
+    return Path(tempfile.gettempdir()) / "s3worker-profiles"
+
+
+def phase(name: str):
+    """Context manager which adds time of its block to phase `name`
+    of the profiled task (if any)"""
+    profile = _current.get()
+    if profile is None:
+        return nullcontext()
+
+    return _timed(profile, name)
+
+
+@contextmanager
+def _timed(profile: TaskProfile, name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - started)
+
+
+def start(task_name: str, task_id: str):
+    """Starts profiling of the task, if it is sampled"""
+    if random.random() >= settings.pm_profile_sample_rate:
+        return
+
+    profile = TaskProfile(task_name, task_id)
+    _current.set(profile)
+    profile.profiler.enable()
+
+
+def stop() -> TaskProfile | None:
+    """Stops profiling of the current task, logs its phases and dumps
+    cProfile stats of slow tasks"""
+    profile = _current.get()
+    if profile is None:
+        return None
+
+    profile.profiler.disable()
+    _current.set(None)
+    profile.elapsed = time.perf_counter() - profile.started
+    logger.info(profile.summary())
+
+    if profile.elapsed >= settings.pm_profile_slow_threshold:
+        _dump(profile)
+
+    return profile
+
+
+def _dump(profile: TaskProfile):
+    profile_dir = get_profile_dir()
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    path = profile_dir / f"{profile.task_name}-{stamp}-{profile.task_id}.pstats"
+    try:
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        profile.profiler.dump_stats(path)
+    except OSError as ex:
+        logger.warning(f"Failed to write profile of slow task: {ex}")
+        return
+
+    logger.warning(
+        f"Slow task {profile.task_name}[{profile.task_id}] "
+        f"({profile.elapsed:.1f}s), profile written to {path}"
+    )
+
+
+def instrument_celery():
+    """Profiles tasks (see module docstring), if `pm_profile` is enabled"""
+    if not settings.pm_profile:
+        return
+
+    from celery import signals
+
+    @signals.task_prerun.connect(weak=False)
+    def _task_prerun(task_id=None, task=None, **kwargs):
+        start(task.name, task_id)
+
+    @signals.task_postrun.connect(weak=False)
+    def _task_postrun(**kwargs):
+        stop()
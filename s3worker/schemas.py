@@ -39,3 +39,49 @@ class Document(BaseModel):
 
     # Config
     model_config = ConfigDict(from_attributes=True)
+
+
+class SyncStats(BaseModel):
+    """Outcome of one `client.sync()` run"""
+    files_total: int = 0  # number of local files
+    files_skipped: int = 0  # unchanged since last sync as per manifest
+    files_changed: int = 0  # in the bucket, but local file differs
+    files_uploaded: int = 0
+    files_failed: int = 0
+    bytes_uploaded: int = 0
+    elapsed: float = 0  # seconds
+
+    @property
+    def files_per_sec(self) -> float:
+        if self.elapsed <= 0:
+            return 0
+        return self.files_uploaded / self.elapsed
+
+    @property
+    def mb_per_sec(self) -> float:
+        if self.elapsed <= 0:
+            return 0
+        return self.bytes_uploaded / (1024 * 1024) / self.elapsed
+
+
+class PullStats(BaseModel):
+    """Outcome of one `client.pull()` run"""
+    files_total: int = 0  # number of listed objects
+    files_present: int = 0  # already in media root with the same size
+    files_downloaded: int = 0
+    files_failed: int = 0
+    files_over_budget: int = 0  # not downloaded, byte budget exhausted
+    bytes_downloaded: int = 0
+    elapsed: float = 0  # seconds
+
+    @property
+    def files_per_sec(self) -> float:
+        if self.elapsed <= 0:
+            return 0
+        return self.files_downloaded / self.elapsed
+
+    @property
+    def mb_per_sec(self) -> float:
+        if self.elapsed <= 0:
+            return 0
+        return self.bytes_downloaded / (1024 * 1024) / self.elapsed
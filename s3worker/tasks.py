@@ -1,33 +1,68 @@
 import logging
 import uuid
+from contextlib import ExitStack
 from uuid import UUID
 from celery import shared_task
-import botocore.exceptions
+from celery.exceptions import MaxRetriesExceededError
 
-from s3worker import generate, client, db
+from s3worker import generate, client, db, delete_buffer
+from s3worker.profiling import phase
 from s3worker.config import get_settings
 from s3worker import constants as const
 from s3worker import exc
 from s3worker.db.engine import Session
-from s3worker.config import FileServer
-from s3worker.types import ImagePreviewSize, ImagePreviewStatus
+from s3worker.types import ImagePreviewSize, ImagePreviewStatus, UploadStatus
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 IMAGE_SIZES = (ImagePreviewSize.sm, ImagePreviewSize.md, ImagePreviewSize.lg, ImagePreviewSize.xl)
 
 
-@shared_task(name=const.S3_WORKER_ADD_DOC_VER)
-def add_doc_vers_task(doc_ver_ids: list[str]):
+@shared_task(
+    bind=True,
+    name=const.S3_WORKER_ADD_DOC_VER,
+    max_retries=6,
+    default_retry_delay=10,
+)
+def add_doc_vers_task(
+    self,
+    doc_ver_ids: list[str],
+    previous: dict[str, str] | None = None
+) -> dict[str, str]:
+    """Upload document versions to S3 storage
+
+    Returns upload status per document version ID. Only failed uploads
+    are retried; statuses of the other IDs are passed to the retry as
+    `previous`, so the result of the last retry covers all IDs.
+    """
     logger.debug('Task started')
-    client.add_doc_vers(doc_ver_ids)
+    with phase("upload"):
+        result = client.add_doc_vers(doc_ver_ids)
+
+    statuses = dict(previous or {})
+    statuses.update((ver, status.value) for ver, status in result.items())
+
+    failed = [
+        ver for ver, status in result.items()
+        if status == UploadStatus.failed
+    ]
+    if failed:
+        try:
+            raise self.retry(
+                args=(failed,),
+                kwargs={"previous": statuses},
+            )
+        except MaxRetriesExceededError:
+            logger.error(f"Giving up uploading doc_vers {failed}")
+
+    return statuses
 
 
 @shared_task(name=const.S3_WORKER_REMOVE_DOC_VER)
 def remove_doc_vers_task(doc_ver_ids: list[str]):
     logger.debug('Task started')
     try:
-        client.remove_doc_vers(doc_ver_ids)
+        delete_buffer.remove_prefixes(client.doc_vers_prefixes(doc_ver_ids))
     except Exception as ex:
         logger.exception(ex)
 
@@ -36,7 +71,9 @@ def remove_doc_vers_task(doc_ver_ids: list[str]):
 def remove_doc_thumbnail_task(doc_id: str):
     logger.debug('Task started')
     try:
-        client.remove_doc_thumbnail(uuid.UUID(doc_id))
+        delete_buffer.remove_prefixes(
+            client.docs_thumbnails_prefixes([uuid.UUID(doc_id)])
+        )
     except Exception as ex:
         logger.exception(ex)
 
@@ -45,8 +82,11 @@ def remove_doc_thumbnail_task(doc_id: str):
 def remove_docs_thumbnail_task(doc_ids: list[str]):  # multiple docs
     logger.debug('Task started')
     try:
-        for doc_id in doc_ids:
-            client.remove_doc_thumbnail(uuid.UUID(doc_id))
+        delete_buffer.remove_prefixes(
+            client.docs_thumbnails_prefixes(
+                [uuid.UUID(doc_id) for doc_id in doc_ids]
+            )
+        )
     except Exception as ex:
         logger.exception(ex)
 
@@ -54,12 +94,26 @@ def remove_docs_thumbnail_task(doc_ids: list[str]):  # multiple docs
 def remove_page_thumbnail_task(page_ids: list[str]):
     logger.debug('Task started')
     try:
-        for page_id in page_ids:
-            client.delete_page(uuid.UUID(page_id))
+        delete_buffer.remove_prefixes(
+            client.pages_prefixes([uuid.UUID(page_id) for page_id in page_ids])
+        )
     except Exception as ex:
         logger.exception(ex)
 
 
+@shared_task(name=const.S3_WORKER_FLUSH_DELETES, ignore_result=True)
+def flush_deletes_task():
+    """Drains buffer of coalesced deletes (see `pm_delete_coalesce`)"""
+    try:
+        errors = delete_buffer.flush()
+    except Exception as ex:
+        logger.exception(ex)
+        return
+
+    if errors:
+        logger.error(f"Failed to delete {len(errors)} objects")
+
+
 @shared_task(
     name=const.S3_WORKER_GENERATE_DOC_THUMBNAIL,
     autoretry_for = (exc.S3DocumentNotFound,),
@@ -71,50 +125,135 @@ def generate_doc_thumbnail_task(doc_id: str):
     logger.debug('Task started')
 
     with Session() as db_session:
-        status = db.get_doc_img_preview_status(db_session, UUID(doc_id))
-        if status is not None:
+        with phase("claim"):
+            doc_ver = db.claim_doc_img_preview(db_session, UUID(doc_id))
+        if doc_ver is None:
             # which means somebody else already started working on this
-            # task
+            # task (or document does not exist)
             return
 
-        db.update_doc_img_preview_status(
-            db_session,
-            UUID(doc_id),
-            status=ImagePreviewStatus.pending
-        )
+        if doc_ver.doc_ver_id is None:
+            db.update_doc_img_preview_status(
+                db_session,
+                UUID(doc_id),
+                status=ImagePreviewStatus.failed,
+                error="Document has no versions"
+            )
+            return
 
-    try:
-        with Session() as db_session:
-            doc_ver = db.get_last_version(db_session, doc_id=UUID(doc_id))
+        logger.debug(f"doc_ver.id = {doc_ver.doc_ver_id}")
+
+        try:
+            with phase("download"):
+                client.download_docver(doc_ver.doc_ver_id, doc_ver.file_name)
+
+            with client.local_docver(
+                docver_id=doc_ver.doc_ver_id,
+                file_name=doc_ver.file_name
+            ), phase("render"):
+                thumb_path, data = generate.doc_ver_thumbnail(
+                    UUID(doc_id), doc_ver.doc_ver_id, doc_ver.file_name
+                )
+
+            with phase("upload"):
+                failed = generate.store_images({thumb_path: data})
+
+            with phase("status_update"):
+                if failed:
+                    db.update_doc_img_preview_status(
+                        db_session,
+                        UUID(doc_id),
+                        status=ImagePreviewStatus.failed,
+                        error=f"Failed to upload {thumb_path}"
+                    )
+                else:
+                    db.update_doc_img_preview_status(
+                        db_session,
+                        UUID(doc_id),
+                        status=ImagePreviewStatus.ready
+                    )
 
-        logger.debug(f"doc_ver.id = {doc_ver.id}")
+        except Exception as ex:
+            logger.exception(ex)
 
-        client.download_docver(
-            docver_id=doc_ver.id,
-            file_name=doc_ver.file_name
+
+@shared_task(
+    name=const.S3_WORKER_GENERATE_PAGE_IMAGE,
+    autoretry_for = (exc.S3DocumentNotFound,),
+    retry_kwargs = {"max_retries": 6, "countdown": 10},
+)
+def generate_page_image_task(page_ids: list[str]):
+    """Generate preview images of the pages (all sizes) and upload them
+    to S3 storage"""
+    logger.debug('Task started')
+
+    with Session() as db_session, phase("query"):
+        pages = db.get_pages_doc_ver(
+            db_session, [UUID(page_id) for page_id in page_ids]
         )
 
-        with Session() as db_session:
-            thumb_path = generate.doc_thumbnail(db_session, UUID(doc_id))
+    if len(pages) < len(page_ids):
+        found = {str(page.page_id) for page in pages}
+        logger.warning(
+            f"Pages {set(page_ids) - found} not found. Skipping them."
+        )
 
-        try:
-            if settings.pm_file_server != FileServer.S3_LOCAL_TEST:
-                client.upload_file(thumb_path)  # upload to S3
-            with Session() as db_session:
-                db.update_doc_img_preview_status(
-                    db_session,
-                    UUID(doc_id),
-                    status=ImagePreviewStatus.ready
-                )
+    _generate_page_previews(pages)
+
+
+@shared_task(
+    name=const.S3_WORKER_GENERATE_PREVIEW,
+    autoretry_for = (exc.S3DocumentNotFound,),
+    retry_kwargs = {"max_retries": 6, "countdown": 10},
+)
+def generate_preview_task(doc_ver_id: str):
+    """Generate preview images of all pages of the document version
+    and upload them to S3 storage"""
+    logger.debug('Task started')
+
+    with Session() as db_session, phase("query"):
+        pages = db.get_doc_ver_pages(db_session, UUID(doc_ver_id))
 
-        except botocore.exceptions.BotoCoreError as e:
-            with Session() as db_session:
-                db.update_doc_img_preview_status(
-                    db_session,
-                    UUID(doc_id),
-                    status=ImagePreviewStatus.failed,
-                    error=str(e)
+    _generate_page_previews(pages)
+
+
+def _generate_page_previews(pages: list):
+    """Renders previews of `pages` and uploads them
+
+    Previews are uploaded in chunks of (at least) `pm_upload_workers`
+    images while pages are being rendered, so memory usage does not grow
+    with the number of pages.
+    """
+    failed = []
+    total = 0
+    with ExitStack() as stack:
+        # keep all involved doc versions out of docver cache eviction
+        # until their pages are rendered
+        with phase("download"):
+            for doc_ver_id, file_name in {
+                (page.doc_ver_id, page.file_name) for page in pages
+            }:
+                stack.enter_context(
+                    client.local_docver(docver_id=doc_ver_id, file_name=file_name)
                 )
 
-    except Exception as ex:
-        logger.exception(ex)
+        rendered = generate.page_previews(pages, sizes=IMAGE_SIZES)
+        chunk = {}
+        while True:
+            with phase("render"):
+                page_previews = next(rendered, None)
+            if page_previews is not None:
+                chunk.update(page_previews)
+            if chunk and (
+                page_previews is None
+                or len(chunk) >= settings.pm_upload_workers
+            ):
+                with phase("upload"):
+                    failed.extend(generate.store_images(chunk))
+                total += len(chunk)
+                chunk = {}
+            if page_previews is None:
+                break
+
+    if failed:
+        logger.error(f"Failed to upload {len(failed)} of {total} previews")
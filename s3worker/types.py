@@ -1,4 +1,6 @@
 from enum import Enum
+from typing import NamedTuple
+from uuid import UUID
 
 
 class ImagePreviewStatus(str, Enum):
@@ -19,8 +21,44 @@ class ImagePreviewStatus(str, Enum):
     failed = "failed"
 
 
+class UploadStatus(str, Enum):
+    """Outcome of uploading one document version"""
+    uploaded = "uploaded"
+    missing = "missing"  # not found in local media root
+    failed = "failed"
+
+
 class ImagePreviewSize(str, Enum):
     sm = "sm"  # small
     md = "md"  # medium
     lg = "lg"  # large
     xl = "xl"  # extra large
+
+
+class RemoteObject(NamedTuple):
+    """Bucket object as returned by `list_objects_v2`"""
+    key: str
+    size: int
+    etag: str
+    last_modified: float  # seconds since epoch, whole seconds
+
+
+class MediaFile(NamedTuple):
+    """File in local media root"""
+    key: str  # "/" separated path relative to media root
+    size: int
+    mtime_ns: int
+
+
+class DeleteError(NamedTuple):
+    """Key which failed to be deleted, as reported by `delete_objects`"""
+    key: str
+    code: str
+    message: str
+
+
+class DocLastVersion(NamedTuple):
+    """Document ID with ID and file name of its last version"""
+    doc_id: UUID
+    doc_ver_id: UUID
+    file_name: str | None
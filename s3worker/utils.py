@@ -1,6 +1,18 @@
+import hashlib
+import sqlite3
 import yaml
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
 from pathlib import Path
 from logging.config import dictConfig
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
 
 
 def get_filename_in_dir(dir: Path) -> str | None:
@@ -31,3 +43,69 @@ def setup_logging(config: Path):
         config = yaml.load(stream, Loader=yaml.FullLoader)
 
     dictConfig(config)
+
+
+def file_etag(path: Path, part_size: int | None = None) -> str:
+    """Returns S3 ETag the content of `path` gets when uploaded
+
+    That is MD5 hex digest of the content or, for multipart uploads in
+    parts of `part_size` bytes, "<MD5 of part digests>-<number of parts>".
+    Does not apply to objects encrypted with SSE-KMS/SSE-C.
+    """
+    chunk_size = part_size or 1024 * 1024
+    digest = hashlib.md5()
+    part_digests = []
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            if part_size:
+                part_digests.append(hashlib.md5(chunk).digest())
+            else:
+                digest.update(chunk)
+
+    if not part_size:
+        return digest.hexdigest()
+
+    return (
+        f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+    )
+
+
+def connect_sqlite(path: Path, schema: str) -> sqlite3.Connection:
+    """Opens local SQLite database shared by several worker processes"""
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(schema)
+
+    return conn
+
+
+def bounded_imap(
+    func: Callable[[T], object],
+    items: Iterable[T],
+    max_workers: int,
+    processes: bool = False,
+) -> Iterator[tuple[T, Future]]:
+    """Runs `func` on each item in a thread pool of `max_workers` threads
+
+    Yields `(item, future)` pairs in order of completion. At most
+    `2 * max_workers` items are in flight at any time, so `items` may be a
+    (lazy) iterable of millions of entries without all of them being
+    submitted to the pool at once.
+    With `processes=True` a pool of `max_workers` processes is used
+    instead (for CPU bound `func`); `func` and items must be picklable.
+    """
+    max_in_flight = max_workers * 2
+    executor_cls = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_cls(max_workers=max_workers) as pool:
+        in_flight: dict[Future, T] = {}
+        for item in items:
+            in_flight[pool.submit(func, item)] = item
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield in_flight.pop(future), future
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield in_flight.pop(future), future
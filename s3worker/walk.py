@@ -0,0 +1,104 @@
+"""
+Fast walker of the local media root.
+
+Built on `os.scandir`: file type and stat data come from the `DirEntry`
+objects and relative keys are built by plain string concatenation.
+Each shard folder of `const.SHARDED_DIRS` (e.g. "docvers/ab") is walked in
+its own thread, so the directory reads of different shards overlap.
+"""
+import logging
+import os
+from typing import Iterator
+
+from s3worker import constants as const
+from s3worker import utils
+from s3worker.types import MediaFile
+
+logger = logging.getLogger(__name__)
+
+
+def iter_media(root: str | os.PathLike, max_workers: int = 8) -> Iterator[MediaFile]:
+    """Yields all files under `root` as (relative key, size, mtime_ns) records
+
+    Relative keys are "/" separated paths relative to `root`
+    e.g. "docvers/ab/cd/abcd1234/doc.pdf". Order of records is not defined.
+    Partial downloads (`const.TMP_DIR`) are skipped.
+    """
+    files: list[MediaFile] = []
+    units: list[tuple[str, str]] = []  # folders to walk in the thread pool
+    _split(os.fspath(root), '', files, units)
+
+    yield from files
+
+    for _, future in utils.bounded_imap(
+        lambda unit: _walk(*unit), units, max_workers=max_workers
+    ):
+        yield from future.result()
+
+
+def _split(
+    abs_dir: str,
+    rel_dir: str,
+    files: list[MediaFile],
+    units: list[tuple[str, str]],
+):
+    """Descends from `abs_dir` until shard folders are reached
+
+    Files found on the way are appended to `files`, shard folders and any
+    other (unsharded) folders are appended to `units`.
+    """
+    for entry, rel_path in _scandir(abs_dir, rel_dir):
+        if entry.is_dir(follow_symlinks=False):
+            if rel_path == const.TMP_DIR:
+                continue
+            if rel_path in const.SHARDED_DIRS:
+                _split_shards(entry.path, rel_path, files, units)
+            elif any(d.startswith(f"{rel_path}/") for d in const.SHARDED_DIRS):
+                _split(entry.path, rel_path, files, units)
+            else:
+                units.append((entry.path, rel_path))
+        elif entry.is_file():
+            files.append(_media_file(entry, rel_path))
+
+
+def _split_shards(
+    abs_dir: str,
+    rel_dir: str,
+    files: list[MediaFile],
+    units: list[tuple[str, str]],
+):
+    for entry, rel_path in _scandir(abs_dir, rel_dir):
+        if entry.is_dir(follow_symlinks=False):
+            units.append((entry.path, rel_path))
+        elif entry.is_file():
+            files.append(_media_file(entry, rel_path))
+
+
+def _walk(abs_dir: str, rel_dir: str) -> list[MediaFile]:
+    """Returns all files under `abs_dir` (recursively)"""
+    result = []
+    stack = [(abs_dir, rel_dir)]
+    while stack:
+        for entry, rel_path in _scandir(*stack.pop()):
+            if entry.is_dir(follow_symlinks=False):
+                stack.append((entry.path, rel_path))
+            elif entry.is_file():
+                result.append(_media_file(entry, rel_path))
+
+    return result
+
+
+def _scandir(abs_dir: str, rel_dir: str) -> list[tuple[os.DirEntry, str]]:
+    try:
+        with os.scandir(abs_dir) as entries:
+            if rel_dir:
+                return [(entry, f"{rel_dir}/{entry.name}") for entry in entries]
+            return [(entry, entry.name) for entry in entries]
+    except OSError as ex:
+        logger.warning(f"Skipping {abs_dir}: {ex}")
+        return []
+
+
+def _media_file(entry: os.DirEntry, rel_path: str) -> MediaFile:
+    stat = entry.stat()
+    return MediaFile(rel_path, stat.st_size, stat.st_mtime_ns)
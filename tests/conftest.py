@@ -1,13 +1,17 @@
 import uuid
+from urllib.request import Request, urlopen
+
 import pytest
+from moto import mock_aws
+from moto.server import ThreadedMotoServer
 
 
 from s3worker.db.base import Base
 from s3worker.db.engine import get_engine, Session
 from s3worker.db import orm
 
-from s3worker.config import get_settings
-from s3worker import constants
+from s3worker.config import StorageBackend, get_settings
+from s3worker import client, constants
 
 config = get_settings()
 
@@ -98,3 +102,84 @@ def make_page(db_session: Session, user: orm.User):
 @pytest.fixture()
 def user(make_user) -> orm.User:
     return make_user(username="random")
+
+
+@pytest.fixture()
+def media_root(tmp_path, monkeypatch):
+    """Empty media root; sync manifest and docver cache index next to it"""
+    root = tmp_path / "media"
+    root.mkdir()
+    monkeypatch.setattr(config, "pm_media_root", str(root))
+    monkeypatch.setattr(config, "pm_sync_manifest_path", tmp_path / "manifest.sqlite")
+    monkeypatch.setattr(config, "pm_docver_cache_index_path", tmp_path / "cache.sqlite")
+
+    return root
+
+
+def _use_aws(monkeypatch, endpoint_url: str | None = None):
+    monkeypatch.setattr(config, "pm_storage_backend", StorageBackend.AWS)
+    monkeypatch.setattr(config, "aws_access_key_id", "testing")
+    monkeypatch.setattr(config, "aws_secret_access_key", "testing")
+    monkeypatch.setattr(config, "aws_region_name", "us-east-1")
+    monkeypatch.setattr(config, "aws_endpoint_url", endpoint_url)
+    monkeypatch.setattr(config, "pm_prefix", "")
+
+
+@pytest.fixture()
+def s3(monkeypatch, media_root):
+    """Mocked S3 with an empty bucket (`pm_s3_bucket_name`)"""
+    _use_aws(monkeypatch)
+
+    with mock_aws():
+        client.reset_client()
+        s3_client = client.get_client()
+        s3_client.create_bucket(Bucket=client.get_bucket_name())
+        yield s3_client
+
+    client.reset_client()
+
+
+@pytest.fixture()
+def put_object(s3):
+    """Puts an object into the mocked bucket; returns its key"""
+
+    def _put(key, data: bytes = b"data") -> str:
+        s3.put_object(Bucket=client.get_bucket_name(), Key=str(key), Body=data)
+        return str(key)
+
+    return _put
+
+
+@pytest.fixture()
+def bucket_keys(s3):
+    """Returns keys of all objects in the mocked bucket"""
+
+    def _keys() -> set[str]:
+        return set(client.list_remote_objects([""], max_workers=1))
+
+    return _keys
+
+
+@pytest.fixture(scope="session")
+def moto_server() -> str:
+    """URL of a local moto server, for clients which `mock_aws` does not
+    patch (aiobotocore)"""
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture()
+def s3_server(monkeypatch, media_root, moto_server):
+    """Empty bucket (`pm_s3_bucket_name`) on local moto server"""
+    _use_aws(monkeypatch, endpoint_url=moto_server)
+    client.reset_client()
+    s3_client = client.get_client()
+    s3_client.create_bucket(Bucket=client.get_bucket_name())
+
+    yield s3_client
+
+    client.reset_client()
+    urlopen(Request(f"{moto_server}/moto-api/reset", method="POST"))
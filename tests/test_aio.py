@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+from s3worker import aio, client, plib
+
+
+@pytest.mark.asyncio
+async def test_map_bounded_limits_concurrency():
+    running = 0
+    max_running = 0
+
+    async def _work(item):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.001 * (item % 3))
+        running -= 1
+        if item == 5:
+            raise ValueError(item)
+        return item * 2
+
+    results = await aio.map_bounded(_work, list(range(20)), max_concurrency=4)
+
+    assert max_running == 4
+    assert results[:5] == [0, 2, 4, 6, 8]
+    assert isinstance(results[5], ValueError)
+    assert results[6:] == [item * 2 for item in range(6, 20)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("items", [[], [1]])
+async def test_map_bounded_fewer_items_than_consumers(items):
+    async def _work(item):
+        return item
+
+    assert await aio.map_bounded(_work, items, max_concurrency=8) == items
+
+
+@pytest.mark.asyncio
+async def test_byte_budget_limits_bytes_in_flight():
+    budget = aio.ByteBudget(100)
+    max_in_flight = 0
+
+    async def _send(size):
+        nonlocal max_in_flight
+        async with budget.reserve(size):
+            max_in_flight = max(max_in_flight, budget.in_flight)
+            await asyncio.sleep(0.001)
+
+    # the oversized body goes alone
+    await asyncio.gather(*(_send(size) for size in [40, 40, 40, 250, 40]))
+
+    assert max_in_flight == 250
+    assert budget.in_flight == 0
+
+    max_in_flight = 0
+    await asyncio.gather(*(_send(40) for _ in range(10)))
+    assert max_in_flight == 80
+
+
+def test_bulk_operations(s3_server, media_root):
+    pytest.importorskip("aiobotocore")
+    files = []
+    for i in range(20):
+        rel_path = plib.thumbnail_path(f"{i:02x}" + "0" * 30)
+        path = plib.rel2abs(rel_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * i)
+        files.append((path, str(rel_path)))
+    missing = "thumbnails/jpg/ff/missing.jpg"
+
+    assert aio.upload_files(files) == [None] * 20
+
+    remote = aio.list_remote_objects(["thumbnails/jpg/0", "thumbnails/jpg/1"])
+    assert {key: obj.size for key, obj in remote.items()} == {
+        keyname: path.stat().st_size for path, keyname in files
+    }
+
+    heads = aio.head_objects([files[3][1], missing])
+    assert heads[files[3][1]].size == 3
+    assert heads[missing] is None
+    assert client.head_objects([files[3][1], missing], max_workers=2) == heads
+
+    assert aio.delete_keys([keyname for _, keyname in files] + [missing]) == []
+    assert aio.list_remote_objects([""]) == {}
+
+
+def test_upload_reports_failures(s3_server, media_root):
+    pytest.importorskip("aiobotocore")
+    path = media_root / "a.txt"
+    path.write_bytes(b"a")
+
+    results = aio.upload_files([(path, "a.txt"), (media_root / "b.txt", "b.txt")])
+
+    assert results[0] is None
+    assert isinstance(results[1], FileNotFoundError)
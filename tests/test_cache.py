@@ -0,0 +1,105 @@
+import uuid
+
+import pytest
+
+from s3worker import cache, client, locks, plib, tasks
+from s3worker.exc import DocverEvicted
+
+
+@pytest.fixture(autouse=True)
+def cache_enabled(monkeypatch):
+    monkeypatch.setattr(cache.settings, "pm_docver_cache_max_bytes", 10**9)
+
+
+def _cached_file(media_root, name: str, size: int):
+    path = media_root / "docvers" / name / "doc.pdf"
+    path.parent.mkdir(parents=True)
+    path.write_bytes(b"x" * size)
+    cache.register(path)
+    return path
+
+
+def test_evict_removes_least_recently_used(media_root):
+    old = _cached_file(media_root, "old", 10)
+    new = _cached_file(media_root, "new", 10)
+
+    assert cache.evict(max_bytes=15) == 10
+
+    assert not old.exists()
+    assert not old.parent.exists()
+    assert new.exists()
+
+
+def test_evict_skips_pinned_files(media_root):
+    old = _cached_file(media_root, "old", 10)
+    new = _cached_file(media_root, "new", 10)
+    fd = cache.pin(old)
+    try:
+        assert cache.evict(max_bytes=15) == 10
+    finally:
+        cache.unpin(fd)
+
+    assert old.exists()
+    assert not new.exists()
+
+
+def test_evict_keeps_folder_locked_by_download(media_root):
+    path = _cached_file(media_root, "old", 10)
+    with locks.file_lock(path.parent):
+        assert cache.evict(max_bytes=0) == 10
+        assert path.parent.exists()
+
+    assert not path.exists()
+
+
+def test_register_keeps_registered_file(media_root, monkeypatch):
+    monkeypatch.setattr(cache.settings, "pm_docver_cache_max_bytes", 5)
+    other = _cached_file(media_root, "other", 10)
+    path = _cached_file(media_root, "path", 10)
+
+    assert path.exists()
+    assert not other.exists()
+
+
+def test_local_docver_with_tiny_cache(s3, media_root, monkeypatch):
+    monkeypatch.setattr(cache.settings, "pm_docver_cache_max_bytes", 1)
+    docver_ids = [uuid.uuid4(), uuid.uuid4()]
+    for docver_id in docver_ids:
+        s3.put_object(
+            Bucket=client.get_bucket_name(),
+            Key=str(plib.docver_path(docver_id, "doc.pdf")),
+            Body=b"pdf",
+        )
+
+    for docver_id in docver_ids:
+        with client.local_docver(docver_id, "doc.pdf") as path:
+            assert path.read_bytes() == b"pdf"
+
+    client.download_docver(docver_ids[0], "doc.pdf")
+    assert plib.abs_docver_path(docver_ids[0], "doc.pdf").exists()
+
+
+def test_docver_evicted_is_not_retried(s3, media_root, monkeypatch):
+    # concurrent task downloads the file and it is evicted right away
+    monkeypatch.setattr(client, "_download_docver", lambda *args: None)
+
+    with pytest.raises(DocverEvicted):
+        with client.local_docver(uuid.uuid4(), "doc.pdf"):
+            pass
+
+    for task in (
+        tasks.generate_doc_thumbnail_task,
+        tasks.generate_page_image_task,
+        tasks.generate_preview_task,
+    ):
+        assert not issubclass(DocverEvicted, task.autoretry_for)
+
+
+def test_disabled_cache_skips_index(media_root, monkeypatch):
+    monkeypatch.setattr(cache.settings, "pm_docver_cache_max_bytes", None)
+    path = _cached_file(media_root, "path", 10)
+
+    cache.unpin(cache.pin(path))
+
+    assert path.exists()
+    assert not cache.get_index_path().exists()
@@ -0,0 +1,186 @@
+import os
+import time
+import uuid
+
+import pytest
+
+from s3worker import client, plib
+from s3worker.exc import S3DocumentNotFound
+
+
+def _write(rel_path, data: bytes):
+    path = plib.rel2abs(rel_path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    return path
+
+
+def test_sync_uploads_missing_files(bucket_keys, media_root):
+    docver = plib.docver_path(uuid.uuid4(), "doc.pdf")
+    thumbnail = plib.thumbnail_path(uuid.uuid4())
+    _write(docver, b"pdf")
+    _write(thumbnail, b"jpg data")
+
+    stats = client.sync(max_workers=2)
+
+    assert bucket_keys() == {str(docver), str(thumbnail)}
+    assert stats.files_total == 2
+    assert stats.files_uploaded == 2
+    assert stats.bytes_uploaded == len(b"pdf") + len(b"jpg data")
+    assert stats.files_failed == 0
+
+
+def test_sync_skips_uploaded_files(s3, media_root):
+    _write(plib.docver_path(uuid.uuid4(), "doc.pdf"), b"pdf")
+    client.sync(max_workers=2)
+
+    stats = client.sync(max_workers=2)
+
+    assert stats.files_total == 1
+    assert stats.files_skipped == 1
+    assert stats.files_uploaded == 0
+
+
+def test_sync_without_manifest_uploads_only_missing(bucket_keys, media_root, monkeypatch):
+    monkeypatch.setattr(client.settings, "pm_sync_manifest", False)
+    first = plib.docver_path(uuid.uuid4(), "doc.pdf")
+    _write(first, b"pdf")
+    client.sync(max_workers=2)
+    second = plib.thumbnail_path(uuid.uuid4())
+    _write(second, b"jpg")
+
+    stats = client.sync(max_workers=2)
+
+    assert stats.files_uploaded == 1
+    assert stats.files_skipped == 0
+    assert bucket_keys() == {str(first), str(second)}
+
+
+def test_sync_lists_file_next_to_shards_by_key(s3, media_root, monkeypatch):
+    monkeypatch.setattr(client.settings, "pm_sync_manifest", False)
+    _write("docvers/doc.pdf", b"pdf")
+    _write(plib.docver_path(uuid.uuid4(), "doc.pdf"), b"pdf")
+    client.sync(max_workers=2)
+    listed = []
+    list_objects = client.list_objects
+    monkeypatch.setattr(
+        client, "list_objects",
+        lambda prefix: listed.append(prefix) or list_objects(prefix)
+    )
+
+    stats = client.sync(max_workers=2)
+
+    assert stats.files_uploaded == 0
+    assert "docvers/doc.pdf" in listed
+    assert "docvers/" not in listed
+
+
+def test_sync_skips_partial_downloads(bucket_keys, media_root):
+    (media_root / ".tmp").mkdir()
+    (media_root / ".tmp" / "tmp1234.pdf").write_bytes(b"partial")
+
+    stats = client.sync(max_workers=2)
+
+    assert stats.files_total == 0
+    assert bucket_keys() == set()
+
+
+@pytest.mark.parametrize("use_manifest", [True, False])
+def test_sync_skips_downloaded_docver(s3, media_root, monkeypatch, use_manifest):
+    monkeypatch.setattr(client.settings, "pm_sync_manifest", use_manifest)
+    docver_id = uuid.uuid4()
+    path = _write(plib.docver_path(docver_id, "doc.pdf"), b"pdf")
+    client.sync(max_workers=2)
+    path.unlink()
+    # LastModified has a resolution of one second
+    time.sleep(1.1)
+
+    client.download_docver(docver_id, "doc.pdf")
+    stats = client.sync(max_workers=2)
+
+    assert path.read_bytes() == b"pdf"
+    assert stats.files_changed == 0
+    assert stats.files_uploaded == 0
+
+
+def test_download_docver_not_found(s3, media_root):
+    with pytest.raises(S3DocumentNotFound):
+        client.download_docver(uuid.uuid4(), "doc.pdf")
+
+
+def test_sync_without_available_manifest(bucket_keys, media_root, monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        client.settings, "pm_sync_manifest_path", tmp_path / "missing" / "m.sqlite"
+    )
+    rel_path = plib.docver_path(uuid.uuid4(), "doc.pdf")
+    _write(rel_path, b"pdf")
+
+    stats = client.sync(max_workers=2)
+
+    assert stats.files_uploaded == 1
+    assert bucket_keys() == {str(rel_path)}
+
+
+def _last_modified(s3, key) -> float:
+    return s3.head_object(
+        Bucket=client.get_bucket_name(), Key=str(key)
+    )["LastModified"].timestamp()
+
+
+def _content(s3, key) -> bytes:
+    return s3.get_object(
+        Bucket=client.get_bucket_name(), Key=str(key)
+    )["Body"].read()
+
+
+def test_sync_reuploads_file_of_different_size(s3, media_root):
+    rel_path = plib.docver_path(uuid.uuid4(), "doc.pdf")
+    path = _write(rel_path, b"pdf")
+    client.sync(max_workers=2)
+    path.write_bytes(b"pdf v2")
+
+    stats = client.sync(max_workers=2)
+
+    assert stats.files_changed == 1
+    assert stats.files_uploaded == 1
+    assert _content(s3, rel_path) == b"pdf v2"
+
+
+def test_sync_reuploads_file_modified_after_upload(s3, media_root):
+    rel_path = plib.docver_path(uuid.uuid4(), "doc.pdf")
+    path = _write(rel_path, b"pdf")
+    client.sync(max_workers=2)
+    path.write_bytes(b"PDF")
+    mtime = _last_modified(s3, rel_path) + 10
+    os.utime(path, (mtime, mtime))
+
+    stats = client.sync(max_workers=2)
+
+    assert stats.files_changed == 1
+    assert _content(s3, rel_path) == b"PDF"
+
+
+@pytest.mark.parametrize("size", [
+    3,
+    # multipart upload: 3 parts of (moto's minimum) 5 MB
+    11 * 1024 * 1024,
+])
+def test_sync_verify_hash_detects_restore(s3, media_root, monkeypatch, size):
+    monkeypatch.setattr(client.settings, "pm_transfer_multipart_threshold", 5 * 1024 * 1024)
+    monkeypatch.setattr(client.settings, "pm_transfer_multipart_chunksize", 5 * 1024 * 1024)
+    monkeypatch.setattr(client, "_transfer_config", None)
+    rel_path = plib.docver_path(uuid.uuid4(), "doc.pdf")
+    path = _write(rel_path, b"a" * size)
+    client.sync(max_workers=2)
+    # e.g. backup restored with its old mtime: same size, older mtime,
+    # i.e. size and LastModified of the listing can't tell the difference
+    path.write_bytes(b"b" * size)
+    mtime = _last_modified(s3, rel_path) - 3600
+    os.utime(path, (mtime, mtime))
+
+    stats = client.sync(max_workers=2, verify_hash=True)
+
+    assert stats.files_changed == 1
+    assert _content(s3, rel_path) == b"b" * size
+    # unchanged content is not uploaded again
+    assert client.sync(max_workers=2, verify_hash=True).files_changed == 0
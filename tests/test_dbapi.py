@@ -21,3 +21,119 @@ def test_get_page_number(db_session, make_page):
     assert page_number == page.number
 
 
+def test_get_pages_doc_ver(db_session, make_page):
+    page: orm.Page = make_page()
+
+    rows = dbapi.get_pages_doc_ver(db_session, page_ids=[page.id])
+
+    assert len(rows) == 1
+    assert rows[0].page_id == page.id
+    assert rows[0].number == page.number
+    assert rows[0].doc_ver_id == page.document_version_id
+    assert rows[0].file_name == page.document_version.file_name
+
+
+def test_get_doc_ver_pages(db_session, make_page):
+    doc_ver = make_page().document_version
+    make_page()
+
+    rows = dbapi.get_doc_ver_pages(db_session, doc_ver.id)
+
+    assert [row.number for row in rows] == [1, 2, 3]
+    assert {row.page_id for row in rows} == {page.id for page in doc_ver.pages}
+    assert {row.doc_ver_id for row in rows} == {doc_ver.id}
+
+
+def test_claim_doc_img_preview(db_session, make_page):
+    page: orm.Page = make_page()
+    doc_ver = page.document_version
+
+    row = dbapi.claim_doc_img_preview(db_session, doc_id=doc_ver.document_id)
+
+    assert row.doc_ver_id == doc_ver.id
+    assert row.file_name == doc_ver.file_name
+    status = dbapi.get_doc_img_preview_status(db_session, doc_ver.document_id)
+    assert status == types.ImagePreviewStatus.pending
+
+    # second claim of the same document fails
+    assert dbapi.claim_doc_img_preview(db_session, doc_ver.document_id) is None
+
+
+def test_get_docs_last_version(db_session, make_page):
+    first_page: orm.Page = make_page()
+    second_page: orm.Page = make_page()
+    doc = second_page.document_version.document
+    last_ver = orm.DocumentVersion(
+        document=doc, number=2, file_name="v2.pdf"
+    )
+    db_session.add(last_ver)
+    db_session.commit()
+
+    result = dbapi.get_docs_last_version(db_session)
+
+    assert sorted(result) == sorted([
+        types.DocLastVersion(
+            first_page.document_version.document_id,
+            first_page.document_version.id,
+            first_page.document_version.file_name,
+        ),
+        types.DocLastVersion(doc.id, last_ver.id, "v2.pdf"),
+    ])
+
+
+def test_iter_docs_last_version(db_session, make_page):
+    doc_ids = sorted(
+        make_page().document_version.document_id for _ in range(5)
+    )
+
+    result = dbapi.iter_docs_last_version(db_session, batch_size=2)
+
+    assert [doc.doc_id for doc in result] == doc_ids
+
+
+def test_iter_docs_last_version_resume(db_session, make_page):
+    doc_ids = sorted(
+        make_page().document_version.document_id for _ in range(5)
+    )
+
+    result = dbapi.iter_docs_last_version(
+        db_session, after=doc_ids[1], batch_size=2
+    )
+
+    assert [doc.doc_id for doc in result] == doc_ids[2:]
+
+
+def test_iter_docs_last_version_many_versions(db_session, make_page):
+    docs = [make_page().document_version.document for _ in range(3)]
+    last_vers = {}
+    for doc in docs:
+        last_vers[doc.id] = orm.DocumentVersion(
+            document=doc, number=3, file_name="v3.pdf"
+        )
+        db_session.add(last_vers[doc.id])
+        db_session.add(
+            orm.DocumentVersion(document=doc, number=2, file_name="v2.pdf")
+        )
+    db_session.commit()
+
+    result = list(dbapi.iter_docs_last_version(db_session, batch_size=1))
+
+    assert result == [
+        types.DocLastVersion(doc_id, last_vers[doc_id].id, "v3.pdf")
+        for doc_id in sorted(last_vers)
+    ]
+
+
+def test_count_docs_last_version(db_session, make_page):
+    pages = [make_page() for _ in range(5)]
+    doc_ids = sorted(page.document_version.document_id for page in pages)
+
+    assert dbapi.count_docs_last_version(db_session) == 5
+    assert dbapi.count_docs_last_version(db_session, after=doc_ids[1]) == 3
+    # page IDs are not counted
+    assert dbapi.count_docs_last_version(
+        db_session,
+        after=doc_ids[1],
+        doc_ids=[doc_ids[0], doc_ids[2], doc_ids[4], pages[0].id],
+        batch_size=2
+    ) == 2
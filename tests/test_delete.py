@@ -0,0 +1,74 @@
+from botocore.stub import Stubber
+
+from s3worker import client
+from s3worker.types import DeleteError
+
+
+def test_remove_prefixes_more_than_1000_keys(put_object, monkeypatch):
+    keys = [f"docvers/ab/cd/{i:05d}/doc.pdf" for i in range(2100)]
+    for key in keys + ["docvers/ef/keep.pdf"]:
+        put_object(key, b"x")
+    batches = []
+    delete_batch = client._delete_batch
+
+    def _spy(keynames):
+        batches.append(len(keynames))
+        return delete_batch(keynames)
+
+    monkeypatch.setattr(client, "_delete_batch", _spy)
+
+    errors = client.remove_prefixes(["docvers/ab/"], max_workers=2)
+
+    assert errors == []
+    # listing is paginated (1000 keys per page), deletes are split
+    # into `delete_objects` batches of at most 1000 keys
+    assert sorted(batches) == [100, 1000, 1000]
+    remaining = client.list_remote_objects(["docvers/"], max_workers=1)
+    assert list(remaining) == ["docvers/ef/keep.pdf"]
+
+
+def test_delete_batches():
+    keys = [str(i) for i in range(2001)]
+
+    batches = client.delete_batches(keys)
+
+    assert [len(batch) for batch in batches] == [1000, 1000, 1]
+    assert sum(batches, []) == keys
+
+
+def test_delete_keys_reports_per_key_errors(s3):
+    with Stubber(s3) as stubber:
+        stubber.add_response(
+            "delete_objects",
+            {
+                "Errors": [{
+                    "Key": "b",
+                    "Code": "AccessDenied",
+                    "Message": "Access Denied",
+                }]
+            },
+            {
+                "Bucket": client.get_bucket_name(),
+                "Delete": {
+                    "Objects": [{"Key": "a"}, {"Key": "b"}],
+                    "Quiet": True,
+                },
+            },
+        )
+
+        errors = client.delete_keys(["a", "b"], max_workers=1)
+
+    assert errors == [DeleteError("b", "AccessDenied", "Access Denied")]
+
+
+def test_delete_keys_failed_request(s3):
+    with Stubber(s3) as stubber:
+        stubber.add_client_error(
+            "delete_objects", service_error_code="SlowDown", http_status_code=503
+        )
+
+        errors = client.delete_keys(["a", "b"], max_workers=1)
+
+    assert [(error.key, error.code) for error in errors] == [
+        ("a", "SlowDown"), ("b", "SlowDown")
+    ]
@@ -0,0 +1,86 @@
+import time
+
+import fakeredis
+import pytest
+
+from s3worker import client, delete_buffer
+from s3worker.types import RemoteObject
+
+
+@pytest.fixture()
+def redis(monkeypatch):
+    fake = fakeredis.FakeRedis()
+    monkeypatch.setattr(delete_buffer, "get_redis", lambda: fake)
+
+    return fake
+
+
+def test_push_keeps_latest_queue_time(redis):
+    delete_buffer.push(["a/", "b/"], queued_at=10)
+    delete_buffer.push(["a/"], queued_at=5)
+    delete_buffer.push(["b/"], queued_at=20)
+
+    assert delete_buffer.peek(10) == {"a/": 10, "b/": 20}
+    assert delete_buffer.peek(1) == {"a/": 10}
+
+
+def test_remove_keeps_prefixes_queued_again(redis):
+    delete_buffer.push(["a/", "b/"], queued_at=10)
+    queued = delete_buffer.peek(10)
+    delete_buffer.push(["b/"], queued_at=20)
+
+    delete_buffer.remove(queued)
+
+    assert delete_buffer.peek(10) == {"b/": 20}
+
+
+def test_flush_deletes_objects_of_queued_prefixes(put_object, bucket_keys, redis):
+    put_object("thumbnails/jpg/ab/1.jpg")
+    put_object("thumbnails/jpg/ab/2.jpg")
+    put_object("thumbnails/jpg/cd/3.jpg")
+    delete_buffer.push(["thumbnails/jpg/ab/"], queued_at=time.time() + 1)
+
+    assert delete_buffer.flush(batch_size=1) == []
+
+    assert bucket_keys() == {"thumbnails/jpg/cd/3.jpg"}
+    assert redis.zcard(delete_buffer.BUFFER_KEY) == 0
+
+
+def test_flush_keeps_objects_uploaded_after_queueing(put_object, bucket_keys, redis):
+    put_object("old/1.jpg")
+    delete_buffer.push(["old/"], queued_at=time.time() + 1)
+    delete_buffer.push(["new/"], queued_at=time.time() - 60)
+    # e.g. regenerated after the delete was requested
+    put_object("new/1.jpg")
+
+    delete_buffer.flush()
+
+    assert bucket_keys() == {"new/1.jpg"}
+
+
+def test_flush_keeps_prefixes_on_failure(s3, redis, monkeypatch):
+    def _fail(*args, **kwargs):
+        raise ConnectionError("storage not reachable")
+
+    monkeypatch.setattr(client, "list_remote_objects", _fail)
+    delete_buffer.push(["a/"], queued_at=10)
+
+    with pytest.raises(ConnectionError):
+        delete_buffer.flush()
+
+    assert delete_buffer.peek(10) == {"a/": 10}
+
+
+def test_remove_queued_keeps_objects_of_the_same_second(monkeypatch):
+    monkeypatch.setattr(client, "list_remote_objects", lambda *a, **kw: {
+        key: RemoteObject(key, 1, "etag", last_modified)
+        for key, last_modified in [("a/old", 99.0), ("a/new", 100.0)]
+    })
+    deleted = []
+    monkeypatch.setattr(
+        client, "delete_keys", lambda keys, **kwargs: deleted.extend(keys) or []
+    )
+
+    delete_buffer.remove_queued({"a/": 100.7})
+
+    assert deleted == ["a/old"]
@@ -0,0 +1,94 @@
+import io
+import shutil
+
+import pytest
+from PIL import Image
+
+from s3worker import image
+from s3worker.config import PdfRenderer
+
+
+class FakeDocument:
+    """Renders blank pages of A4 aspect ratio, records render calls"""
+    renderer = PdfRenderer.PDFTOPPM
+
+    def __init__(self):
+        self.renders = []
+
+    def render(self, page_number: int, size_px: int) -> Image.Image:
+        self.renders.append((page_number, size_px))
+        return Image.new("RGB", (size_px, round(size_px * 1.414)), "white")
+
+    def close(self):
+        pass
+
+
+def _size(data: bytes) -> tuple[int, int]:
+    return Image.open(io.BytesIO(data)).size
+
+
+def test_generate_page_previews_renders_once():
+    doc = FakeDocument()
+
+    previews = image.generate_page_previews(
+        doc, page_number=2, sizes={"sm": 200, "xl": 1600, "md": 600}
+    )
+
+    assert doc.renders == [(2, 1600)]
+    assert set(previews) == {"sm", "md", "xl"}
+    assert _size(previews["xl"]) == (1600, 2262)
+    assert _size(previews["md"]) == (600, 848)
+    assert _size(previews["sm"]) == (200, 283)
+
+
+def test_downscale_keeps_smaller_images():
+    img = Image.new("RGB", (100, 50))
+
+    assert image.downscale(img, 200) is img
+    assert image.downscale(img, 50).size == (50, 25)
+
+
+@pytest.fixture()
+def pdf_path(tmp_path):
+    """PDF of a white and a black A4 page"""
+    path = tmp_path / "doc.pdf"
+    white = Image.new("RGB", (595, 842), "white")
+    black = Image.new("RGB", (595, 842), "black")
+    white.save(path, "PDF", save_all=True, append_images=[black])
+
+    return path
+
+
+@pytest.mark.parametrize("renderer", [
+    PdfRenderer.PDFIUM,
+    pytest.param(
+        PdfRenderer.PDFTOPPM,
+        marks=pytest.mark.skipif(
+            shutil.which("pdftoppm") is None, reason="needs poppler-utils"
+        ),
+    ),
+])
+def test_render(pdf_path, renderer):
+    if renderer == PdfRenderer.PDFIUM:
+        pytest.importorskip("pypdfium2")
+
+    with image.open_pdf(pdf_path, renderer=renderer) as doc:
+        assert doc.renderer == renderer
+        first = image.render(doc, page_number=1, size_px=300)
+        second = image.render(doc, page_number=2, size_px=300)
+
+    assert first.width == second.width == 300
+    assert abs(first.height - 424) <= 1
+    assert first.convert("L").getpixel((150, 200)) > 250
+    assert second.convert("L").getpixel((150, 200)) < 5
+
+
+def test_render_preview(pdf_path, monkeypatch):
+    pytest.importorskip("pypdfium2")
+    monkeypatch.setattr(image.settings, "pm_pdf_renderer", PdfRenderer.PDFIUM)
+
+    data = image.render_preview(pdf_path, size_px=200, page_number=2)
+
+    width, height = _size(data)
+    assert width == 200
+    assert abs(height - 283) <= 1
@@ -0,0 +1,66 @@
+import sqlite3
+
+import pytest
+
+from s3worker import manifest
+
+
+def _keys() -> set[str]:
+    with manifest.session() as conn:
+        return set(manifest.load(conn))
+
+
+def test_writer_commits_in_batches(media_root):
+    with manifest.writer() as writer:
+        writer.batch_size = 2
+        writer.add("a", 1, 1)
+        assert _keys() == set()
+
+        writer.add("b", 2, 2)
+        # visible to other connections before the writer is closed
+        assert _keys() == {"a", "b"}
+
+        writer.add("c", 3, 3)
+
+    assert _keys() == {"a", "b", "c"}
+
+
+def test_writer_does_not_hold_write_lock(media_root):
+    with manifest.writer() as writer:
+        writer.add("a", 1, 1)
+        writer.flush()
+        writer.add("b", 2, 2)
+
+        # e.g. `manifest.record()` in a worker process; fails right away
+        # with "database is locked" if a write transaction is open
+        other = sqlite3.connect(manifest.get_manifest_path(), timeout=0)
+        other.execute(manifest.INSERT, ("other", 1, 1, None))
+        other.commit()
+        other.close()
+
+    assert _keys() == {"a", "b", "other"}
+
+
+def test_writer_keeps_rows_on_error(media_root):
+    with pytest.raises(RuntimeError):
+        with manifest.writer() as writer:
+            writer.add("a", 1, 1)
+            raise RuntimeError("interrupted")
+
+    assert _keys() == {"a"}
+
+
+def test_writer_disabled(media_root, monkeypatch):
+    monkeypatch.setattr(manifest.settings, "pm_sync_manifest", False)
+
+    with manifest.writer() as writer:
+        assert writer is None
+
+
+def test_writer_not_available(media_root, monkeypatch, tmp_path):
+    monkeypatch.setattr(
+        manifest.settings, "pm_sync_manifest_path", tmp_path / "missing" / "m.sqlite"
+    )
+
+    with manifest.writer() as writer:
+        assert writer is None
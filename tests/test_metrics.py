@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import create_engine, exc, text
+
+from s3worker import metrics
+
+
+class _Recorder:
+    def __init__(self):
+        self.observed = []
+
+    def labels(self, statement):
+        self.statement = statement
+        return self
+
+    def observe(self, amount):
+        self.observed.append(self.statement)
+
+
+def test_instrument_engine_failed_statements(monkeypatch):
+    recorder = _Recorder()
+    monkeypatch.setattr(metrics, "active", True)
+    monkeypatch.setattr(metrics, "DB_QUERY_SECONDS", recorder)
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(exc.OperationalError):
+                conn.execute(text("SELECT * FROM missing"))
+        conn.execute(text("SELECT 1"))
+
+        assert "metrics_started" not in conn.info
+
+    assert recorder.observed == ["SELECT"]
+
+
+def test_no_metrics_outside_worker(tmp_path):
+    env = dict(os.environ, PM_METRICS_PORT="9100", TMPDIR=str(tmp_path))
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    result = subprocess.run(
+        [
+            sys.executable, "-c",
+            "import sys, s3worker.client, s3worker.db.engine; "
+            "print('prometheus_client' in sys.modules)"
+        ],
+        env=env, capture_output=True, text=True, check=True,
+    )
+
+    assert result.stdout.strip() == "False"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_setup_and_teardown(tmp_path):
+    pytest.importorskip("prometheus_client")
+    env = dict(os.environ, PM_METRICS_PORT="9100", TMPDIR=str(tmp_path))
+    env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+    # in a new interpreter: prometheus_client must not be imported yet
+    result = subprocess.run(
+        [
+            sys.executable, "-c",
+            "import os\n"
+            "from s3worker import metrics\n"
+            "metrics.setup()\n"
+            "metrics.TASKS.labels('task', 'SUCCESS').inc()\n"
+            "print(sorted(os.listdir(os.environ['PROMETHEUS_MULTIPROC_DIR'])))\n"
+            "metrics.teardown()"
+        ],
+        env=env, capture_output=True, text=True, check=True,
+    )
+
+    # samples were written to the temporary folder, which is removed
+    assert "counter_" in result.stdout
+    assert list(tmp_path.iterdir()) == []
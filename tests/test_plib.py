@@ -0,0 +1,47 @@
+import pytest
+
+from s3worker import client, plib
+
+
+@pytest.mark.parametrize("rel_path, expected", [
+    ("docvers/ab/cd/abcd1234/doc.pdf", "docvers/ab"),
+    ("thumbnails/jpg/bd/f8/bdf862be/sm.jpg", "thumbnails/jpg/bd"),
+    ("ocr/pages/01/23/0123abcd/page.hocr", "ocr/pages/01"),
+    ("other/folder/file.txt", "other/folder"),
+    ("file.txt", "file.txt"),
+    ("docvers/doc.pdf", "docvers/doc.pdf"),
+    ("docvers/ab", "docvers/ab"),
+    ("thumbnails/jpg/sm.jpg", "thumbnails/jpg/sm.jpg"),
+    ("thumbnails/sm.jpg", "thumbnails/sm.jpg"),
+    ("ocr/page.hocr", "ocr/page.hocr"),
+    ("thumbnails/png/sm.png", "thumbnails/png"),
+])
+def test_shard_prefix(rel_path, expected):
+    assert plib.shard_prefix(rel_path) == expected
+
+
+def test_listing_prefix(monkeypatch):
+    monkeypatch.setattr(client.settings, "pm_prefix", "")
+    assert client._listing_prefix("docvers/ab/cd/abcd/doc.pdf") == "docvers/ab/"
+    assert client._listing_prefix("file.txt") == "file.txt"
+    assert client._listing_prefix("docvers/doc.pdf") == "docvers/doc.pdf"
+
+    monkeypatch.setattr(client.settings, "pm_prefix", "tenant")
+    assert client._listing_prefix("docvers/ab/cd/abcd/doc.pdf") == "tenant/docvers/ab/"
+    assert client._listing_prefix("file.txt") == "tenant/file.txt"
+
+
+@pytest.mark.parametrize("spec, expected", [
+    ("ab", ["ab"]),
+    ("00-03", ["00", "01", "02", "03"]),
+    ("fe-ff", ["fe", "ff"]),
+    ("00-ff", [f"{i:02x}" for i in range(256)]),
+])
+def test_shard_range(spec, expected):
+    assert plib.shard_range(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["", "a", "abc", "0g", "3f-00", "00-", "00-3f-7f"])
+def test_shard_range_invalid(spec):
+    with pytest.raises(ValueError):
+        plib.shard_range(spec)
@@ -0,0 +1,89 @@
+import os
+import uuid
+
+from s3worker import client, manifest, plib
+
+
+def _uuid(shard: str) -> uuid.UUID:
+    """Random UUID in shard folder `shard` e.g. "ab" """
+    return uuid.UUID(shard + uuid.uuid4().hex[2:])
+
+
+def test_pull_downloads_missing_files(put_object, media_root):
+    docver = put_object(plib.docver_path(_uuid("ab"), "doc.pdf"), b"pdf")
+    thumbnail = put_object(plib.thumbnail_path(_uuid("cd")), b"jpg data")
+
+    stats = client.pull(max_workers=2)
+
+    assert stats.files_total == 2
+    assert stats.files_downloaded == 2
+    assert stats.bytes_downloaded == len(b"pdf") + len(b"jpg data")
+    assert plib.rel2abs(docver).read_bytes() == b"pdf"
+    assert plib.rel2abs(thumbnail).read_bytes() == b"jpg data"
+    assert not os.listdir(media_root / ".tmp")
+
+
+def test_pull_sets_mtime_and_records_manifest(s3, media_root, put_object):
+    key = put_object(plib.docver_path(_uuid("ab"), "doc.pdf"), b"pdf")
+    last_modified = s3.head_object(
+        Bucket=client.get_bucket_name(), Key=key
+    )["LastModified"].timestamp()
+
+    client.pull(shards=["ab"], max_workers=2)
+
+    stat = plib.rel2abs(key).stat()
+    assert stat.st_mtime == last_modified
+    with manifest.session() as conn:
+        assert manifest.load(conn) == {key: (3, stat.st_mtime_ns)}
+
+    stats = client.sync(max_workers=2)
+    assert stats.files_skipped == 1
+    assert stats.files_uploaded == 0
+
+
+def test_pull_resumes(put_object, media_root):
+    present = put_object(plib.thumbnail_path(_uuid("ab")), b"jpg")
+    partial = put_object(plib.thumbnail_path(_uuid("cd")), b"jpg data")
+    for rel_path, data in ((present, b"JPG"), (partial, b"jpg")):
+        path = plib.rel2abs(rel_path)
+        path.parent.mkdir(parents=True)
+        path.write_bytes(data)
+
+    stats = client.pull(shards=["ab", "cd"], max_workers=2)
+
+    assert stats.files_present == 1
+    assert stats.files_downloaded == 1
+    # same size counts as present, content is not compared
+    assert plib.rel2abs(present).read_bytes() == b"JPG"
+    assert plib.rel2abs(partial).read_bytes() == b"jpg data"
+
+
+def test_pull_byte_budget(put_object, media_root):
+    keys = [
+        put_object(plib.thumbnail_path(_uuid(shard)), b"x" * 10)
+        for shard in ("01", "02", "03")
+    ]
+
+    stats = client.pull(
+        shards=plib.shard_range("01-03"), max_workers=2, max_bytes=25
+    )
+
+    assert stats.files_downloaded == 2
+    assert stats.files_over_budget == 1
+    assert stats.bytes_downloaded == 20
+    # objects are pulled in order of their keys
+    assert [plib.rel2abs(key).exists() for key in keys] == [True, True, False]
+
+
+def test_pull_subtrees_and_shards(put_object, media_root):
+    wanted = put_object(plib.docver_path(_uuid("ab"), "doc.pdf"), b"pdf")
+    put_object(plib.docver_path(_uuid("cd"), "doc.pdf"), b"pdf")
+    put_object(plib.thumbnail_path(_uuid("ab")), b"jpg")
+
+    stats = client.pull(
+        subtrees=["docvers"], shards=plib.shard_range("a0-bf"), max_workers=2
+    )
+
+    assert stats.files_total == 1
+    assert stats.files_downloaded == 1
+    assert plib.rel2abs(wanted).exists()
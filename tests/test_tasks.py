@@ -0,0 +1,128 @@
+import io
+
+import pytest
+from PIL import Image
+
+from s3worker import client, generate, image, plib, tasks
+from s3worker.config import PdfRenderer
+from s3worker.types import UploadStatus
+
+
+def _stub_add_doc_vers(monkeypatch, statuses):
+    """Stubs `client.add_doc_vers`: returns `statuses[ver]` of each ID,
+    `statuses[ver]` may be a list of statuses of consecutive calls;
+    returns list of IDs of every call"""
+    calls = []
+
+    def _add_doc_vers(doc_ver_ids):
+        calls.append(list(doc_ver_ids))
+        result = {}
+        for ver in doc_ver_ids:
+            status = statuses[ver]
+            if isinstance(status, list):
+                status = status.pop(0) if len(status) > 1 else status[0]
+            result[ver] = status
+        return result
+
+    monkeypatch.setattr(client, "add_doc_vers", _add_doc_vers)
+
+    return calls
+
+
+def test_add_doc_vers_task_returns_status_per_id(monkeypatch):
+    calls = _stub_add_doc_vers(monkeypatch, {
+        "a": UploadStatus.uploaded,
+        "b": UploadStatus.missing,
+    })
+
+    result = tasks.add_doc_vers_task.apply(args=(["a", "b"],))
+
+    assert result.get() == {"a": "uploaded", "b": "missing"}
+    assert calls == [["a", "b"]]
+
+
+def test_add_doc_vers_task_retries_only_failed_ids(monkeypatch):
+    calls = _stub_add_doc_vers(monkeypatch, {
+        "a": UploadStatus.uploaded,
+        "b": [UploadStatus.failed, UploadStatus.uploaded],
+        "c": UploadStatus.missing,
+        "d": [UploadStatus.failed, UploadStatus.failed, UploadStatus.uploaded],
+    })
+
+    result = tasks.add_doc_vers_task.apply(args=(["a", "b", "c", "d"],))
+
+    # eagerly applied retries return result of the last one
+    assert result.get() == {
+        "a": "uploaded", "b": "uploaded", "c": "missing", "d": "uploaded"
+    }
+    assert calls == [["a", "b", "c", "d"], ["b", "d"], ["d"]]
+
+
+def test_add_doc_vers_task_gives_up_after_max_retries(monkeypatch):
+    calls = _stub_add_doc_vers(monkeypatch, {
+        "a": UploadStatus.uploaded,
+        "b": UploadStatus.failed,
+    })
+
+    result = tasks.add_doc_vers_task.apply(args=(["a", "b"],))
+
+    assert result.get() == {"a": "uploaded", "b": "failed"}
+    assert calls == [["a", "b"]] + [["b"]] * tasks.add_doc_vers_task.max_retries
+
+
+@pytest.fixture()
+def doc_ver(db_session, make_page, s3, monkeypatch):
+    """Document version of 3 pages, its PDF in the bucket"""
+    monkeypatch.setattr(image.settings, "pm_pdf_renderer", PdfRenderer.PDFIUM)
+    doc_ver = make_page().document_version
+    doc_ver.file_name = "doc.pdf"
+    db_session.commit()
+
+    pdf = io.BytesIO()
+    pages = [Image.new("RGB", (595, 842), "white") for _ in range(3)]
+    pages[0].save(pdf, "PDF", save_all=True, append_images=pages[1:])
+    s3.put_object(
+        Bucket=client.get_bucket_name(),
+        Key=str(plib.docver_path(doc_ver.id, "doc.pdf")),
+        Body=pdf.getvalue(),
+    )
+
+    return doc_ver
+
+
+def _preview_keys(page_ids) -> set[str]:
+    return {
+        str(plib.thumbnail_path(page_id, size=size))
+        for page_id in page_ids
+        for size in tasks.IMAGE_SIZES
+    }
+
+
+def test_generate_preview_task(doc_ver, monkeypatch):
+    pytest.importorskip("pypdfium2")
+    monkeypatch.setattr(tasks.settings, "pm_upload_workers", 6)
+    chunks = []
+    store_images = generate.store_images
+
+    def _store_images(images):
+        chunks.append(len(images))
+        return store_images(images)
+
+    monkeypatch.setattr(generate, "store_images", _store_images)
+
+    tasks.generate_preview_task.apply(args=(str(doc_ver.id),)).get()
+
+    # previews are uploaded while pages are rendered (4 sizes per page)
+    assert chunks == [8, 4]
+    uploaded = set(client.list_remote_objects(["thumbnails/"], max_workers=1))
+    assert uploaded == _preview_keys(page.id for page in doc_ver.pages)
+
+
+def test_generate_page_image_task(doc_ver):
+    pytest.importorskip("pypdfium2")
+    page = doc_ver.pages[1]
+
+    tasks.generate_page_image_task.apply(args=([str(page.id)],)).get()
+
+    uploaded = set(client.list_remote_objects(["thumbnails/"], max_workers=1))
+    assert uploaded == _preview_keys([page.id])
@@ -0,0 +1,72 @@
+import hashlib
+import threading
+import time
+
+import pytest
+
+from s3worker import utils
+
+
+def test_bounded_imap_yields_every_item():
+    items = list(range(50))
+
+    result = {
+        item: future.result()
+        for item, future in utils.bounded_imap(lambda x: x * 2, items, max_workers=4)
+    }
+
+    assert result == {item: item * 2 for item in items}
+
+
+def test_bounded_imap_limits_items_in_flight():
+    consumed = 0
+
+    def _items():
+        nonlocal consumed
+        for item in range(100):
+            consumed += 1
+            yield item
+
+    results = utils.bounded_imap(lambda x: x, _items(), max_workers=2)
+    next(results)
+
+    # at most 2 * max_workers items are submitted before the first result
+    assert consumed <= 4
+
+
+def test_bounded_imap_runs_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+
+    # deadlocks (BrokenBarrierError) unless 3 calls run at the same time
+    results = utils.bounded_imap(
+        lambda x: barrier.wait(), range(3), max_workers=3
+    )
+
+    assert len([future.result() for _, future in results]) == 3
+
+
+def test_bounded_imap_failure_of_one_item():
+    def _func(x):
+        if x == 3:
+            raise ValueError(x)
+        time.sleep(0.001)
+        return x
+
+    results = dict(utils.bounded_imap(_func, range(5), max_workers=2))
+
+    with pytest.raises(ValueError):
+        results[3].result()
+    assert [results[i].result() for i in (0, 1, 2, 4)] == [0, 1, 2, 4]
+
+
+def test_file_etag(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"abcdefghij")
+
+    assert utils.file_etag(path) == hashlib.md5(b"abcdefghij").hexdigest()
+
+    parts = [b"abcd", b"efgh", b"ij"]
+    digests = b"".join(hashlib.md5(part).digest() for part in parts)
+    assert utils.file_etag(path, part_size=4) == (
+        f"{hashlib.md5(digests).hexdigest()}-3"
+    )